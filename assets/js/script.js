@@ -5,6 +5,13 @@ let cart = [];
 let allProducts = [];
 let filteredProducts = [];
 const DEFAULT_VISIBLE_COUNT = 15;
+const PAGE_SIZE = 24;
+// true once /api/medicines answered; filtering then happens server-side, page by page
+let serverCatalog = false;
+let catalogQuery = null;
+let nextCursor = null;
+let catalogRequestSeq = 0;
+let searchDebounce = null;
 
 // DOM elements
 const authButtons = document.getElementById('authButtons');
@@ -52,6 +59,20 @@ document.addEventListener('DOMContentLoaded', async function() {
     }
 });
 
+// Session token helpers
+function authHeaders(extra = {}) {
+    const token = localStorage.getItem('genricycle_token');
+    return token ? { ...extra, Authorization: `Bearer ${token}` } : extra;
+}
+
+function clearSession() {
+    localStorage.removeItem('genricycle_user');
+    localStorage.removeItem('genricycle_token');
+    localStorage.removeItem('userData');
+    currentUser = null;
+    isLoggedIn = false;
+}
+
 // Check login status
 async function checkLoginStatus() {
     const savedUserRaw = localStorage.getItem('genricycle_user') || localStorage.getItem('userData');
@@ -59,7 +80,22 @@ async function checkLoginStatus() {
     if (savedUserRaw) {
         try { savedUser = JSON.parse(savedUserRaw); } catch(e) { savedUser = null; }
     }
-    if (savedUser && savedUser.email) {
+    if (savedUser && localStorage.getItem('genricycle_token')) {
+        // Token is verified by the server without a database lookup
+        try {
+            const resp = await fetch('/api/auth/session', { headers: authHeaders() });
+            if (resp.status === 401) {
+                clearSession();
+                showNotification('Your session has expired. Please log in again.', 'info');
+            } else {
+                currentUser = savedUser;
+                isLoggedIn = true;
+            }
+        } catch (err) {
+            currentUser = savedUser;
+            isLoggedIn = true;
+        }
+    } else if (savedUser && savedUser.email) {
         try {
             const resp = await fetch(`/api/user?email=${encodeURIComponent(savedUser.email)}`);
             if (resp.status === 200) {
@@ -102,14 +138,11 @@ async function deleteAccount() {
     try {
         const resp = await fetch('/api/user', {
             method: 'DELETE',
-            headers: { 'Content-Type': 'application/json' },
+            headers: authHeaders({ 'Content-Type': 'application/json' }),
             body: JSON.stringify({ email: currentUser.email })
         });
         if (resp.status === 200) {
-            localStorage.removeItem('genricycle_user');
-            localStorage.removeItem('userData');
-            isLoggedIn = false;
-            currentUser = null;
+            clearSession();
             updateUI();
             showNotification('Your account has been deleted.', 'success');
             // Navigate home
@@ -157,33 +190,46 @@ function initializeSearch() {
             }
         });
         
-        // Real-time search as user types
+        // Real-time search as user types (debounced: each keystroke is a server query)
         searchInput.addEventListener('input', function() {
             const query = this.value.toLowerCase();
-            applyFilters(query);
+            clearTimeout(searchDebounce);
+            searchDebounce = setTimeout(() => applyFilters(query), 200);
         });
     }
 }
 
+function mapMedicine(m) {
+    return {
+        id: m.slug || String(m.id),
+        name: m.name,
+        description: m.description || '',
+        price: Number(m.price) || 0,
+        originalPrice: Math.round((Number(m.price) || 0) * 1.25) || (Number(m.price) || 0),
+        rating: 4.5,
+        reviews: 120,
+        category: m.category_name || 'General',
+        brand: m.brand || 'Generic',
+        image: m.image_url || 'https://via.placeholder.com/400x400?text=No+Image'
+    };
+}
+
+async function fetchMedicinesPage(params, cursor) {
+    const qs = new URLSearchParams(params);
+    if (cursor) qs.set('cursor', cursor);
+    const res = await fetch(`/api/medicines?${qs.toString()}`);
+    if (!res.ok) throw new Error(`medicines request failed: ${res.status}`);
+    const data = await res.json();
+    return { items: (data.items || []).map(mapMedicine), nextCursor: data.next_cursor || null };
+}
+
 // Products data initialization
 async function initializeProducts() {
     try {
-        const res = await fetch('/api/medicines');
-        const data = await res.json();
-        let mapped = Array.isArray(data) ? data.map(m => ({
-            id: m.slug || String(m.id),
-            name: m.name,
-            description: m.description || '',
-            price: Number(m.price) || 0,
-            originalPrice: Math.round((Number(m.price) || 0) * 1.25) || (Number(m.price) || 0),
-            rating: 4.5,
-            reviews: 120,
-            category: m.category_name || 'General',
-            brand: m.brand || 'Generic',
-            image: m.image_url || 'https://via.placeholder.com/400x400?text=No+Image'
-        })) : [];
-        if (!mapped.length) throw new Error('Empty medicines list');
-        allProducts = mapped;
+        const page = await fetchMedicinesPage({ limit: DEFAULT_VISIBLE_COUNT });
+        if (!page.items.length) throw new Error('Empty medicines list');
+        allProducts = page.items;
+        serverCatalog = true;
     } catch (e) {
         console.warn('Falling back to built-in product list due to API error:', e);
         // Fallback default featured medicines
@@ -198,7 +244,7 @@ async function initializeProducts() {
         ];
     }
     filteredProducts = getDefaultProducts();
-    populateBrandOptions();
+    await populateBrandOptions();
     displayProducts();
     updateSearchResultsInfo();
 }
@@ -233,13 +279,24 @@ async function initializeCategories() {
     }
 }
 
-function populateBrandOptions() {
+async function populateBrandOptions() {
     const brandSelect = document.getElementById('brandFilter');
     if (!brandSelect) return;
-    const brands = Array.from(new Set(allProducts.map(p => p.brand))).filter(Boolean).sort();
+    let brands = null;
+    if (serverCatalog) {
+        try {
+            const res = await fetch('/api/medicines/brands');
+            if (res.ok) brands = await res.json();
+        } catch (e) {
+            brands = null;
+        }
+    }
+    if (!Array.isArray(brands)) {
+        brands = Array.from(new Set(allProducts.map(p => p.brand))).filter(Boolean).sort();
+    }
     brands.forEach(brand => {
         const opt = document.createElement('option');
-        opt.value = brand.toLowerCase();
+        opt.value = brand;
         opt.textContent = brand;
         brandSelect.appendChild(opt);
     });
@@ -277,6 +334,29 @@ function applyFilters(searchQuery = '') {
         }
     }
 
+    if (serverCatalog) {
+        if (!query && !hasActiveFilters) {
+            catalogQuery = null;
+            nextCursor = null;
+            filteredProducts = getDefaultProducts();
+            displayProducts();
+            updateSearchResultsInfo();
+            return;
+        }
+        if (query) {
+            searchCatalog(query, brandValue, categoryValue, priceValue, ratingValue);
+            return;
+        }
+        const params = { limit: PAGE_SIZE };
+        if (brandValue) params.brand = brandValue;
+        if (categoryValue) params.category = categoryValue;
+        if (priceValue === 'low-high') params.sort = 'price_asc';
+        else if (priceValue === 'high-low') params.sort = 'price_desc';
+        catalogQuery = params;
+        loadCatalogPage(false);
+        return;
+    }
+
     // 1) Search filter
     if (query) {
         filtered = filtered.filter(product =>
@@ -294,7 +374,7 @@ function applyFilters(searchQuery = '') {
 
     // 3) Brand filter
     if (brandValue) {
-        filtered = filtered.filter(product => (product.brand || '').toLowerCase() === brandValue);
+        filtered = filtered.filter(product => (product.brand || '') === brandValue);
     }
 
     // 3b) Category filter
@@ -325,6 +405,74 @@ function applyFilters(searchQuery = '') {
     updateSearchResultsInfo();
 }
 
+// Fetch the first (append=false) or next page of the current server-side query
+async function loadCatalogPage(append) {
+    const seq = ++catalogRequestSeq;
+    const ratingValue = document.getElementById('ratingFilter') ? document.getElementById('ratingFilter').value : '';
+    try {
+        const page = await fetchMedicinesPage(catalogQuery, append ? nextCursor : null);
+        if (seq !== catalogRequestSeq) return; // a newer query superseded this one
+        let items = page.items;
+        if (ratingValue === 'high-rating') {
+            items = items.filter(product => product.rating >= 4.5);
+        }
+        filteredProducts = append ? filteredProducts.concat(items) : items;
+        nextCursor = page.nextCursor;
+    } catch (e) {
+        if (seq !== catalogRequestSeq) return;
+        console.warn('Catalog query failed:', e);
+        if (!append) filteredProducts = [];
+        nextCursor = null;
+    }
+    displayProducts();
+    updateSearchResultsInfo();
+}
+
+// Ranked, typo-tolerant search (one page of best matches; price sort applies to it)
+async function searchCatalog(query, brandValue, categoryValue, priceValue, ratingValue) {
+    const seq = ++catalogRequestSeq;
+    catalogQuery = null;
+    nextCursor = null;
+    const qs = new URLSearchParams({ q: query, limit: PAGE_SIZE });
+    if (brandValue) qs.set('brand', brandValue);
+    if (categoryValue) qs.set('category', categoryValue);
+    let items = [];
+    try {
+        const res = await fetch(`/api/medicines/search?${qs.toString()}`);
+        if (!res.ok) throw new Error(`search request failed: ${res.status}`);
+        const data = await res.json();
+        items = (data.items || []).map(mapMedicine);
+    } catch (e) {
+        console.warn('Search failed:', e);
+    }
+    if (seq !== catalogRequestSeq) return; // a newer query superseded this one
+    if (ratingValue === 'high-rating') {
+        items = items.filter(product => product.rating >= 4.5);
+    }
+    if (priceValue === 'low-high') items.sort((a, b) => a.price - b.price);
+    else if (priceValue === 'high-low') items.sort((a, b) => b.price - a.price);
+    filteredProducts = items;
+    displayProducts();
+    updateSearchResultsInfo();
+}
+
+function renderLoadMore() {
+    if (!productsGrid) return;
+    let btn = document.getElementById('loadMoreProducts');
+    if (!serverCatalog || !catalogQuery || !nextCursor) {
+        if (btn) btn.remove();
+        return;
+    }
+    if (!btn) {
+        btn = document.createElement('button');
+        btn.id = 'loadMoreProducts';
+        btn.className = 'btn btn-primary';
+        btn.textContent = 'Load more';
+        btn.addEventListener('click', () => loadCatalogPage(true));
+        productsGrid.insertAdjacentElement('afterend', btn);
+    }
+}
+
 function displayProducts() {
     if (!productsGrid) return;
     
@@ -334,6 +482,7 @@ function displayProducts() {
         const productCard = createProductCard(product);
         productsGrid.appendChild(productCard);
     });
+    renderLoadMore();
 }
 
 function createProductCard(product) {
@@ -434,6 +583,9 @@ function clearFilters() {
     if (document.getElementById('brandFilter')) document.getElementById('brandFilter').value = '';
     if (document.getElementById('offerSort')) document.getElementById('offerSort').value = '';
     if (filtersSidebar) filtersSidebar.style.display = 'none';
+    catalogQuery = null;
+    nextCursor = null;
+    catalogRequestSeq++;
     filteredProducts = getDefaultProducts();
     displayProducts();
     updateSearchResultsInfo();
@@ -575,6 +727,7 @@ if (loginModalEl) {
                     currentUser = data.user;
                     isLoggedIn = true;
                     localStorage.setItem('genricycle_user', JSON.stringify(currentUser));
+                    if (data.token) localStorage.setItem('genricycle_token', data.token);
                     closeModal('loginModal');
                     updateUI();
                     if (emailEl) emailEl.value = '';
@@ -628,6 +781,7 @@ if (signupModalEl) {
                     currentUser = data.user;
                     isLoggedIn = true;
                     localStorage.setItem('genricycle_user', JSON.stringify(currentUser));
+                    if (data.token) localStorage.setItem('genricycle_token', data.token);
                     closeModal('signupModal');
                     updateUI();
                     document.getElementById('signupName').value = '';
@@ -649,9 +803,10 @@ if (signupModalEl) {
 
 // Logout functionality
 function logout() {
-    isLoggedIn = false;
-    currentUser = null;
-    localStorage.removeItem('genricycle_user');
+    if (localStorage.getItem('genricycle_token')) {
+        fetch('/api/auth/logout', { method: 'POST', headers: authHeaders() }).catch(() => {});
+    }
+    clearSession();
     updateUI();
     closeDropdown();
     showNotification('Logged out successfully!', 'info');
@@ -1,8 +1,31 @@
+import base64
+import bisect
+import csv
+import functools
+import hashlib
+import heapq
+import hmac
+import io
+import itertools
+import json
+import mimetypes
+import mmap
 import os
+import random
+import re
+import secrets
 import sqlite3
-from datetime import datetime
-from flask import Flask, jsonify, send_from_directory, g
-from werkzeug.security import generate_password_hash, check_password_hash
+import struct
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+import click
+from flask import Flask, abort, jsonify, request, send_file, g
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.security import generate_password_hash, check_password_hash, safe_join
 
 BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
  
@@ -18,66 +41,1071 @@ def _mysql_cfg():
     db = (os.environ.get('DB_NAME') or os.environ.get('MYSQL_DB') or 'genricycle')
     return {'host': host, 'port': port, 'user': user, 'password': password, 'db': db}
 
+def _env_int(name, default):
+    try:
+        return int(os.environ.get(name) or default)
+    except ValueError:
+        return default
+
+def _env_float(name, default):
+    try:
+        return float(os.environ.get(name) or default)
+    except ValueError:
+        return default
+
+DB_PATH = os.environ.get('DB_PATH') or os.path.join(BASE_DIR, 'storage', 'genricycle.db')
+
+def _mysql_connect():
+    import pymysql
+    cfg = _mysql_cfg()
+    try:
+        return pymysql.connect(host=cfg['host'], port=cfg['port'], user=cfg['user'], password=cfg['password'], database=cfg['db'], cursorclass=pymysql.cursors.DictCursor, autocommit=False)
+    except pymysql.err.OperationalError:
+        tmp = pymysql.connect(host=cfg['host'], port=cfg['port'], user=cfg['user'], password=cfg['password'], cursorclass=pymysql.cursors.DictCursor, autocommit=True)
+        cur = tmp.cursor()
+        cur.execute(f"CREATE DATABASE IF NOT EXISTS `{cfg['db']}` CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci")
+        tmp.close()
+        return pymysql.connect(host=cfg['host'], port=cfg['port'], user=cfg['user'], password=cfg['password'], database=cfg['db'], cursorclass=pymysql.cursors.DictCursor, autocommit=False)
+
+SQLITE_BUSY_TIMEOUT_MS = _env_int('SQLITE_BUSY_TIMEOUT_MS', 5000)
+_sqlite_writer = threading.Lock()  # see DBProxy.begin_write
+SQLITE_PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', os.environ.get('SQLITE_SYNCHRONOUS') or 'NORMAL'),
+    ('foreign_keys', 'ON'),
+    ('busy_timeout', SQLITE_BUSY_TIMEOUT_MS),
+    ('cache_size', -_env_int('SQLITE_CACHE_SIZE_KB', 64 * 1024)),
+    ('mmap_size', _env_int('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+    ('temp_store', 'MEMORY'),
+)
+
+def _sqlite_connect():
+    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+    # check_same_thread=False: pooled connections move between request threads, but
+    # the pool guarantees only one thread uses a connection at a time.
+    conn = sqlite3.connect(DB_PATH, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000.0,
+                           check_same_thread=False, cached_statements=_env_int('SQLITE_STMT_CACHE', 256))
+    conn.row_factory = sqlite3.Row
+    for name, value in SQLITE_PRAGMAS:
+        conn.execute(f'PRAGMA {name} = {value}')
+    return conn
+
+def _mysql_ping(conn):
+    conn.ping(reconnect=False)
+
+def _sqlite_ping(conn):
+    conn.execute('SELECT 1').fetchone()
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    # Bounded pool: keeps at least min_size connections open, never more than max_size,
+    # pings connections that sat idle longer than ping_after before handing them out and
+    # closes surplus connections idle for longer than idle_timeout. With thread_affinity
+    # a thread gets back the connection it last released when that one is still idle,
+    # which keeps SQLite's per-connection page and statement caches warm. When the pool
+    # is exhausted, waiters are served first come, first served: a released connection
+    # is handed to the oldest waiter, so a thread that just released one can't take it
+    # straight back and starve the others.
+    def __init__(self, connect, ping=None, min_size=1, max_size=10, timeout=5.0, idle_timeout=300.0, ping_after=30.0, thread_affinity=False):
+        self._connect = connect
+        self._ping = ping
+        self.min_size = max(0, min_size)
+        self.max_size = max(1, max_size, self.min_size)
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.ping_after = ping_after
+        self.thread_affinity = thread_affinity
+        self._local = threading.local()
+        self._idle = deque()
+        self._waiters = deque()  # [Event, handed]: handed is an idle entry or 'create'
+        self._size = 0
+        self._cond = threading.Condition()
+        self._stats = {
+            'checkouts': 0, 'created': 0, 'closed': 0, 'evicted_idle': 0, 'health_failures': 0,
+            'waits': 0, 'timeouts': 0, 'wait_time_total_ms': 0.0, 'wait_time_max_ms': 0.0,
+            'affinity_hits': 0,
+        }
+
+    def fill(self):
+        while True:
+            with self._cond:
+                if self._size >= self.min_size:
+                    return
+                self._size += 1
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                raise
+            with self._cond:
+                self._stats['created'] += 1
+                self._put_idle(conn)
+
+    def acquire(self):
+        start = time.monotonic()
+        deadline = start + self.timeout
+        waited = False
+        while True:
+            conn = None
+            idle_since = None
+            create = False
+            waiter = None
+            with self._cond:
+                self._evict_idle()
+                if self._waiters or (not self._idle and self._size >= self.max_size):
+                    waiter = [threading.Event(), None]
+                    self._waiters.append(waiter)
+                elif self._idle:
+                    conn, idle_since = self._take_idle()
+                else:
+                    self._size += 1
+                    create = True
+            if waiter is not None:
+                waited = True
+                waiter[0].wait(max(0.0, deadline - time.monotonic()))
+                with self._cond:
+                    if waiter[1] is None:
+                        self._waiters.remove(waiter)
+                        self._stats['timeouts'] += 1
+                        raise PoolTimeout(f'no database connection available within {self.timeout}s (max_size={self.max_size})')
+                if waiter[1] == 'create':
+                    create = True
+                else:
+                    conn, idle_since = waiter[1]
+            if create:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._wake_creator()
+                    raise
+                with self._cond:
+                    self._stats['created'] += 1
+            elif self._ping and time.monotonic() - idle_since > self.ping_after:
+                try:
+                    self._ping(conn)
+                except Exception:
+                    with self._cond:
+                        self._stats['health_failures'] += 1
+                    self.discard(conn)
+                    continue
+            with self._cond:
+                self._stats['checkouts'] += 1
+                if waited:
+                    wait_ms = (time.monotonic() - start) * 1000.0
+                    self._stats['waits'] += 1
+                    self._stats['wait_time_total_ms'] += wait_ms
+                    self._stats['wait_time_max_ms'] = max(self._stats['wait_time_max_ms'], wait_ms)
+            return conn
+
+    def _take_idle(self):
+        # caller holds self._cond
+        if self.thread_affinity:
+            mine = getattr(self._local, 'conn', None)
+            for i, entry in enumerate(self._idle):
+                if entry[0] is mine:
+                    del self._idle[i]
+                    self._stats['affinity_hits'] += 1
+                    return entry
+        return self._idle.pop()
+
+    def release(self, conn):
+        try:
+            conn.rollback()
+        except Exception:
+            self.discard(conn)
+            return
+        if self.thread_affinity:
+            self._local.conn = conn
+        with self._cond:
+            self._put_idle(conn)
+
+    def discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._size -= 1
+            self._stats['closed'] += 1
+            self._wake_creator()
+
+    def _put_idle(self, conn):
+        # caller holds self._cond: hand the connection to the oldest waiter, if any
+        if self._waiters:
+            waiter = self._waiters.popleft()
+            waiter[1] = (conn, time.monotonic())
+            waiter[0].set()
+        else:
+            self._idle.append((conn, time.monotonic()))
+
+    def _wake_creator(self):
+        # caller holds self._cond: a slot came free, let the oldest waiter open a connection
+        if self._waiters and self._size < self.max_size:
+            self._size += 1
+            waiter = self._waiters.popleft()
+            waiter[1] = 'create'
+            waiter[0].set()
+
+    def _evict_idle(self):
+        # caller holds self._cond; oldest idle connections sit at the left end
+        now = time.monotonic()
+        while self._idle and self._size > self.min_size and now - self._idle[0][1] > self.idle_timeout:
+            conn, _ = self._idle.popleft()
+            self._size -= 1
+            self._stats['closed'] += 1
+            self._stats['evicted_idle'] += 1
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def close(self):
+        with self._cond:
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+            self._stats['closed'] += len(idle)
+        for conn, _ in idle:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def stats(self):
+        with self._cond:
+            out = dict(self._stats)
+            out.update({
+                'size': self._size, 'idle': len(self._idle), 'in_use': self._size - len(self._idle),
+                'min_size': self.min_size, 'max_size': self.max_size,
+            })
+        out['wait_time_avg_ms'] = (out['wait_time_total_ms'] / out['waits']) if out['waits'] else 0.0
+        return out
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                eng = _db_engine()
+                pool = ConnectionPool(
+                    _sqlite_connect if eng == 'sqlite' else _mysql_connect,
+                    ping=_sqlite_ping if eng == 'sqlite' else _mysql_ping,
+                    min_size=_env_int('DB_POOL_MIN', 1),
+                    max_size=_env_int('DB_POOL_MAX', 10),
+                    timeout=_env_float('DB_POOL_TIMEOUT', 5.0),
+                    idle_timeout=_env_float('DB_POOL_IDLE_TIMEOUT', 300.0),
+                    ping_after=_env_float('DB_POOL_PING_AFTER', 30.0),
+                    thread_affinity=(eng == 'sqlite'),
+                )
+                pool.fill()
+                _pool = pool
+    return _pool
+
+
+DB_REPLICA_MAX_LAG = _env_float('DB_REPLICA_MAX_LAG', 5.0)
+DB_REPLICA_CHECK_INTERVAL = _env_float('DB_REPLICA_CHECK_INTERVAL', 2.0)
+# after a client writes, its reads stay on the primary until every replica still in
+# rotation must have applied the write
+REPLICA_STICKY_SECONDS = DB_REPLICA_MAX_LAG + DB_REPLICA_CHECK_INTERVAL
+READ_PRIMARY_COOKIE = 'read_primary_until'
+
+def _replica_cfgs():
+    # DB_REPLICAS=host[:port][=weight],... (MySQL); user, password and database as for the primary
+    primary = _mysql_cfg()
+    out = []
+    for item in (os.environ.get('DB_REPLICAS') or '').split(','):
+        addr, _, weight = item.strip().partition('=')
+        if not addr:
+            continue
+        host, _, port = addr.partition(':')
+        out.append((addr, dict(primary, host=host, port=int(port or 3306)), float(weight or 1)))
+    return out
+
+def _mysql_replica_connect(cfg, timeout=10):
+    import pymysql
+    return pymysql.connect(host=cfg['host'], port=cfg['port'], user=cfg['user'], password=cfg['password'], database=cfg['db'],
+                           cursorclass=pymysql.cursors.DictCursor, autocommit=False, connect_timeout=timeout,
+                           read_timeout=timeout, init_command='SET SESSION TRANSACTION READ ONLY')
+
+def _mysql_replica_lag(replica):
+    # seconds the replica's applier is behind its source; None when replication is not running
+    import pymysql
+    conn = _mysql_replica_connect(replica.cfg, timeout=max(1, int(DB_REPLICA_CHECK_INTERVAL)))
+    try:
+        cur = conn.cursor()
+        try:
+            cur.execute('SHOW REPLICA STATUS')
+        except pymysql.err.ProgrammingError:  # before MySQL 8.0.22
+            cur.execute('SHOW SLAVE STATUS')
+        row = cur.fetchone()
+    finally:
+        conn.close()
+    lag = row.get('Seconds_Behind_Source', row.get('Seconds_Behind_Master')) if row else None
+    return None if lag is None else float(lag)
+
+
+class Replica:
+    # One read replica: its own connection pool and what the last health check saw
+    # (lag is None while it is down, not replicating or not yet checked).
+    def __init__(self, name, cfg, weight, pool):
+        self.name = name
+        self.cfg = cfg
+        self.weight = weight
+        self.pool = pool
+        self.lag = None
+        self.error = 'not checked yet'
+        self.checked_at = None
+
+    def fail(self, error):
+        # a checkout failed: out of rotation until the next check passes
+        self.lag, self.error = None, str(error) or type(error).__name__
+
+
+class ReplicaSet:
+    # pick() returns a replica for a read, at random in proportion to weight among those
+    # whose last check succeeded with lag <= max_lag, or None to read from the primary.
+    # Checks run every `interval` seconds on a short-lived thread that pick() starts, so
+    # no request waits for one; probe(replica) returns the lag or None, or raises.
+    def __init__(self, replicas, probe, max_lag=5.0, interval=2.0):
+        self.replicas = replicas
+        self.max_lag = max_lag
+        self.interval = interval
+        self._probe = probe
+        self._lock = threading.Lock()
+        self._checking = False
+        self._next_check = 0.0
+
+    def pick(self):
+        with self._lock:
+            start = not self._checking and time.monotonic() >= self._next_check
+            if start:
+                self._checking = True
+        if start:
+            threading.Thread(target=self.check, name='replica-check', daemon=True).start()
+        live = [r for r in self.replicas if r.lag is not None and r.lag <= self.max_lag]
+        if len(live) < 2:
+            return live[0] if live else None
+        return random.choices(live, [r.weight for r in live])[0]
+
+    def check(self):
+        try:
+            for r in self.replicas:
+                was_live = r.lag is not None and r.lag <= self.max_lag
+                try:
+                    lag = self._probe(r)
+                    error = None if lag is not None else 'replication is not running'
+                except Exception as e:
+                    lag, error = None, str(e) or type(e).__name__
+                if lag is not None and lag > self.max_lag:
+                    error = f'{lag:.0f}s behind the primary'
+                r.lag, r.error, r.checked_at = lag, error, time.time()
+                if was_live != (error is None):
+                    app.logger.warning('replica %s %s', r.name, 'in rotation' if error is None else f'out of rotation: {error}')
+        finally:
+            with self._lock:
+                self._checking = False
+                self._next_check = time.monotonic() + self.interval
+
+    def stats(self):
+        return [{'name': r.name, 'weight': r.weight, 'lag_seconds': r.lag, 'in_rotation': r.lag is not None and r.lag <= self.max_lag,
+                 'error': r.error, 'checked_at': r.checked_at, 'pool': r.pool.stats()} for r in self.replicas]
+
+
+_replicas = None
+_replicas_loaded = False
+
+def get_replicas():
+    # the ReplicaSet from DB_REPLICAS, or None (no replicas, or SQLite)
+    global _replicas, _replicas_loaded
+    if not _replicas_loaded:
+        with _pool_lock:
+            if not _replicas_loaded:
+                cfgs = _replica_cfgs()
+                if cfgs and _db_engine() == 'sqlite':
+                    app.logger.warning('DB_REPLICAS is ignored with DB_ENGINE=sqlite')
+                elif cfgs:
+                    _replicas = ReplicaSet(
+                        [Replica(name, cfg, weight, ConnectionPool(
+                            functools.partial(_mysql_replica_connect, cfg), ping=_mysql_ping,
+                            min_size=0, max_size=_env_int('DB_POOL_MAX', 10), timeout=_env_float('DB_POOL_TIMEOUT', 5.0),
+                            idle_timeout=_env_float('DB_POOL_IDLE_TIMEOUT', 300.0), ping_after=_env_float('DB_POOL_PING_AFTER', 30.0)))
+                         for name, cfg, weight in cfgs],
+                        _mysql_replica_lag, max_lag=DB_REPLICA_MAX_LAG, interval=DB_REPLICA_CHECK_INTERVAL)
+                _replicas_loaded = True
+    return _replicas
+
+def read_primary_until(cookies):
+    # epoch seconds until which this client's reads must see its own writes
+    try:
+        return float(cookies.get(READ_PRIMARY_COOKIE) or 0)
+    except ValueError:
+        return 0.0
+
+def route_read(primary_until=0.0):
+    # the replica a read-only request should use, or None for the primary
+    replicas = get_replicas()
+    if replicas is None:
+        return None
+    if primary_until > time.time():
+        reason = 'recent_write'
+    else:
+        replica = replicas.pick()
+        if replica is not None:
+            metrics.inc('genricycle_db_replica_reads_total', (('replica', replica.name),))
+            return replica
+        reason = 'no_replica'
+    metrics.inc('genricycle_db_primary_reads_total', (('reason', reason),))
+    return None
+
+
+_WRITE_TARGET = re.compile(r'^\s*(?:INSERT(?:\s+OR\s+\w+)?(?:\s+IGNORE)?\s+INTO|REPLACE\s+INTO|UPDATE|DELETE\s+FROM)\s+`?(\w+)', re.I)
+# UPDATEs that change nothing but medicines.stock (checkout, restocking) count as writes
+# to 'medicine_stock', so they only evict the cached responses that include stock
+_STOCK_ONLY_UPDATE = re.compile(r'^\s*UPDATE\s+`?medicines`?\s+SET\s+`?stock`?\s*=[^,]*?\sWHERE\s', re.I)
+_table_listeners = []
+
+def written_table(sql):
+    # the table a write statement counts against, or None for reads
+    m = _WRITE_TARGET.match(sql)
+    if m is None:
+        return None
+    return 'medicine_stock' if _STOCK_ONLY_UPDATE.match(sql) else m.group(1).lower()
+
+def on_tables_written(fn):
+    # fn(tables) runs after a commit that wrote to any of `tables` (a set of names)
+    _table_listeners.append(fn)
+    return fn
+
+def notify_tables_written(tables):
+    for fn in _table_listeners:
+        fn(tables)
+
+
+class Metrics:
+    # Minimal in-process Prometheus registry: labelled counters and histograms, rendered
+    # in the text exposition format. Values are per process.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._meta = {}
+        self._values = {}
+
+    def counter(self, name, help_text):
+        self._meta[name] = ('counter', help_text, None)
+
+    def histogram(self, name, help_text, buckets):
+        self._meta[name] = ('histogram', help_text, tuple(buckets))
+
+    def inc(self, name, labels=(), value=1):
+        key = (name, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def observe(self, name, value, labels=()):
+        buckets = self._meta[name][2]
+        key = (name, labels)
+        with self._lock:
+            h = self._values.get(key)
+            if h is None:
+                h = self._values[key] = [0] * (len(buckets) + 2)  # per bucket, +Inf, sum
+            h[bisect.bisect_left(buckets, value)] += 1
+            h[-1] += value
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        pairs = tuple(labels) + tuple(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in pairs) + '}'
+
+    def render(self, gauges=()):
+        with self._lock:
+            values = [(k, list(v) if isinstance(v, list) else v) for k, v in self._values.items()]
+        lines = []
+        for name, (kind, help_text, buckets) in sorted(self._meta.items()):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for (n, labels), v in values:
+                if n != name:
+                    continue
+                if kind == 'counter':
+                    lines.append(f'{name}{self._labels(labels)} {v}')
+                    continue
+                running = 0
+                for bound, count in zip(buckets + ('+Inf',), v[:-1]):
+                    running += count
+                    lines.append(f'{name}_bucket{self._labels(labels, (("le", bound),))} {running}')
+                lines.append(f'{name}_sum{self._labels(labels)} {v[-1]}')
+                lines.append(f'{name}_count{self._labels(labels)} {running}')
+        for name, help_text, samples in gauges:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} gauge')
+            for labels, v in samples:
+                lines.append(f'{name}{self._labels(labels)} {v}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+metrics.counter('genricycle_http_requests_total', 'HTTP requests by endpoint, method and status.')
+metrics.histogram('genricycle_http_request_duration_seconds', 'Handler time per request.', _LATENCY_BUCKETS)
+metrics.counter('genricycle_db_queries_total', 'SQL statements executed, by endpoint.')
+metrics.histogram('genricycle_db_queries_per_request', 'SQL statements per request.', (0, 1, 2, 3, 5, 10, 20, 50, 100, 200))
+metrics.histogram('genricycle_db_time_per_request_seconds', 'Database time per request.', _LATENCY_BUCKETS)
+metrics.counter('genricycle_db_rows_total', 'Rows fetched through DBProxy, by endpoint.')
+metrics.counter('genricycle_db_slow_queries_total', 'Statements slower than SLOW_QUERY_MS.')
+metrics.counter('genricycle_db_repeated_queries_total', 'Requests that ran one statement shape N_PLUS_ONE_THRESHOLD+ times, by endpoint.')
+metrics.counter('genricycle_db_replica_reads_total', 'Read-only requests routed to a replica, by replica.')
+metrics.counter('genricycle_db_primary_reads_total', 'Read-only requests kept on the primary (recent_write, no_replica, replica_error).')
+
+
+SLOW_QUERY_MS = _env_float('SLOW_QUERY_MS', 200.0)
+_SQL_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_SQL_IDENTS = re.compile(r'"[^"]*"|`[^`]*`')
+_SQL_LISTS = re.compile(r'\((?:\s*\?\s*,)+\s*\?\s*\)')
+
+@functools.lru_cache(maxsize=2048)
+def normalize_sql(sql):
+    # one line, literals and IN/VALUES lists collapsed to ?, so every execution of the
+    # same statement shape aggregates under one key
+    text = _SQL_LISTS.sub('(...)', _SQL_LITERALS.sub('?', ' '.join(sql.split())))
+    return re.sub(r'\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))+', '(...)', text)
+
+@functools.lru_cache(maxsize=2048)
+def _sql_shape(sql):
+    # normalize_sql() with quoted table/column names blanked too: a loop that runs the
+    # same query once per table is an N+1 just like one that runs it once per id
+    return _SQL_IDENTS.sub('"?"', normalize_sql(sql))
+
+
+class QueryStats:
+    # What one DBProxy (= one request) did: statement count, DB time, rows and a
+    # per-statement breakdown keyed by normalized SQL.
+    def __init__(self):
+        self.count = 0
+        self.ms = 0.0
+        self.rows = 0
+        self.statements = {}
+        self.shapes = {}
+
+    def start(self, sql):
+        self.count += 1
+        entry = self.statements.get(sql)
+        if entry is None:
+            entry = self.statements[sql] = [0, 0.0, 0]
+        entry[0] += 1
+        shape = _sql_shape(sql)
+        self.shapes[shape] = self.shapes.get(shape, 0) + 1
+        return entry
+
+    def add(self, entry, ms, rows):
+        self.ms += ms
+        self.rows += rows
+        entry[1] += ms
+        entry[2] += rows
+
+    def top(self, n=5):
+        return sorted(((normalize_sql(sql), e[0], round(e[1], 2), e[2]) for sql, e in self.statements.items()),
+                      key=lambda t: -t[2])[:n]
+
+    def repeated(self, threshold):
+        return {shape: n for shape, n in self.shapes.items() if n >= threshold}
+
+
+class TracedCursor:
+    # Cursor wrapper that charges fetch time and fetched rows to the statement that
+    # produced them (SQLite does most of a SELECT's work while stepping through rows).
+    def __init__(self, cur, stats, entry, sql, ms):
+        self._cur = cur
+        self._stats = stats
+        self._entry = entry
+        self._sql = sql
+        self._ms = 0.0
+        self._charge(ms, 0)
+
+    def _charge(self, ms, rows):
+        slow = self._ms < SLOW_QUERY_MS
+        self._ms += ms
+        self._stats.add(self._entry, ms, rows)
+        if slow and self._ms >= SLOW_QUERY_MS:
+            app.logger.warning('slow query %.1fms: %s', self._ms, normalize_sql(self._sql))
+            metrics.inc('genricycle_db_slow_queries_total')
+
+    def fetchone(self):
+        t0 = time.perf_counter()
+        row = self._cur.fetchone()
+        self._charge((time.perf_counter() - t0) * 1000.0, row is not None)
+        return row
+
+    def fetchmany(self, size=None):
+        t0 = time.perf_counter()
+        rows = self._cur.fetchmany(size) if size is not None else self._cur.fetchmany()
+        self._charge((time.perf_counter() - t0) * 1000.0, len(rows))
+        return rows
+
+    def fetchall(self):
+        t0 = time.perf_counter()
+        rows = self._cur.fetchall()
+        self._charge((time.perf_counter() - t0) * 1000.0, len(rows))
+        return rows
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def __getattr__(self, name):
+        return getattr(self._cur, name)
+
+
+class Rows:
+    # A result set as the cursor returned it: the column names once and one tuple per
+    # row (DBProxy.rows). JSONProvider writes it as a list of objects, with the dicts
+    # built by dict/zip in C rather than one dict(r) per row in the handler.
+    __slots__ = ('columns', 'data')
+
+    def __init__(self, columns, data):
+        self.columns = tuple(columns)
+        self.data = data
+
+    @classmethod
+    def from_sqlite(cls, records):
+        # list of sqlite3.Row -> Rows
+        return cls(records[0].keys() if records else (), list(map(tuple, records)))
+
+    def __len__(self):
+        return len(self.data)
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return Rows(self.columns, self.data[i])
+        return self.data[i]
+
+    def value(self, i, name):
+        return self.data[i][self.columns.index(name)]
+
+    def project(self, names):
+        idx = [self.columns.index(n) for n in names]
+        return Rows(names, [tuple(r[i] for i in idx) for r in self.data])
+
+    def dicts(self):
+        # DECIMAL/DATETIME columns (pymysql) are converted a column at a time, which is
+        # much cheaper than the JSON encoder's default() callback once per value
+        data = self.data
+        typed = [i for i, v in enumerate(data[0]) if type(v) in _COLUMN_ENCODERS] if data else None
+        if typed:
+            columns = list(zip(*data))
+            for i in typed:
+                try:
+                    columns[i] = list(map(_COLUMN_ENCODERS[type(data[0][i])], columns[i]))
+                except (TypeError, AttributeError):  # NULLs or mixed types in the column
+                    columns[i] = list(map(_export_value, columns[i]))
+            data = zip(*columns)
+        return list(map(dict, map(zip, itertools.repeat(self.columns), data)))
+
+
 class DBProxy:
-    def __init__(self, conn, engine):
+    # The connection is only checked out of the pool on first use, so handlers (and
+    # requests) that never touch the database never pay for a checkout. Tables written
+    # through execute() are reported to on_tables_written listeners once committed.
+    # Every statement is timed into self.stats (see QueryStats). With a `replica` the
+    # connection comes from that replica's pool, or from the primary's if it can't be had.
+    def __init__(self, conn, engine, pool=None, replica=None):
         self._conn = conn
         self._engine = engine
-    def execute(self, sql, params=None):
+        self._pool = pool
+        self._replica = replica
+        self.replica = None
+        self.wrote = False
+        self._written = set()
+        self._writer = False
+        self._trace = None
+        self.stats = QueryStats()
+    def _connection(self):
+        if self._conn is None:
+            replica, self._replica = self._replica, None
+            if replica is not None:
+                try:
+                    self._conn = replica.pool.acquire()
+                    self._pool, self.replica = replica.pool, replica.name
+                    return self._conn
+                except Exception as e:
+                    if not isinstance(e, PoolTimeout):
+                        replica.fail(e)
+                    metrics.inc('genricycle_db_primary_reads_total', (('reason', 'replica_error'),))
+            if self._pool is None:
+                self._pool = get_pool()
+            self._conn = self._pool.acquire()
+        return self._conn
+    def _run(self, method, sql, params, tuples=False):
+        conn = self._connection()
+        table = written_table(sql)
+        if table:
+            self._written.add(table)
+        if self._trace is not None:
+            self._trace(sql)
+        entry = self.stats.start(sql)
+        t0 = time.perf_counter()
         if self._engine == 'mysql':
-            sql = sql.replace('?', '%s')
-            cur = self._conn.cursor()
-            cur.execute(sql, params or ())
-            return cur
+            if tuples:
+                import pymysql
+                cur = conn.cursor(pymysql.cursors.Cursor)
+            else:
+                cur = conn.cursor()
+            getattr(cur, method)(sql.replace('?', '%s'), params)
+        elif tuples:
+            cur = conn.cursor()
+            cur.row_factory = None
+            getattr(cur, method)(sql, params)
         else:
-            return self._conn.execute(sql, params or ())
+            cur = getattr(conn, method)(sql, params)
+        return TracedCursor(cur, self.stats, entry, sql, (time.perf_counter() - t0) * 1000.0)
+    def execute(self, sql, params=None):
+        return self._run('execute', sql, params or ())
+    def executemany(self, sql, seq):
+        return self._run('executemany', sql, seq)
+    def rows(self, sql, params=None):
+        # SELECT -> Rows, for results that are only sent back as JSON
+        cur = self._run('execute', sql, params or (), tuples=True)
+        data = cur.fetchall()
+        return Rows([d[0] for d in cur.description], data)
+    def begin_write(self):
+        # SQLite: take the write lock up front (waiting up to busy_timeout) instead of
+        # failing with SQLITE_BUSY when a deferred transaction upgrades after a read.
+        # Threads of this process queue for it on _sqlite_writer first: SQLite's busy
+        # handler polls with sleeps of up to 100 ms, which gave contended writers
+        # (checkout) tails of most of a second, while a released lock wakes a waiter at
+        # once. InnoDB takes row locks as the transaction's statements run.
+        conn = self._connection()
+        if self._engine == 'sqlite' and not conn.in_transaction:
+            if not self._writer:
+                self._writer = _sqlite_writer.acquire(timeout=SQLITE_BUSY_TIMEOUT_MS / 1000.0)
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+            except Exception:
+                self._end_write()
+                raise
+    def _end_write(self):
+        if self._writer:
+            self._writer = False
+            _sqlite_writer.release()
+    def rollback(self):
+        self._written.clear()
+        try:
+            if self._conn is not None:
+                self._conn.rollback()
+        finally:
+            self._end_write()
     def commit(self):
-        self._conn.commit()
+        try:
+            if self._conn is not None:
+                self._conn.commit()
+        finally:
+            self._end_write()
+        if self._written:
+            tables, self._written = self._written, set()
+            self.wrote = True
+            notify_tables_written(tables)
     def close(self):
+        self._written.clear()
+        self._end_write()
+        conn, self._conn = self._conn, None
+        if conn is None:
+            return
+        if self._pool is not None:
+            self._pool.release(conn)
+            return
         try:
-            self._conn.close()
+            conn.close()
         except Exception:
             pass
     def set_trace_callback(self, cb):
-        pass
+        # cb(sql) before each statement, like sqlite3.Connection.set_trace_callback
+        self._trace = cb
     @property
     def engine(self):
         return self._engine
     @property
+    def acquired(self):
+        return self._conn is not None
+    @property
     def raw(self):
-        return self._conn
+        return self._connection()
 
 def get_db():
     db = getattr(g, '_db', None)
     if db is None:
-        import pymysql
-        cfg = _mysql_cfg()
-        try:
-            conn = pymysql.connect(host=cfg['host'], port=cfg['port'], user=cfg['user'], password=cfg['password'], database=cfg['db'], cursorclass=pymysql.cursors.DictCursor, autocommit=False)
-        except Exception:
-            tmp = pymysql.connect(host=cfg['host'], port=cfg['port'], user=cfg['user'], password=cfg['password'], cursorclass=pymysql.cursors.DictCursor, autocommit=True)
-            cur = tmp.cursor()
-            cur.execute(f"CREATE DATABASE IF NOT EXISTS `{cfg['db']}` CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci")
-            tmp.close()
-            conn = pymysql.connect(host=cfg['host'], port=cfg['port'], user=cfg['user'], password=cfg['password'], database=cfg['db'], cursorclass=pymysql.cursors.DictCursor, autocommit=False)
-        g._db = DBProxy(conn, 'mysql')
+        replica = route_read(read_primary_until(request.cookies)) if g.get('_replica_reads') else None
+        g._db = DBProxy(None, _db_engine(), replica=replica)
     return g._db
 
+def replica_reads(view):
+    # GET requests to a view that only SELECTs read from a replica when one is healthy and
+    # caught up (see ReplicaSet), except right after the same client wrote something.
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.method in ('GET', 'HEAD'):
+            g._replica_reads = True
+        return view(*args, **kwargs)
+    return wrapper
+
 def close_db(e=None):
-    db = getattr(g, '_db', None)
+    db = g.pop('_db', None)
     if db is not None:
         try:
             db.close()
         except Exception:
             pass
 
-def init_db():
-    eng = _db_engine()
+def _column_exists(c, eng, table, column):
     if eng == 'sqlite':
-        os.makedirs(os.path.join(BASE_DIR, 'storage'), exist_ok=True)
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        c.executescript(
-            '''
+        c.execute(f'PRAGMA table_info({table})')
+        return any(r[1] == column for r in c.fetchall())
+    c.execute('SELECT COUNT(*) AS c FROM information_schema.columns WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s', (table, column))
+    return (c.fetchone().get('c') or 0) > 0
+
+def _index_exists(c, eng, table, index):
+    if eng == 'sqlite':
+        c.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'index' AND name = ?", (index,))
+        return c.fetchone()[0] > 0
+    c.execute('SELECT COUNT(*) AS c FROM information_schema.statistics WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s', (table, index))
+    return (c.fetchone().get('c') or 0) > 0
+
+def _add_column(c, eng, table, column, sqlite_type, mysql_type):
+    if not _column_exists(c, eng, table, column):
+        c.execute(f'ALTER TABLE {table} ADD COLUMN {column} {sqlite_type if eng == "sqlite" else mysql_type}')
+
+def _create_index(c, eng, table, index, columns, unique=False):
+    if not _index_exists(c, eng, table, index):
+        c.execute(f'CREATE {"UNIQUE " if unique else ""}INDEX {index} ON {table}({", ".join(columns)})')
+
+# Indexes for the catalog sort orders and the FK columns used as join/filter targets.
+# InnoDB already keeps an index per FK column, so the composite ones below only pay
+# off there by also covering the usual sort/filter column.
+CATALOG_INDEXES = (
+    ('medicines', 'idx_medicines_name', ('name',)),
+    ('medicines', 'idx_medicines_category_name', ('category_id', 'name')),
+    ('lab_tests', 'idx_lab_tests_name', ('name',)),
+    ('doctors', 'idx_doctors_name', ('name',)),
+    ('doctors', 'idx_doctors_specialty_name', ('specialty', 'name')),
+    ('addresses', 'idx_addresses_user', ('user_id', 'is_default')),
+    ('orders', 'idx_orders_user_created', ('user_id', 'created_at')),
+    ('order_items', 'idx_order_items_order', ('order_id', 'medicine_id')),
+    ('transactions', 'idx_transactions_user_created', ('user_id', 'created_at')),
+    ('deliveries', 'idx_deliveries_order', ('order_id',)),
+    ('appointments', 'idx_appointments_doctor_time', ('doctor_id', 'scheduled_at')),
+    ('lab_orders', 'idx_lab_orders_user', ('user_id', 'scheduled_at')),
+)
+
+def _m_catalog_indexes(c, eng):
+    for table, index, columns in CATALOG_INDEXES:
+        _create_index(c, eng, table, index, columns)
+
+def _m_appointment_slots(c, eng):
+    # booked_slot mirrors scheduled_at while a booking is live and is NULL once it is
+    # cancelled, so the unique index forbids double booking but frees cancelled slots
+    _add_column(c, eng, 'appointments', 'booked_slot', 'TEXT', 'DATETIME NULL')
+    c.execute("UPDATE appointments SET booked_slot = scheduled_at WHERE id IN ("
+              "SELECT id FROM (SELECT MIN(id) AS id FROM appointments WHERE scheduled_at IS NOT NULL "
+              "AND COALESCE(status, '') <> 'cancelled' GROUP BY doctor_id, scheduled_at) first_booking)")
+    _create_index(c, eng, 'appointments', 'uq_appointments_doctor_slot', ('doctor_id', 'booked_slot'), unique=True)
+
+def _m_reward_ledger(c, eng):
+    # Points become an append-only ledger; reward_points.points_balance turns into a
+    # snapshot of the ledger up to reward_points.ledger_id. Existing balances are carried
+    # over as opening entries so the history adds up to the balance.
+    if eng == 'sqlite':
+        c.execute('''CREATE TABLE IF NOT EXISTS reward_ledger (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            delta INTEGER NOT NULL,
+            reason TEXT NOT NULL,
+            order_id INTEGER,
+            transaction_id INTEGER,
+            created_at TEXT DEFAULT (datetime('now')),
+            FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE,
+            FOREIGN KEY(order_id) REFERENCES orders(id) ON DELETE SET NULL,
+            FOREIGN KEY(transaction_id) REFERENCES transactions(id) ON DELETE SET NULL
+        )''')
+    else:
+        c.execute('''CREATE TABLE IF NOT EXISTS reward_ledger (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            user_id INT NOT NULL,
+            delta INT NOT NULL,
+            reason VARCHAR(64) NOT NULL,
+            order_id INT,
+            transaction_id INT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE,
+            FOREIGN KEY(order_id) REFERENCES orders(id) ON DELETE SET NULL,
+            FOREIGN KEY(transaction_id) REFERENCES transactions(id) ON DELETE SET NULL
+        ) ENGINE=InnoDB''')
+    _create_index(c, eng, 'reward_ledger', 'idx_reward_ledger_user', ('user_id', 'id'))
+    # one accrual per order and reason, however often the batch job runs
+    _create_index(c, eng, 'reward_ledger', 'uq_reward_ledger_order_reason', ('order_id', 'reason'), unique=True)
+    _add_column(c, eng, 'reward_points', 'ledger_id', 'INTEGER DEFAULT 0', 'INT DEFAULT 0')
+    c.execute("INSERT INTO reward_ledger(user_id, delta, reason) SELECT user_id, points_balance, 'opening_balance' "
+              "FROM reward_points WHERE points_balance <> 0 AND COALESCE(ledger_id, 0) = 0")
+    c.execute('UPDATE reward_points SET ledger_id = (SELECT COALESCE(MAX(id), 0) FROM reward_ledger)')
+
+def _m_rollups(c, eng):
+    # Aggregates kept up to date after checkout (see record_order_rollups) and rebuilt from
+    # scratch by `flask rebuild-rollups`. category_id 0 = uncategorized, city '' = unknown.
+    day, money, city = ('TEXT', 'REAL', 'TEXT') if eng == 'sqlite' else ('DATE', 'DECIMAL(14,2)', 'VARCHAR(128)')
+    suffix = '' if eng == 'sqlite' else ' ENGINE=InnoDB'
+    c.execute(f'''CREATE TABLE IF NOT EXISTS sales_daily_medicine (
+        day {day} NOT NULL,
+        medicine_id INTEGER NOT NULL,
+        category_id INTEGER NOT NULL DEFAULT 0,
+        units INTEGER NOT NULL DEFAULT 0,
+        revenue {money} NOT NULL DEFAULT 0,
+        orders INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY(day, medicine_id)
+    ){suffix}''')
+    c.execute(f'''CREATE TABLE IF NOT EXISTS sales_daily_category (
+        day {day} NOT NULL,
+        category_id INTEGER NOT NULL,
+        units INTEGER NOT NULL DEFAULT 0,
+        revenue {money} NOT NULL DEFAULT 0,
+        orders INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY(day, category_id)
+    ){suffix}''')
+    c.execute(f'''CREATE TABLE IF NOT EXISTS orders_daily_city (
+        day {day} NOT NULL,
+        city {city} NOT NULL,
+        orders INTEGER NOT NULL DEFAULT 0,
+        revenue {money} NOT NULL DEFAULT 0,
+        PRIMARY KEY(day, city)
+    ){suffix}''')
+    c.execute(f'''CREATE TABLE IF NOT EXISTS low_stock (
+        medicine_id INTEGER PRIMARY KEY,
+        stock INTEGER NOT NULL,
+        updated_at {day if eng == 'sqlite' else 'TIMESTAMP NULL'}
+    ){suffix}''')
+    _create_index(c, eng, 'medicines', 'idx_medicines_stock', ('stock',))
+
+def _m_jobs(c, eng):
+    # Background job queue (see JobQueue). Times are epoch seconds; run_at is when a
+    # queued job is due, or when a running job's lease runs out.
+    if eng == 'sqlite':
+        c.execute('''CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            run_at REAL NOT NULL,
+            created_at REAL NOT NULL,
+            locked_by TEXT,
+            last_error TEXT
+        )''')
+    else:
+        c.execute('''CREATE TABLE IF NOT EXISTS jobs (
+            id BIGINT AUTO_INCREMENT PRIMARY KEY,
+            kind VARCHAR(64) NOT NULL,
+            payload TEXT NOT NULL,
+            status VARCHAR(16) NOT NULL DEFAULT 'queued',
+            attempts INT NOT NULL DEFAULT 0,
+            run_at DOUBLE NOT NULL,
+            created_at DOUBLE NOT NULL,
+            locked_by VARCHAR(32),
+            last_error TEXT
+        ) ENGINE=InnoDB''')
+    _create_index(c, eng, 'jobs', 'idx_jobs_status_run_at', ('status', 'run_at'))
+
+def _m_ledger_transactions(c, eng):
+    # order accruals point at the order's payment transaction (see _accrue_points)
+    _create_index(c, eng, 'transactions', 'idx_transactions_order', ('order_id', 'type'))
+    c.execute("UPDATE reward_ledger SET transaction_id = (SELECT MIN(t.id) FROM transactions t "
+              "WHERE t.order_id = reward_ledger.order_id AND t.type = 'payment') "
+              "WHERE reason = 'order_accrual' AND transaction_id IS NULL")
+
+def _m_ledger_reward(c, eng):
+    # `reason` is only ever set by the server; what a redemption was for goes in `reward`.
+    # Redemptions that stored a client-chosen reason are moved over.
+    _add_column(c, eng, 'reward_ledger', 'reward', 'TEXT', 'VARCHAR(128)')
+    c.execute("UPDATE reward_ledger SET reward = reason, reason = 'redemption' "
+              "WHERE delta < 0 AND reason NOT IN ('redemption', 'opening_balance')")
+
+# Columns the search index reads from medicines (see SEARCH_INDEX_SQL; stock is left
+# out, it changes with every order). An UPDATE of any of them bumps medicines.revision,
+# whoever runs it, so the index's fingerprint notices edits made outside this process.
+MEDICINE_REVISION_COLUMNS = ('slug', 'name', 'generic_name', 'brand', 'description', 'price', 'image_url', 'category_id')
+
+def _m_medicines_revision(c, eng):
+    _add_column(c, eng, 'medicines', 'revision', 'INTEGER NOT NULL DEFAULT 0', 'INT NOT NULL DEFAULT 0')
+    _create_index(c, eng, 'medicines', 'idx_medicines_revision', ('revision',))
+    if eng == 'sqlite':
+        c.execute(f'''CREATE TRIGGER IF NOT EXISTS medicines_revision
+            AFTER UPDATE OF {", ".join(MEDICINE_REVISION_COLUMNS)} ON medicines
+            BEGIN UPDATE medicines SET revision = revision + 1 WHERE id = NEW.id; END''')
+    else:
+        unchanged = ' AND '.join(f'NEW.{col} <=> OLD.{col}' for col in MEDICINE_REVISION_COLUMNS)
+        c.execute('DROP TRIGGER IF EXISTS medicines_revision')
+        c.execute(f'CREATE TRIGGER medicines_revision BEFORE UPDATE ON medicines FOR EACH ROW '
+                  f'SET NEW.revision = OLD.revision + IF({unchanged}, 0, 1)')
+
+# Append-only: (version, name, fn(cursor, engine)). Steps must tolerate databases that
+# already have the change from before migrations were tracked.
+MIGRATIONS = [
+    (1, 'users.password_hash', lambda c, eng: _add_column(c, eng, 'users', 'password_hash', 'TEXT', 'VARCHAR(255)')),
+    (2, 'users.language', lambda c, eng: _add_column(c, eng, 'users', 'language', 'TEXT', 'VARCHAR(16)')),
+    (3, 'users.currency', lambda c, eng: _add_column(c, eng, 'users', 'currency', 'TEXT', 'VARCHAR(16)')),
+    (4, 'catalog and foreign key indexes', _m_catalog_indexes),
+    (5, 'medicines brand/price indexes', lambda c, eng: (
+        _create_index(c, eng, 'medicines', 'idx_medicines_brand_name', ('brand', 'name')),
+        _create_index(c, eng, 'medicines', 'idx_medicines_price', ('price',)),
+    )),
+    (6, 'medicines slug index', lambda c, eng: _create_index(c, eng, 'medicines', 'idx_medicines_slug', ('slug',))),
+    (7, 'delivery_persons service area and capacity', lambda c, eng: (
+        _add_column(c, eng, 'delivery_persons', 'city', 'TEXT', 'VARCHAR(128)'),
+        _add_column(c, eng, 'delivery_persons', 'pincode', 'TEXT', 'VARCHAR(32)'),
+        _add_column(c, eng, 'delivery_persons', 'capacity', 'INTEGER', 'INT'),
+        _create_index(c, eng, 'deliveries', 'idx_deliveries_status_person', ('status', 'delivery_person_id')),
+    )),
+    (8, 'appointments.booked_slot unique per doctor', _m_appointment_slots),
+    (9, 'reward_ledger', _m_reward_ledger),
+    (10, 'sales/inventory rollup tables', _m_rollups),
+    (11, 'jobs', _m_jobs),
+    (12, 'medicines.revision', _m_medicines_revision),
+    (13, 'reward_ledger.transaction_id for accruals', _m_ledger_transactions),
+    (14, 'reward_ledger.reward', _m_ledger_reward),
+]
+
+def run_migrations(conn, eng):
+    c = conn.cursor()
+    if eng == 'sqlite':
+        c.execute("CREATE TABLE IF NOT EXISTS schema_migrations (version INTEGER PRIMARY KEY, name TEXT, applied_at TEXT DEFAULT (datetime('now')))")
+    else:
+        c.execute('CREATE TABLE IF NOT EXISTS schema_migrations (version INT PRIMARY KEY, name VARCHAR(255), applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP) ENGINE=InnoDB')
+    conn.commit()
+    c.execute('SELECT version FROM schema_migrations')
+    applied = {(r['version'] if isinstance(r, dict) else r[0]) for r in c.fetchall()}
+    ph = '?' if eng == 'sqlite' else '%s'
+    done = []
+    for version, name, step in MIGRATIONS:
+        if version in applied:
+            continue
+        step(c, eng)
+        c.execute(f'INSERT INTO schema_migrations(version, name) VALUES({ph}, {ph})', (version, name))
+        conn.commit()
+        done.append(version)
+    return done
+
+# Base tables; everything after them is a migration. Editing these or MIGRATIONS changes
+# SCHEMA_FINGERPRINT, which makes the next start run the (idempotent) DDL again.
+SQLITE_SCHEMA = '''
             PRAGMA foreign_keys = ON;
 
             CREATE TABLE IF NOT EXISTS users (
@@ -203,6 +1231,47 @@ def init_db():
                 FOREIGN KEY(lab_test_id) REFERENCES lab_tests(id) ON DELETE CASCADE
             );
 
+            CREATE TABLE IF NOT EXISTS delivery_persons (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                phone TEXT,
+                vehicle_type TEXT,
+                active INTEGER DEFAULT 1
+            );
+
+            CREATE TABLE IF NOT EXISTS deliveries (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                order_id INTEGER NOT NULL,
+                delivery_person_id INTEGER,
+                address_id INTEGER,
+                status TEXT DEFAULT 'scheduled',
+                scheduled_at TEXT,
+                picked_at TEXT,
+                delivered_at TEXT,
+                FOREIGN KEY(order_id) REFERENCES orders(id) ON DELETE CASCADE,
+                FOREIGN KEY(delivery_person_id) REFERENCES delivery_persons(id) ON DELETE SET NULL,
+                FOREIGN KEY(address_id) REFERENCES addresses(id) ON DELETE SET NULL
+            );
+
+            CREATE TABLE IF NOT EXISTS doctor_availability (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                doctor_id INTEGER NOT NULL,
+                day_of_week INTEGER NOT NULL,
+                start_time TEXT NOT NULL,
+                end_time TEXT NOT NULL,
+                FOREIGN KEY(doctor_id) REFERENCES doctors(id) ON DELETE CASCADE
+            );
+
+            CREATE TABLE IF NOT EXISTS lab_results (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                lab_order_id INTEGER NOT NULL,
+                result_summary TEXT,
+                result_url TEXT,
+                status TEXT DEFAULT 'pending',
+                reported_at TEXT,
+                FOREIGN KEY(lab_order_id) REFERENCES lab_orders(id) ON DELETE CASCADE
+            );
+
             CREATE TABLE IF NOT EXISTS recycle_requests (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 facility_name TEXT,
@@ -214,506 +1283,1453 @@ def init_db():
                 created_at TEXT DEFAULT (datetime('now'))
             );
             '''
-        )
-        conn.commit()
-        # migrate optional columns
-        c.execute("PRAGMA table_info(users)")
-        existing_cols = {row[1] for row in c.fetchall()}
-        if 'password_hash' not in existing_cols:
-            try:
-                c.execute("ALTER TABLE users ADD COLUMN password_hash TEXT")
-            except Exception:
-                pass
-        if 'language' not in existing_cols:
-            try:
-                c.execute("ALTER TABLE users ADD COLUMN language TEXT")
-            except Exception:
-                pass
-        if 'currency' not in existing_cols:
-            try:
-                c.execute("ALTER TABLE users ADD COLUMN currency TEXT")
-            except Exception:
-                pass
-        # seed
-        c.execute('SELECT COUNT(*) FROM categories')
-        if c.fetchone()[0] == 0:
-            c.executemany('INSERT INTO categories(name) VALUES(?)', [
-                ('Pain Relief',), ('Antibiotic',), ('Diabetes',), ('Vitamins',), ('Cardiovascular',), ('Antiseptic',), ('Digestive',), ('Prescription',)
-            ])
-        c.execute('SELECT COUNT(*) FROM medicines')
-        if c.fetchone()[0] == 0:
-            c.execute('SELECT id, name FROM categories')
-            cat_map = {row[1]: row[0] for row in c.fetchall()}
-            medicines = [
-                ('paracetamol', 'Paracetamol 500mg Tablets', 'Paracetamol', "Bell's", 'Pain relief and fever reducer.', 45.0, 1000, cat_map['Pain Relief'], 'https://images.unsplash.com/photo-1559757148-5c350d0d3c56?w=200&h=200&fit=crop&crop=center'),
-                ('ibuprofen', 'Ibuprofen 400mg Tablets', 'Ibuprofen', 'Generic', 'NSAID for pain and inflammation.', 65.0, 800, cat_map['Pain Relief'], 'https://images.unsplash.com/photo-1587854692152-cbe660dbde88?w=200&h=200&fit=crop&crop=center'),
-                ('amoxicillin', 'Amoxicillin 500mg Capsules', 'Amoxicillin', 'Generic', 'Broad-spectrum antibiotic.', 120.0, 500, cat_map['Antibiotic'], 'https://images.unsplash.com/photo-1584308666744-24d5c474f2ae?w=200&h=200&fit=crop&crop=center'),
-                ('metformin', 'Metformin 500mg Tablets', 'Metformin', 'Generic', 'Type 2 diabetes management.', 75.0, 1200, cat_map['Diabetes'], 'https://images.unsplash.com/photo-1576671081837-49000212a370?w=200&h=200&fit=crop&crop=center'),
-                ('vitamin-d', 'Vitamin D3 1000 IU Tablets', 'Cholecalciferol', 'Generic', 'Bone health and immunity support.', 350.0, 300, cat_map['Vitamins'], 'https://images.unsplash.com/photo-1582719478250-c89cae4dc85b?w=200&h=200&fit=crop&crop=center'),
-                ('atorvastatin', 'Atorvastatin 20mg Tablets', 'Atorvastatin', 'Generic', 'Cholesterol management.', 180.0, 600, cat_map['Cardiovascular'], 'https://images.unsplash.com/photo-1584308666744-24d5c474f2ae?w=200&h=200&fit=crop&crop=center'),
-            ]
-            c.executemany('''
-                INSERT INTO medicines(slug, name, generic_name, brand, description, price, stock, category_id, image_url)
-                VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', medicines)
-        c.execute('SELECT COUNT(*) FROM doctors')
-        if c.fetchone()[0] == 0:
-            doctors = [
-                ('Aisha Khan', 'Dermatology', 8, 199.0, 'https://randomuser.me/api/portraits/women/33.jpg'),
-                ('Ravi Verma', 'General Medicine', 12, 199.0, 'https://randomuser.me/api/portraits/men/32.jpg'),
-                ('Neha Sharma', 'Pediatrics', 6, 199.0, 'https://randomuser.me/api/portraits/women/65.jpg')
-            ]
-            c.executemany('INSERT INTO doctors(name, specialty, experience_years, consultation_fee, image_url) VALUES(?, ?, ?, ?, ?)', doctors)
-        c.execute('SELECT COUNT(*) FROM labs')
-        if c.fetchone()[0] == 0:
-            labs = [
-                ('SRL Diagnostics', 'Mumbai', '+91-90000-00001'),
-                ('Lal PathLabs', 'Delhi', '+91-90000-00002')
-            ]
-            c.executemany('INSERT INTO labs(name, city, contact) VALUES(?, ?, ?)', labs)
-            c.execute('SELECT id, name FROM labs')
-            labs_map = {row[1]: row[0] for row in c.fetchall()}
-            lab_tests = [
-                ('Complete Blood Count (CBC)', 'Hematology', 399.0, labs_map['SRL Diagnostics']),
-                ('Lipid Profile', 'Biochemistry', 699.0, labs_map['Lal PathLabs']),
-                ('Thyroid Profile (T3, T4, TSH)', 'Hormone', 499.0, labs_map['SRL Diagnostics'])
-            ]
-            c.executemany('INSERT INTO lab_tests(name, category, price, lab_id) VALUES(?, ?, ?, ?)', lab_tests)
-        conn.commit()
-        conn.close()
-    else:
-        import pymysql
-        cfg = _mysql_cfg()
-        tmp = pymysql.connect(host=cfg['host'], port=cfg['port'], user=cfg['user'], password=cfg['password'], cursorclass=pymysql.cursors.DictCursor, autocommit=True)
-        cur0 = tmp.cursor()
-        cur0.execute(f"CREATE DATABASE IF NOT EXISTS `{cfg['db']}` CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci")
-        tmp.close()
-        conn = pymysql.connect(host=cfg['host'], port=cfg['port'], user=cfg['user'], password=cfg['password'], database=cfg['db'], cursorclass=pymysql.cursors.DictCursor, autocommit=False)
+
+MYSQL_SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS users (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        name VARCHAR(255) NOT NULL,
+        email VARCHAR(255) UNIQUE,
+        phone VARCHAR(64),
+        role VARCHAR(64) DEFAULT 'customer',
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    ) ENGINE=InnoDB''',
+    '''CREATE TABLE IF NOT EXISTS addresses (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        user_id INT NOT NULL,
+        line1 VARCHAR(255),
+        city VARCHAR(128),
+        pincode VARCHAR(32),
+        is_default TINYINT(1) DEFAULT 0,
+        FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+    ) ENGINE=InnoDB''',
+    '''CREATE TABLE IF NOT EXISTS categories (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        name VARCHAR(128) UNIQUE NOT NULL
+    ) ENGINE=InnoDB''',
+    '''CREATE TABLE IF NOT EXISTS medicines (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        slug VARCHAR(128),
+        name VARCHAR(255) NOT NULL,
+        generic_name VARCHAR(255),
+        brand VARCHAR(255),
+        description TEXT,
+        price DECIMAL(10,2) NOT NULL,
+        stock INT DEFAULT 0,
+        category_id INT,
+        image_url VARCHAR(512),
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY(category_id) REFERENCES categories(id) ON DELETE SET NULL
+    ) ENGINE=InnoDB''',
+    '''CREATE TABLE IF NOT EXISTS orders (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        user_id INT NOT NULL,
+        status VARCHAR(64) DEFAULT 'pending',
+        total_amount DECIMAL(10,2) DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+    ) ENGINE=InnoDB''',
+    '''CREATE TABLE IF NOT EXISTS order_items (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        order_id INT NOT NULL,
+        medicine_id INT NOT NULL,
+        quantity INT NOT NULL,
+        price DECIMAL(10,2) NOT NULL,
+        FOREIGN KEY(order_id) REFERENCES orders(id) ON DELETE CASCADE,
+        FOREIGN KEY(medicine_id) REFERENCES medicines(id) ON DELETE CASCADE
+    ) ENGINE=InnoDB''',
+    '''CREATE TABLE IF NOT EXISTS transactions (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        user_id INT NOT NULL,
+        order_id INT,
+        type VARCHAR(64),
+        amount DECIMAL(10,2),
+        status VARCHAR(64),
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE,
+        FOREIGN KEY(order_id) REFERENCES orders(id) ON DELETE SET NULL
+    ) ENGINE=InnoDB''',
+    '''CREATE TABLE IF NOT EXISTS reward_points (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        user_id INT UNIQUE NOT NULL,
+        points_balance INT DEFAULT 0,
+        updated_at TIMESTAMP NULL,
+        FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+    ) ENGINE=InnoDB''',
+    '''CREATE TABLE IF NOT EXISTS doctors (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        name VARCHAR(255) NOT NULL,
+        specialty VARCHAR(128),
+        experience_years INT,
+        consultation_fee DECIMAL(10,2),
+        image_url VARCHAR(512)
+    ) ENGINE=InnoDB''',
+    '''CREATE TABLE IF NOT EXISTS appointments (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        user_id INT NOT NULL,
+        doctor_id INT NOT NULL,
+        scheduled_at TIMESTAMP NULL,
+        status VARCHAR(64),
+        FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE,
+        FOREIGN KEY(doctor_id) REFERENCES doctors(id) ON DELETE CASCADE
+    ) ENGINE=InnoDB''',
+    '''CREATE TABLE IF NOT EXISTS labs (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        name VARCHAR(255) NOT NULL,
+        city VARCHAR(128),
+        contact VARCHAR(64)
+    ) ENGINE=InnoDB''',
+    '''CREATE TABLE IF NOT EXISTS lab_tests (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        name VARCHAR(255) NOT NULL,
+        category VARCHAR(128),
+        price DECIMAL(10,2),
+        lab_id INT,
+        FOREIGN KEY(lab_id) REFERENCES labs(id) ON DELETE SET NULL
+    ) ENGINE=InnoDB''',
+    '''CREATE TABLE IF NOT EXISTS lab_orders (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        user_id INT NOT NULL,
+        lab_test_id INT NOT NULL,
+        scheduled_at TIMESTAMP NULL,
+        status VARCHAR(64),
+        FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE,
+        FOREIGN KEY(lab_test_id) REFERENCES lab_tests(id) ON DELETE CASCADE
+    ) ENGINE=InnoDB''',
+    '''CREATE TABLE IF NOT EXISTS delivery_persons (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        name VARCHAR(255) NOT NULL,
+        phone VARCHAR(64),
+        vehicle_type VARCHAR(64),
+        active TINYINT(1) DEFAULT 1
+    ) ENGINE=InnoDB''',
+    '''CREATE TABLE IF NOT EXISTS deliveries (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        order_id INT NOT NULL,
+        delivery_person_id INT,
+        address_id INT,
+        status VARCHAR(64) DEFAULT 'scheduled',
+        scheduled_at TIMESTAMP NULL,
+        picked_at TIMESTAMP NULL,
+        delivered_at TIMESTAMP NULL,
+        FOREIGN KEY(order_id) REFERENCES orders(id) ON DELETE CASCADE,
+        FOREIGN KEY(delivery_person_id) REFERENCES delivery_persons(id) ON DELETE SET NULL,
+        FOREIGN KEY(address_id) REFERENCES addresses(id) ON DELETE SET NULL
+    ) ENGINE=InnoDB''',
+    '''CREATE TABLE IF NOT EXISTS doctor_availability (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        doctor_id INT NOT NULL,
+        day_of_week TINYINT NOT NULL,
+        start_time TIME NOT NULL,
+        end_time TIME NOT NULL,
+        FOREIGN KEY(doctor_id) REFERENCES doctors(id) ON DELETE CASCADE
+    ) ENGINE=InnoDB''',
+    '''CREATE TABLE IF NOT EXISTS lab_results (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        lab_order_id INT NOT NULL,
+        result_summary TEXT,
+        result_url VARCHAR(512),
+        status VARCHAR(64) DEFAULT 'pending',
+        reported_at TIMESTAMP NULL,
+        FOREIGN KEY(lab_order_id) REFERENCES lab_orders(id) ON DELETE CASCADE
+    ) ENGINE=InnoDB''',
+    '''CREATE TABLE IF NOT EXISTS recycle_requests (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        facility_name VARCHAR(255),
+        phone VARCHAR(64),
+        address VARCHAR(255),
+        city VARCHAR(128),
+        pincode VARCHAR(32),
+        status VARCHAR(64),
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    ) ENGINE=InnoDB''',
+]
+
+SCHEMA_FINGERPRINT = hashlib.sha256(repr((SQLITE_SCHEMA, MYSQL_SCHEMA, [(v, n) for v, n, _ in MIGRATIONS])).encode()).hexdigest()[:16]
+
+def _stored_fingerprint(conn):
+    try:
         c = conn.cursor()
-        stmts = [
-            '''CREATE TABLE IF NOT EXISTS users (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                name VARCHAR(255) NOT NULL,
-                email VARCHAR(255) UNIQUE,
-                phone VARCHAR(64),
-                role VARCHAR(64) DEFAULT 'customer',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            ) ENGINE=InnoDB''',
-            '''CREATE TABLE IF NOT EXISTS addresses (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                user_id INT NOT NULL,
-                line1 VARCHAR(255),
-                city VARCHAR(128),
-                pincode VARCHAR(32),
-                is_default TINYINT(1) DEFAULT 0,
-                FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
-            ) ENGINE=InnoDB''',
-            '''CREATE TABLE IF NOT EXISTS categories (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                name VARCHAR(128) UNIQUE NOT NULL
-            ) ENGINE=InnoDB''',
-            '''CREATE TABLE IF NOT EXISTS medicines (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                slug VARCHAR(128),
-                name VARCHAR(255) NOT NULL,
-                generic_name VARCHAR(255),
-                brand VARCHAR(255),
-                description TEXT,
-                price DECIMAL(10,2) NOT NULL,
-                stock INT DEFAULT 0,
-                category_id INT,
-                image_url VARCHAR(512),
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY(category_id) REFERENCES categories(id) ON DELETE SET NULL
-            ) ENGINE=InnoDB''',
-            '''CREATE TABLE IF NOT EXISTS orders (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                user_id INT NOT NULL,
-                status VARCHAR(64) DEFAULT 'pending',
-                total_amount DECIMAL(10,2) DEFAULT 0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
-            ) ENGINE=InnoDB''',
-            '''CREATE TABLE IF NOT EXISTS order_items (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                order_id INT NOT NULL,
-                medicine_id INT NOT NULL,
-                quantity INT NOT NULL,
-                price DECIMAL(10,2) NOT NULL,
-                FOREIGN KEY(order_id) REFERENCES orders(id) ON DELETE CASCADE,
-                FOREIGN KEY(medicine_id) REFERENCES medicines(id) ON DELETE CASCADE
-            ) ENGINE=InnoDB''',
-            '''CREATE TABLE IF NOT EXISTS transactions (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                user_id INT NOT NULL,
-                order_id INT,
-                type VARCHAR(64),
-                amount DECIMAL(10,2),
-                status VARCHAR(64),
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE,
-                FOREIGN KEY(order_id) REFERENCES orders(id) ON DELETE SET NULL
-            ) ENGINE=InnoDB''',
-            '''CREATE TABLE IF NOT EXISTS reward_points (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                user_id INT UNIQUE NOT NULL,
-                points_balance INT DEFAULT 0,
-                updated_at TIMESTAMP NULL,
-                FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
-            ) ENGINE=InnoDB''',
-            '''CREATE TABLE IF NOT EXISTS doctors (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                name VARCHAR(255) NOT NULL,
-                specialty VARCHAR(128),
-                experience_years INT,
-                consultation_fee DECIMAL(10,2),
-                image_url VARCHAR(512)
-            ) ENGINE=InnoDB''',
-            '''CREATE TABLE IF NOT EXISTS appointments (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                user_id INT NOT NULL,
-                doctor_id INT NOT NULL,
-                scheduled_at TIMESTAMP NULL,
-                status VARCHAR(64),
-                FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE,
-                FOREIGN KEY(doctor_id) REFERENCES doctors(id) ON DELETE CASCADE
-            ) ENGINE=InnoDB''',
-            '''CREATE TABLE IF NOT EXISTS labs (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                name VARCHAR(255) NOT NULL,
-                city VARCHAR(128),
-                contact VARCHAR(64)
-            ) ENGINE=InnoDB''',
-            '''CREATE TABLE IF NOT EXISTS lab_tests (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                name VARCHAR(255) NOT NULL,
-                category VARCHAR(128),
-                price DECIMAL(10,2),
-                lab_id INT,
-                FOREIGN KEY(lab_id) REFERENCES labs(id) ON DELETE SET NULL
-            ) ENGINE=InnoDB''',
-            '''CREATE TABLE IF NOT EXISTS lab_orders (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                user_id INT NOT NULL,
-                lab_test_id INT NOT NULL,
-                scheduled_at TIMESTAMP NULL,
-                status VARCHAR(64),
-                FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE,
-                FOREIGN KEY(lab_test_id) REFERENCES lab_tests(id) ON DELETE CASCADE
-            ) ENGINE=InnoDB''',
-            '''CREATE TABLE IF NOT EXISTS delivery_persons (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                name VARCHAR(255) NOT NULL,
-                phone VARCHAR(64),
-                vehicle_type VARCHAR(64),
-                active TINYINT(1) DEFAULT 1
-            ) ENGINE=InnoDB''',
-            '''CREATE TABLE IF NOT EXISTS deliveries (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                order_id INT NOT NULL,
-                delivery_person_id INT,
-                address_id INT,
-                status VARCHAR(64) DEFAULT 'scheduled',
-                scheduled_at TIMESTAMP NULL,
-                picked_at TIMESTAMP NULL,
-                delivered_at TIMESTAMP NULL,
-                FOREIGN KEY(order_id) REFERENCES orders(id) ON DELETE CASCADE,
-                FOREIGN KEY(delivery_person_id) REFERENCES delivery_persons(id) ON DELETE SET NULL,
-                FOREIGN KEY(address_id) REFERENCES addresses(id) ON DELETE SET NULL
-            ) ENGINE=InnoDB''',
-            '''CREATE TABLE IF NOT EXISTS doctor_availability (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                doctor_id INT NOT NULL,
-                day_of_week TINYINT NOT NULL,
-                start_time TIME NOT NULL,
-                end_time TIME NOT NULL,
-                FOREIGN KEY(doctor_id) REFERENCES doctors(id) ON DELETE CASCADE
-            ) ENGINE=InnoDB''',
-            '''CREATE TABLE IF NOT EXISTS lab_results (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                lab_order_id INT NOT NULL,
-                result_summary TEXT,
-                result_url VARCHAR(512),
-                status VARCHAR(64) DEFAULT 'pending',
-                reported_at TIMESTAMP NULL,
-                FOREIGN KEY(lab_order_id) REFERENCES lab_orders(id) ON DELETE CASCADE
-            ) ENGINE=InnoDB''',
-            '''CREATE TABLE IF NOT EXISTS recycle_requests (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                facility_name VARCHAR(255),
-                phone VARCHAR(64),
-                address VARCHAR(255),
-                city VARCHAR(128),
-                pincode VARCHAR(32),
-                status VARCHAR(64),
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            ) ENGINE=InnoDB''',
-        ]
-        for s in stmts:
-            c.execute(s)
-        conn.commit()
-        c.execute('SELECT COUNT(*) AS c FROM users')
-        if (c.fetchone().get('c') or 0) == 0:
-            c.execute("INSERT INTO users(name, email, phone, role) VALUES(%s, %s, %s, %s)", ('Test User', 'test@example.com', '+91-90000-00000', 'customer'))
-        c.execute('SELECT id FROM users LIMIT 1')
-        user_id = c.fetchone()['id']
-        c.execute('SELECT COUNT(*) AS c FROM addresses')
-        if (c.fetchone().get('c') or 0) == 0:
-            c.execute("INSERT INTO addresses(user_id, line1, city, pincode, is_default) VALUES(%s, %s, %s, %s, %s)", (user_id, '221B Baker Street', 'Delhi', '110001', 1))
-        c.execute('SELECT id FROM addresses WHERE user_id = %s ORDER BY id LIMIT 1', (user_id,))
-        addr_id = c.fetchone()['id']
-        c.execute('SELECT id, price FROM medicines LIMIT 1')
-        mrow = c.fetchone()
-        med_id = mrow['id']
-        med_price = mrow['price']
-        c.execute('SELECT COUNT(*) AS c FROM orders')
-        if (c.fetchone().get('c') or 0) == 0:
-            c.execute('INSERT INTO orders(user_id, status, total_amount) VALUES(%s, %s, %s)', (user_id, 'pending', med_price))
-        c.execute('SELECT id FROM orders WHERE user_id = %s ORDER BY id LIMIT 1', (user_id,))
-        order_id = c.fetchone()['id']
-        c.execute('SELECT COUNT(*) AS c FROM order_items WHERE order_id = %s', (order_id,))
-        if (c.fetchone().get('c') or 0) == 0:
-            c.execute('INSERT INTO order_items(order_id, medicine_id, quantity, price) VALUES(%s, %s, %s, %s)', (order_id, med_id, 1, med_price))
-        c.execute('SELECT COUNT(*) AS c FROM delivery_persons')
-        if (c.fetchone().get('c') or 0) == 0:
-            c.execute('INSERT INTO delivery_persons(name, phone, vehicle_type) VALUES(%s, %s, %s)', ('Rahul Kumar', '+91-90000-00003', 'Bike'))
-        c.execute('SELECT id FROM delivery_persons ORDER BY id LIMIT 1')
-        dp_id = c.fetchone()['id']
-        c.execute('SELECT COUNT(*) AS c FROM deliveries')
-        if (c.fetchone().get('c') or 0) == 0:
-            c.execute('INSERT INTO deliveries(order_id, delivery_person_id, address_id, status, scheduled_at) VALUES(%s, %s, %s, %s, NOW())', (order_id, dp_id, addr_id, 'scheduled'))
-        c.execute('SELECT id FROM doctors ORDER BY id LIMIT 1')
-        drow = c.fetchone()
-        if drow:
-            doc_id = drow['id']
-            c.execute('SELECT COUNT(*) AS c FROM doctor_availability WHERE doctor_id = %s', (doc_id,))
-            if (c.fetchone().get('c') or 0) == 0:
-                c.execute("INSERT INTO doctor_availability(doctor_id, day_of_week, start_time, end_time) VALUES(%s, %s, %s, %s)", (doc_id, 1, '10:00:00', '16:00:00'))
-            c.execute('SELECT COUNT(*) AS c FROM appointments')
-            if (c.fetchone().get('c') or 0) == 0:
-                c.execute('INSERT INTO appointments(user_id, doctor_id, scheduled_at, status) VALUES(%s, %s, NOW(), %s)', (user_id, doc_id, 'scheduled'))
-        c.execute('SELECT id FROM lab_tests ORDER BY id LIMIT 1')
-        ltrow = c.fetchone()
-        if ltrow:
-            lt_id = ltrow['id']
-            c.execute('SELECT COUNT(*) AS c FROM lab_orders')
-            if (c.fetchone().get('c') or 0) == 0:
-                c.execute('INSERT INTO lab_orders(user_id, lab_test_id, scheduled_at, status) VALUES(%s, %s, NOW(), %s)', (user_id, lt_id, 'scheduled'))
-            c.execute('SELECT id FROM lab_orders ORDER BY id LIMIT 1')
-            lo_id = c.fetchone()['id']
-            c.execute('SELECT COUNT(*) AS c FROM lab_results WHERE lab_order_id = %s', (lo_id,))
-            if (c.fetchone().get('c') or 0) == 0:
-                c.execute('INSERT INTO lab_results(lab_order_id, result_summary, status, reported_at) VALUES(%s, %s, %s, NOW())', (lo_id, 'All parameters within normal range', 'completed'))
-        conn.commit()
-        # migrate optional columns on users for app features
-        c.execute("SELECT column_name FROM information_schema.columns WHERE table_schema = DATABASE() AND table_name = 'users'")
-        rows = c.fetchall()
-        existing_cols = { (r.get('column_name') or r.get('COLUMN_NAME')) for r in rows } if rows and isinstance(rows[0], dict) else { r[0] for r in rows }
-        if 'password_hash' not in existing_cols:
-            try:
-                c.execute("ALTER TABLE users ADD COLUMN password_hash VARCHAR(255)")
-            except Exception:
-                pass
-        if 'language' not in existing_cols:
-            try:
-                c.execute("ALTER TABLE users ADD COLUMN language VARCHAR(16)")
-            except Exception:
-                pass
-        if 'currency' not in existing_cols:
-            try:
-                c.execute("ALTER TABLE users ADD COLUMN currency VARCHAR(16)")
-            except Exception:
-                pass
+        c.execute("SELECT value FROM schema_meta WHERE name = 'fingerprint'")
+        row = c.fetchone()
+    except Exception:
+        conn.rollback()  # no schema_meta yet: a new database
+        return None
+    if row is None:
+        return None
+    return row['value'] if isinstance(row, dict) else row[0]
+
+def init_db(force=False):
+    # Warm start is one SELECT: when the stored fingerprint matches this code the DDL,
+    # information_schema checks and migrations are all skipped. Demo data is no longer
+    # inserted here, see seed_db / `flask seed-db`. Returns True when schema work ran.
+    eng = _db_engine()
+    conn = _sqlite_connect() if eng == 'sqlite' else _mysql_connect()
+    try:
+        if not force and _stored_fingerprint(conn) == SCHEMA_FINGERPRINT:
+            return False
+        c = conn.cursor()
+        if eng == 'sqlite':
+            c.executescript(SQLITE_SCHEMA)
+        else:
+            for stmt in MYSQL_SCHEMA:
+                c.execute(stmt)
         conn.commit()
-        # seed
-        c.execute('SELECT COUNT(*) AS c FROM categories')
-        if (c.fetchone().get('c') or 0) == 0:
-            c.executemany('INSERT INTO categories(name) VALUES(%s)', [
-                ('Pain Relief',), ('Antibiotic',), ('Diabetes',), ('Vitamins',), ('Cardiovascular',), ('Antiseptic',), ('Digestive',), ('Prescription',)
-            ])
-        c.execute('SELECT COUNT(*) AS c FROM medicines')
-        if (c.fetchone().get('c') or 0) == 0:
-            c.execute('SELECT id, name FROM categories')
-            cat_map = {row['name']: row['id'] for row in c.fetchall()}
-            medicines = [
-                ('paracetamol', 'Paracetamol 500mg Tablets', 'Paracetamol', "Bell's", 'Pain relief and fever reducer.', 45.0, 1000, cat_map['Pain Relief'], 'https://images.unsplash.com/photo-1559757148-5c350d0d3c56?w=200&h=200&fit=crop&crop=center'),
-                ('ibuprofen', 'Ibuprofen 400mg Tablets', 'Ibuprofen', 'Generic', 'NSAID for pain and inflammation.', 65.0, 800, cat_map['Pain Relief'], 'https://images.unsplash.com/photo-1587854692152-cbe660dbde88?w=200&h=200&fit=crop&crop=center'),
-                ('amoxicillin', 'Amoxicillin 500mg Capsules', 'Amoxicillin', 'Generic', 'Broad-spectrum antibiotic.', 120.0, 500, cat_map['Antibiotic'], 'https://images.unsplash.com/photo-1584308666744-24d5c474f2ae?w=200&h=200&fit=crop&crop=center'),
-                ('metformin', 'Metformin 500mg Tablets', 'Metformin', 'Generic', 'Type 2 diabetes management.', 75.0, 1200, cat_map['Diabetes'], 'https://images.unsplash.com/photo-1576671081837-49000212a370?w=200&h=200&fit=crop&crop=center'),
-                ('vitamin-d', 'Vitamin D3 1000 IU Tablets', 'Cholecalciferol', 'Generic', 'Bone health and immunity support.', 350.0, 300, cat_map['Vitamins'], 'https://images.unsplash.com/photo-1582719478250-c89cae4dc85b?w=200&h=200&fit=crop&crop=center'),
-                ('atorvastatin', 'Atorvastatin 20mg Tablets', 'Atorvastatin', 'Generic', 'Cholesterol management.', 180.0, 600, cat_map['Cardiovascular'], 'https://images.unsplash.com/photo-1584308666744-24d5c474f2ae?w=200&h=200&fit=crop&crop=center'),
-            ]
-            c.executemany('''
-                INSERT INTO medicines(slug, name, generic_name, brand, description, price, stock, category_id, image_url)
-                VALUES(%s, %s, %s, %s, %s, %s, %s, %s, %s)
-            ''', medicines)
-        c.execute('SELECT COUNT(*) AS c FROM doctors')
-        if (c.fetchone().get('c') or 0) == 0:
-            doctors = [
-                ('Aisha Khan', 'Dermatology', 8, 199.0, 'https://randomuser.me/api/portraits/women/33.jpg'),
-                ('Ravi Verma', 'General Medicine', 12, 199.0, 'https://randomuser.me/api/portraits/men/32.jpg'),
-                ('Neha Sharma', 'Pediatrics', 6, 199.0, 'https://randomuser.me/api/portraits/women/65.jpg')
-            ]
-            c.executemany('INSERT INTO doctors(name, specialty, experience_years, consultation_fee, image_url) VALUES(%s, %s, %s, %s, %s)', doctors)
-        c.execute('SELECT COUNT(*) AS c FROM labs')
-        if (c.fetchone().get('c') or 0) == 0:
-            labs = [
-                ('SRL Diagnostics', 'Mumbai', '+91-90000-00001'),
-                ('Lal PathLabs', 'Delhi', '+91-90000-00002')
-            ]
-            c.executemany('INSERT INTO labs(name, city, contact) VALUES(%s, %s, %s)', labs)
-            c.execute('SELECT id, name FROM labs')
-            labs_map = {row['name']: row['id'] for row in c.fetchall()}
-            lab_tests = [
-                ('Complete Blood Count (CBC)', 'Hematology', 399.0, labs_map['SRL Diagnostics']),
-                ('Lipid Profile', 'Biochemistry', 699.0, labs_map['Lal PathLabs']),
-                ('Thyroid Profile (T3, T4, TSH)', 'Hormone', 499.0, labs_map['SRL Diagnostics'])
-            ]
-            c.executemany('INSERT INTO lab_tests(name, category, price, lab_id) VALUES(%s, %s, %s, %s)', lab_tests)
+        run_migrations(conn, eng)
+        c.execute('CREATE TABLE IF NOT EXISTS schema_meta (name VARCHAR(64) PRIMARY KEY, value VARCHAR(255))')
+        ph = '?' if eng == 'sqlite' else '%s'
+        c.execute("DELETE FROM schema_meta WHERE name = 'fingerprint'")
+        c.execute(f"INSERT INTO schema_meta(name, value) VALUES('fingerprint', {ph})", (SCHEMA_FINGERPRINT,))
         conn.commit()
+        return True
+    finally:
+        conn.close()
 
+SEED_CATEGORIES = ['Pain Relief', 'Antibiotic', 'Diabetes', 'Vitamins', 'Cardiovascular', 'Antiseptic', 'Digestive', 'Prescription']
+SEED_MEDICINES = [
+    ('paracetamol', 'Paracetamol 500mg Tablets', 'Paracetamol', "Bell's", 'Pain relief and fever reducer.', 45.0, 1000, 'Pain Relief', 'https://images.unsplash.com/photo-1559757148-5c350d0d3c56?w=200&h=200&fit=crop&crop=center'),
+    ('ibuprofen', 'Ibuprofen 400mg Tablets', 'Ibuprofen', 'Generic', 'NSAID for pain and inflammation.', 65.0, 800, 'Pain Relief', 'https://images.unsplash.com/photo-1587854692152-cbe660dbde88?w=200&h=200&fit=crop&crop=center'),
+    ('amoxicillin', 'Amoxicillin 500mg Capsules', 'Amoxicillin', 'Generic', 'Broad-spectrum antibiotic.', 120.0, 500, 'Antibiotic', 'https://images.unsplash.com/photo-1584308666744-24d5c474f2ae?w=200&h=200&fit=crop&crop=center'),
+    ('metformin', 'Metformin 500mg Tablets', 'Metformin', 'Generic', 'Type 2 diabetes management.', 75.0, 1200, 'Diabetes', 'https://images.unsplash.com/photo-1576671081837-49000212a370?w=200&h=200&fit=crop&crop=center'),
+    ('vitamin-d', 'Vitamin D3 1000 IU Tablets', 'Cholecalciferol', 'Generic', 'Bone health and immunity support.', 350.0, 300, 'Vitamins', 'https://images.unsplash.com/photo-1582719478250-c89cae4dc85b?w=200&h=200&fit=crop&crop=center'),
+    ('atorvastatin', 'Atorvastatin 20mg Tablets', 'Atorvastatin', 'Generic', 'Cholesterol management.', 180.0, 600, 'Cardiovascular', 'https://images.unsplash.com/photo-1584308666744-24d5c474f2ae?w=200&h=200&fit=crop&crop=center'),
+]
+SEED_DOCTORS = [
+    ('Aisha Khan', 'Dermatology', 8, 199.0, 'https://randomuser.me/api/portraits/women/33.jpg'),
+    ('Ravi Verma', 'General Medicine', 12, 199.0, 'https://randomuser.me/api/portraits/men/32.jpg'),
+    ('Neha Sharma', 'Pediatrics', 6, 199.0, 'https://randomuser.me/api/portraits/women/65.jpg'),
+]
+SEED_LABS = [('SRL Diagnostics', 'Mumbai', '+91-90000-00001'), ('Lal PathLabs', 'Delhi', '+91-90000-00002')]
+SEED_LAB_TESTS = [
+    ('Complete Blood Count (CBC)', 'Hematology', 399.0, 'SRL Diagnostics'),
+    ('Lipid Profile', 'Biochemistry', 699.0, 'Lal PathLabs'),
+    ('Thyroid Profile (T3, T4, TSH)', 'Hormone', 499.0, 'SRL Diagnostics'),
+]
 
-app = Flask(__name__, static_folder=BASE_DIR, static_url_path='')
+def seed_db(db):
+    # Demo catalog plus one sample customer journey (address, order, delivery,
+    # appointment, lab order and result), each only into tables that are still empty.
+    # Same data on both engines. Returns {table: rows inserted}.
+    added = Counter()
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
-@app.before_request
-def before_request():
-    get_db()
+    def empty(table):
+        return db.execute(f'SELECT 1 AS x FROM {table} LIMIT 1').fetchone() is None
 
-@app.teardown_appcontext
-def teardown_db(exception):
-    close_db()
+    def first_id(table):
+        row = db.execute(f'SELECT id FROM {table} ORDER BY id LIMIT 1').fetchone()
+        return row['id'] if row else None
 
-@app.route('/')
-def index():
-    # Serve the reorganized home page explicitly from pages/home
-    home_dir = os.path.join(BASE_DIR, 'pages', 'home')
-    return send_from_directory(home_dir, 'index.html')
+    if empty('categories'):
+        db.executemany('INSERT INTO categories(name) VALUES(?)', [(n,) for n in SEED_CATEGORIES])
+        added['categories'] += len(SEED_CATEGORIES)
+    if empty('medicines'):
+        cats = {r['name']: r['id'] for r in db.execute('SELECT id, name FROM categories').fetchall()}
+        db.executemany('INSERT INTO medicines(slug, name, generic_name, brand, description, price, stock, category_id, image_url) '
+                       'VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?)', [(*m[:7], cats.get(m[7]), m[8]) for m in SEED_MEDICINES])
+        added['medicines'] += len(SEED_MEDICINES)
+    if empty('doctors'):
+        db.executemany('INSERT INTO doctors(name, specialty, experience_years, consultation_fee, image_url) VALUES(?, ?, ?, ?, ?)', SEED_DOCTORS)
+        added['doctors'] += len(SEED_DOCTORS)
+    if empty('labs'):
+        db.executemany('INSERT INTO labs(name, city, contact) VALUES(?, ?, ?)', SEED_LABS)
+        added['labs'] += len(SEED_LABS)
+        labs = {r['name']: r['id'] for r in db.execute('SELECT id, name FROM labs').fetchall()}
+        db.executemany('INSERT INTO lab_tests(name, category, price, lab_id) VALUES(?, ?, ?, ?)',
+                       [(*t[:3], labs.get(t[3])) for t in SEED_LAB_TESTS])
+        added['lab_tests'] += len(SEED_LAB_TESTS)
 
-@app.route('/api/db/summary')
-def api_db_summary():
-    db = get_db()
-    if db.engine == 'sqlite':
-        tables_rows = db.execute("SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%' ORDER BY name").fetchall()
-        tables = [r['name'] if isinstance(r, sqlite3.Row) else r[0] for r in tables_rows]
-        summary = {}
-        for t in tables:
-            cols = db.execute(f"PRAGMA table_info({t})").fetchall()
-            fks = db.execute(f"PRAGMA foreign_key_list({t})").fetchall()
-            count = db.execute(f"SELECT COUNT(*) AS c FROM {t}").fetchone()[0]
-            sample = db.execute(f"SELECT * FROM {t} LIMIT 5").fetchall()
-            summary[t] = {
-                'columns': [
-                    {
-                        'cid': c['cid'] if isinstance(c, sqlite3.Row) else c[0],
-                        'name': c['name'] if isinstance(c, sqlite3.Row) else c[1],
-                        'type': c['type'] if isinstance(c, sqlite3.Row) else c[2],
-                        'notnull': c['notnull'] if isinstance(c, sqlite3.Row) else c[3],
-                        'dflt_value': c['dflt_value'] if isinstance(c, sqlite3.Row) else c[4],
-                        'pk': c['pk'] if isinstance(c, sqlite3.Row) else c[5],
-                    } for c in cols
-                ],
-                'foreign_keys': [
-                    {
-                        'id': fk['id'] if isinstance(fk, sqlite3.Row) else fk[0],
-                        'seq': fk['seq'] if isinstance(fk, sqlite3.Row) else fk[1],
-                        'table': fk['table'] if isinstance(fk, sqlite3.Row) else fk[2],
-                        'from': fk['from'] if isinstance(fk, sqlite3.Row) else fk[3],
-                        'to': fk['to'] if isinstance(fk, sqlite3.Row) else fk[4],
-                        'on_update': fk['on_update'] if isinstance(fk, sqlite3.Row) else fk[5],
-                        'on_delete': fk['on_delete'] if isinstance(fk, sqlite3.Row) else fk[6],
-                        'match': fk['match'] if isinstance(fk, sqlite3.Row) else fk[7],
-                    } for fk in fks
-                ],
-                'row_count': count,
-                'sample_rows': [dict(r) for r in sample],
-            }
-        return jsonify({'db_path': DB_PATH, 'tables': tables, 'summary': summary})
-    else:
-        tables_rows = db.execute("SELECT table_name FROM information_schema.tables WHERE table_schema = DATABASE() AND table_type='BASE TABLE' ORDER BY table_name").fetchall()
-        tables = [r['table_name'] for r in tables_rows]
-        summary = {}
-        for t in tables:
-            cols = db.execute("SELECT column_name, data_type, is_nullable, column_default, column_key FROM information_schema.columns WHERE table_schema = DATABASE() AND table_name = ? ORDER BY ordinal_position", (t,)).fetchall()
-            fks = db.execute(
-                "SELECT k.constraint_name, k.table_name, k.column_name, k.referenced_table_name, k.referenced_column_name, rc.update_rule, rc.delete_rule "
-                "FROM information_schema.key_column_usage k "
-                "LEFT JOIN information_schema.referential_constraints rc "
-                "ON k.constraint_name = rc.constraint_name AND k.table_schema = rc.constraint_schema "
-                "WHERE k.table_schema = DATABASE() AND k.table_name = ? AND k.referenced_table_name IS NOT NULL",
-                (t,)
-            ).fetchall()
-            ct = db.execute(f"SELECT COUNT(*) AS c FROM {t}").fetchone()
-            count = ct.get('c') if isinstance(ct, dict) else (ct[0] if ct else 0)
-            sample_rows = db.execute(f"SELECT * FROM {t} LIMIT 5").fetchall()
-            summary[t] = {
-                'columns': [
-                    {
-                        'name': c.get('column_name'),
-                        'type': c.get('data_type'),
-                        'notnull': 0 if (c.get('is_nullable') == 'YES') else 1,
-                        'dflt_value': c.get('column_default'),
-                        'pk': 1 if (c.get('column_key') == 'PRI') else 0,
-                    } for c in cols
-                ],
-                'foreign_keys': [
-                    {
-                        'table': fk.get('referenced_table_name'),
-                        'from': fk.get('column_name'),
-                        'to': fk.get('referenced_column_name'),
-                        'on_update': fk.get('update_rule'),
-                        'on_delete': fk.get('delete_rule'),
-                    } for fk in fks
-                ],
-                'row_count': int(count or 0),
-                'sample_rows': list(sample_rows),
-            }
-        cfg = _mysql_cfg()
-        dsn = {'host': cfg['host'], 'port': cfg['port'], 'db': cfg['db'], 'user': cfg['user']}
-        return jsonify({'db_path': dsn, 'tables': tables, 'summary': summary})
+    if empty('users'):
+        db.execute('INSERT INTO users(name, email, phone, role) VALUES(?, ?, ?, ?)', ('Test User', 'test@example.com', '+91-90000-00000', 'customer'))
+        added['users'] += 1
+    user_id = first_id('users')
+    if empty('addresses'):
+        db.execute('INSERT INTO addresses(user_id, line1, city, pincode, is_default) VALUES(?, ?, ?, ?, ?)', (user_id, '221B Baker Street', 'Delhi', '110001', 1))
+        added['addresses'] += 1
+    med = db.execute('SELECT id, price FROM medicines ORDER BY id LIMIT 1').fetchone()
+    if empty('orders'):
+        order_id = db.execute('INSERT INTO orders(user_id, status, total_amount, created_at) VALUES(?, ?, ?, ?)',
+                              (user_id, 'pending', med['price'], now)).lastrowid
+        db.execute('INSERT INTO order_items(order_id, medicine_id, quantity, price) VALUES(?, ?, ?, ?)', (order_id, med['id'], 1, med['price']))
+        added['orders'] += 1
+        added['order_items'] += 1
+    if empty('delivery_persons'):
+        db.execute('INSERT INTO delivery_persons(name, phone, vehicle_type) VALUES(?, ?, ?)', ('Rahul Kumar', '+91-90000-00003', 'Bike'))
+        added['delivery_persons'] += 1
+    if empty('deliveries'):
+        db.execute('INSERT INTO deliveries(order_id, delivery_person_id, address_id, status, scheduled_at) VALUES(?, ?, ?, ?, ?)',
+                   (first_id('orders'), first_id('delivery_persons'), first_id('addresses'), 'scheduled', now))
+        added['deliveries'] += 1
+    doc_id = first_id('doctors')
+    if empty('doctor_availability'):
+        db.execute('INSERT INTO doctor_availability(doctor_id, day_of_week, start_time, end_time) VALUES(?, ?, ?, ?)', (doc_id, 1, '10:00:00', '16:00:00'))
+        added['doctor_availability'] += 1
+    if empty('appointments'):
+        db.execute('INSERT INTO appointments(user_id, doctor_id, scheduled_at, status) VALUES(?, ?, ?, ?)', (user_id, doc_id, now, 'scheduled'))
+        added['appointments'] += 1
+    if empty('lab_orders'):
+        lab_order_id = db.execute('INSERT INTO lab_orders(user_id, lab_test_id, scheduled_at, status) VALUES(?, ?, ?, ?)',
+                                  (user_id, first_id('lab_tests'), now, 'scheduled')).lastrowid
+        db.execute('INSERT INTO lab_results(lab_order_id, result_summary, status, reported_at) VALUES(?, ?, ?, ?)',
+                   (lab_order_id, 'All parameters within normal range', 'completed', now))
+        added['lab_orders'] += 1
+        added['lab_results'] += 1
+    db.commit()
+    if added['orders'] or added['medicines']:
+        rebuild_rollups(db)
+    return dict(added)
 
-@app.route('/api/medicines')
-def api_medicines():
-    db = get_db()
-    rows = db.execute('''
-        SELECT m.id, m.slug, m.name, m.generic_name, m.brand, m.description, m.price, m.stock, m.image_url,
-               c.name as category_name
-        FROM medicines m
-        LEFT JOIN categories c ON m.category_id = c.id
-        ORDER BY m.name ASC
-    ''').fetchall()
-    return jsonify([dict(r) for r in rows])
+def _export_value(value):
+    # same text on both engines: DECIMAL as a number, DATETIME like SQLite's datetime('now'),
+    # TIME (a timedelta from pymysql) as 'HH:MM:SS'
+    if isinstance(value, datetime):
+        return value.isoformat(sep=' ')
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, timedelta):
+        minutes, seconds = divmod(int(value.total_seconds()), 60)
+        return f'{minutes // 60:02d}:{minutes % 60:02d}:{seconds:02d}'
+    return value
 
-@app.route('/api/categories')
-def api_categories():
-    db = get_db()
-    rows = db.execute('SELECT id, name FROM categories ORDER BY name').fetchall()
-    return jsonify([dict(r) for r in rows])
+_COLUMN_ENCODERS = {
+    Decimal: float,
+    datetime: functools.partial(datetime.isoformat, sep=' '),
+    date: date.isoformat,
+    timedelta: _export_value,
+}
 
-@app.route('/api/doctors')
-def api_doctors():
-    db = get_db()
-    rows = db.execute('SELECT id, name, specialty, experience_years, consultation_fee, image_url FROM doctors ORDER BY name').fetchall()
-    return jsonify([dict(r) for r in rows])
+def _json_default(value):
+    if isinstance(value, Rows):
+        return value.dicts()
+    out = _export_value(value)
+    if out is value:
+        raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+    return out
 
-@app.route('/api/lab-tests')
-def api_lab_tests():
+def _load_orjson(choice):
+    if choice != 'orjson':
+        return None
+    try:
+        import orjson
+    except ImportError:
+        return None
+    return orjson
+
+
+class JSONProvider(DefaultJSONProvider):
+    # jsonify()/get_json() for the whole app. Values are written the same on both engines
+    # (see _export_value), Rows as a list of objects, keys in column order. Encodes with
+    # orjson when it is installed and JSON_PROVIDER isn't 'stdlib'; the json module
+    # produces the same document otherwise.
+    sort_keys = False
+    ensure_ascii = False
+    default = staticmethod(_json_default)
+
+    def __init__(self, app, backend=None):
+        super().__init__(app)
+        self._orjson = _load_orjson((backend or os.environ.get('JSON_PROVIDER') or 'orjson').strip().lower())
+        if self._orjson is not None:
+            self._options = self._orjson.OPT_PASSTHROUGH_DATETIME | self._orjson.OPT_NON_STR_KEYS
+
+    @property
+    def name(self):
+        return 'orjson' if self._orjson is not None else 'stdlib'
+
+    def dumpb(self, obj):
+        # compact UTF-8 bytes
+        if self._orjson is not None:
+            return self._orjson.dumps(obj, default=_json_default, option=self._options)
+        return super().dumps(obj, separators=(',', ':')).encode()
+
+    def dumps(self, obj, **kwargs):
+        if self._orjson is not None and not kwargs:
+            return self.dumpb(obj).decode()
+        return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        if self._orjson is not None and not kwargs:
+            return self._orjson.loads(s)
+        return super().loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            return super().response(*args, **kwargs)
+        return self._app.response_class(self.dumpb(self._prepare_response_obj(args, kwargs)) + b'\n',
+                                        mimetype=self.mimetype)
+
+
+app = Flask(__name__, static_folder=None)
+app.json = JSONProvider(app)
+
+STATIC_MAX_AGE = _env_int('STATIC_MAX_AGE', 7 * 24 * 3600)
+_STATIC_ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+_STATIC_COMPRESSIBLE = ('.html', '.css', '.js', '.json', '.svg', '.txt', '.md', '.sql')
+
+def _send_static(directory, filename):
+    # Static files never touch the database. Precompressed siblings (foo.css.br /
+    # foo.css.gz, see `flask compress-static`) are preferred when the client accepts
+    # them; ETag/Last-Modified come from send_file's conditional handling.
+    path = safe_join(directory, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    accepted = request.accept_encodings
+    encoding = None
+    for enc, suffix in _STATIC_ENCODINGS:
+        if accepted[enc] and os.path.isfile(path + suffix):
+            path, encoding = path + suffix, enc
+            break
+    # pages link assets by unversioned URL, so HTML is always revalidated (cheap 304)
+    max_age = None if mimetype == 'text/html' else STATIC_MAX_AGE
+    resp = send_file(path, mimetype=mimetype, conditional=True, etag=True, max_age=max_age)
+    if encoding:
+        resp.headers['Content-Encoding'] = encoding
+    if filename.endswith(_STATIC_COMPRESSIBLE):
+        resp.vary.add('Accept-Encoding')
+    return resp
+
+@app.route('/<path:filename>')
+def static_files(filename):
+    if filename.startswith('api/'):
+        abort(404)
+    return _send_static(BASE_DIR, filename)
+
+@app.cli.command('compress-static')
+def compress_static():
+    """Write .gz (and .br when brotli is installed) next to compressible static files."""
+    import gzip
+    try:
+        import brotli
+    except ImportError:
+        brotli = None
+    count = 0
+    for sub in ('assets', 'pages'):
+        for root, _, files in os.walk(os.path.join(BASE_DIR, sub)):
+            for name in files:
+                if not name.endswith(_STATIC_COMPRESSIBLE):
+                    continue
+                src = os.path.join(root, name)
+                with open(src, 'rb') as f:
+                    data = f.read()
+                with open(src + '.gz', 'wb') as f:
+                    f.write(gzip.compress(data, compresslevel=9, mtime=0))
+                if brotli is not None:
+                    with open(src + '.br', 'wb') as f:
+                        f.write(brotli.compress(data, quality=11))
+                count += 1
+    print(f'compressed {count} files' + ('' if brotli else ' (gzip only, brotli not installed)'))
+
+class ResponseCache:
+    # LRU + TTL cache of serialized JSON response bodies, keyed by path and query string.
+    # Entries are tagged with the tables they were read from; invalidate() drops every
+    # entry touching a written table and bumps that table's version so a response that
+    # was being computed during the write is not stored afterwards.
+    def __init__(self, max_entries=512, ttl=300.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._written_at = {}
+        self._stats = {'hits': 0, 'misses': 0, 'stores': 0, 'not_modified': 0, 'evictions': 0, 'expired': 0, 'invalidations': 0}
+
+    def versions(self, tables):
+        with self._lock:
+            return tuple(self._versions.get(t, 0) for t in tables)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+            if entry[0] < time.monotonic():
+                del self._entries[key]
+                self._stats['expired'] += 1
+                self._stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return entry
+
+    def put(self, key, tables, versions, body, ttl=None):
+        etag = hashlib.sha1(body).hexdigest()[:20]
+        entry = (time.monotonic() + (self.ttl if ttl is None else ttl), body, etag, tables)
+        with self._lock:
+            if tuple(self._versions.get(t, 0) for t in tables) != versions:
+                return entry
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            self._stats['stores'] += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+        return entry
+
+    def invalidate(self, tables):
+        now = time.monotonic()
+        with self._lock:
+            for t in tables:
+                self._versions[t] = self._versions.get(t, 0) + 1
+                self._written_at[t] = now
+            stale = [k for k, e in self._entries.items() if not tables.isdisjoint(e[3])]
+            for k in stale:
+                del self._entries[k]
+            self._stats['invalidations'] += len(stale)
+
+    def written_within(self, tables, seconds):
+        since = time.monotonic() - seconds
+        with self._lock:
+            return any(self._written_at.get(t, since) > since for t in tables)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def stats(self):
+        with self._lock:
+            out = dict(self._stats)
+            out.update({'entries': len(self._entries), 'max_entries': self.max_entries, 'ttl': self.ttl,
+                        'bytes': sum(len(e[1]) for e in self._entries.values())})
+        lookups = out['hits'] + out['misses']
+        out['hit_ratio'] = round(out['hits'] / lookups, 4) if lookups else 0.0
+        return out
+
+
+CACHE_ENABLED = (os.environ.get('CACHE_ENABLED') or '1').strip().lower() not in ('0', 'false', 'no', 'off')
+response_cache = ResponseCache(max_entries=_env_int('CACHE_MAX_ENTRIES', 512), ttl=_env_float('CACHE_TTL', 300.0))
+CATALOG_TABLES = frozenset(('medicines', 'medicine_stock', 'categories', 'doctors', 'labs', 'lab_tests'))
+
+@on_tables_written
+def _invalidate_catalog_cache(tables):
+    catalog = CATALOG_TABLES & tables
+    if catalog:
+        response_cache.invalidate(catalog)
+
+def _cached_response(entry):
+    _, body, etag, _ = entry
+    if request.if_none_match.contains_weak(etag):  # If-None-Match uses weak comparison
+        response_cache.count('not_modified')
+        resp = app.response_class(status=304)
+    else:
+        resp = app.response_class(body, mimetype='application/json')
+    resp.set_etag(etag)
+    resp.cache_control.no_cache = True
+    return resp
+
+def cached_json(*tables, ttl=None, tables_for=None):
+    # Read-through cache for GET endpoints whose JSON depends only on `tables` and the
+    # query string (or on tables_for(request.args), when that depends on the query).
+    # Only 200 responses are stored, as the bytes that were sent.
+    fixed = frozenset(tables)
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if not CACHE_ENABLED:
+                return view(*args, **kwargs)
+            tables = frozenset(tables_for(request.args)) if tables_for is not None else fixed
+            key = request.path + '?' + '&'.join(f'{k}={v}' for k, v in sorted(request.args.items(multi=True)))
+            entry = _shared.snapshot.get(key) if _shared is not None else None
+            if entry is None:
+                entry = response_cache.get(key)
+            if entry is None:
+                versions = response_cache.versions(tables)
+                resp = app.make_response(view(*args, **kwargs))
+                if resp.status_code != 200 or not resp.is_json:
+                    return resp
+                db = g.get('_db')
+                if db is not None and db.replica is not None and response_cache.written_within(tables, REPLICA_STICKY_SECONDS):
+                    return resp  # the replica may not have the write yet; don't pin its answer
+                entry = response_cache.put(key, tables, versions, resp.get_data(), ttl)
+            return _cached_response(entry)
+        return wrapper
+    return decorator
+
+@app.teardown_appcontext
+def teardown_db(exception):
+    close_db()
+
+N_PLUS_ONE_THRESHOLD = _env_int('N_PLUS_ONE_THRESHOLD', 10)
+REQUEST_QUERY_WARN = _env_int('REQUEST_QUERY_WARN', 50)
+
+@app.before_request
+def _start_timer():
+    g._t0 = time.perf_counter()
+
+def record_request(endpoint, method, status, elapsed, stats):
+    # per-endpoint metrics and warnings for chatty requests; returns the Server-Timing
+    # header values (shared with the ASGI mode in asgi.py)
+    labels = (('endpoint', endpoint),)
+    metrics.inc('genricycle_http_requests_total', (('endpoint', endpoint), ('method', method), ('status', status)))
+    metrics.observe('genricycle_http_request_duration_seconds', elapsed, labels)
+    metrics.observe('genricycle_db_queries_per_request', stats.count, labels)
+    if stats.count:
+        metrics.inc('genricycle_db_queries_total', labels, stats.count)
+        metrics.inc('genricycle_db_rows_total', labels, stats.rows)
+        metrics.observe('genricycle_db_time_per_request_seconds', stats.ms / 1000.0, labels)
+        repeated = stats.repeated(N_PLUS_ONE_THRESHOLD)
+        if repeated:
+            metrics.inc('genricycle_db_repeated_queries_total', labels)
+            shape, n = max(repeated.items(), key=lambda kv: kv[1])
+            app.logger.warning('%s %s ran one query %d times (N+1?): %s', method, endpoint, n, shape)
+        if stats.count >= REQUEST_QUERY_WARN:
+            app.logger.warning('%s %s ran %d queries (%.1fms); top: %s', method, endpoint, stats.count, stats.ms, stats.top(3))
+    return (f'db;dur={stats.ms:.2f};desc="{stats.count} queries, {stats.rows} rows"', f'app;dur={elapsed * 1000.0:.2f}')
+
+@app.after_request
+def _record_request(resp):
+    t0 = g.pop('_t0', None)
+    if t0 is None:
+        return resp
+    endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    db = g.get('_db')
+    timing = record_request(endpoint, request.method, resp.status_code, time.perf_counter() - t0,
+                            db.stats if db is not None else QueryStats())
+    for value in timing:
+        resp.headers.add('Server-Timing', value)
+    return resp
+
+@app.after_request
+def _read_your_writes(resp):
+    # a client that just wrote reads from the primary for REPLICA_STICKY_SECONDS; a cookie,
+    # so it holds whichever worker serves the next request
+    db = g.get('_db')
+    if db is not None and db.wrote and get_replicas() is not None:
+        resp.set_cookie(READ_PRIMARY_COOKIE, f'{time.time() + REPLICA_STICKY_SECONDS:.3f}',
+                        max_age=int(REPLICA_STICKY_SECONDS) + 1, httponly=True, samesite='Lax')
+    return resp
+
+METRICS_ENABLED = (os.environ.get('METRICS_ENABLED') or '1').strip().lower() not in ('0', 'false', 'no', 'off')
+
+@app.route('/metrics')
+def metrics_endpoint():
+    if not METRICS_ENABLED:
+        abort(404)
+    gauges = []
+    if _pool is not None:
+        pool = _pool.stats()
+        gauges.append(('genricycle_db_pool_connections', 'Pooled connections by state.',
+                       [((('state', 'idle'),), pool['idle']), ((('state', 'in_use'),), pool['in_use'])]))
+        gauges.append(('genricycle_db_pool_waits', 'Checkouts that had to wait for a connection (cumulative).',
+                       [((), pool['waits'])]))
+    if _replicas is not None:
+        replicas = _replicas.stats()
+        gauges.append(('genricycle_db_replica_up', '1 when the replica is in rotation (healthy, lag <= DB_REPLICA_MAX_LAG).',
+                       [((('replica', r['name']),), int(r['in_rotation'])) for r in replicas]))
+        gauges.append(('genricycle_db_replica_lag_seconds', 'Replication lag at the last check.',
+                       [((('replica', r['name']),), r['lag_seconds']) for r in replicas if r['lag_seconds'] is not None]))
+    try:
+        depth = job_queue.depth(get_db())
+    except Exception:
+        app.logger.warning('job queue depth unavailable', exc_info=True)
+        depth = []
+    now = time.time()
+    gauges.append(('genricycle_jobs', 'Background jobs by kind and status (queued, running, dead).',
+                   [((('kind', r['kind']), ('status', r['status'])), r['n']) for r in depth]))
+    gauges.append(('genricycle_job_oldest_seconds', 'Age of the oldest queued or running job, by kind.',
+                   [((('kind', r['kind']), ('status', r['status'])), round(now - r['oldest'], 3))
+                    for r in depth if r['status'] != 'dead']))
+    cache = response_cache.stats()
+    gauges.append(('genricycle_response_cache', 'Response cache counters and size (see /api/cache/stats).',
+                   [((('stat', k),), v) for k, v in cache.items()]))
+    return app.response_class(metrics.render(gauges), mimetype='text/plain; version=0.0.4')
+
+@app.errorhandler(PoolTimeout)
+def handle_pool_timeout(e):
+    return jsonify({'error': 'database busy, try again'}), 503
+
+@app.route('/')
+def index():
+    # Serve the reorganized home page explicitly from pages/home
+    home_dir = os.path.join(BASE_DIR, 'pages', 'home')
+    return _send_static(home_dir, 'index.html')
+
+DB_SUMMARY_TTL = _env_float('DB_SUMMARY_TTL', 10.0)
+
+def _sqlite_schema(db):
+    # one query per metadata category via the pragma table-valued functions
+    tables = [r['name'] for r in db.execute("SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%' ORDER BY name").fetchall()]
+    columns = {t: [] for t in tables}
+    for c in db.execute(
+        "SELECT m.name AS tbl, p.cid, p.name, p.type, p.\"notnull\", p.dflt_value, p.pk "
+        "FROM sqlite_master m JOIN pragma_table_info(m.name) p "
+        "WHERE m.type = 'table' AND m.name NOT LIKE 'sqlite_%' ORDER BY m.name, p.cid"
+    ).fetchall():
+        columns[c['tbl']].append({'cid': c['cid'], 'name': c['name'], 'type': c['type'], 'notnull': c['notnull'], 'dflt_value': c['dflt_value'], 'pk': c['pk']})
+    fks = {t: [] for t in tables}
+    for fk in db.execute(
+        "SELECT m.name AS tbl, f.id, f.seq, f.\"table\", f.\"from\", f.\"to\", f.on_update, f.on_delete, f.\"match\" "
+        "FROM sqlite_master m JOIN pragma_foreign_key_list(m.name) f "
+        "WHERE m.type = 'table' AND m.name NOT LIKE 'sqlite_%' ORDER BY m.name, f.id, f.seq"
+    ).fetchall():
+        fks[fk['tbl']].append({k: fk[k] for k in ('id', 'seq', 'table', 'from', 'to', 'on_update', 'on_delete', 'match')})
+    return tables, columns, fks, None
+
+def _mysql_schema(db):
+    stats = {}
+    tables = []
+    for r in db.execute("SELECT table_name AS t, table_rows AS n FROM information_schema.tables WHERE table_schema = DATABASE() AND table_type='BASE TABLE' ORDER BY table_name").fetchall():
+        tables.append(r['t'])
+        stats[r['t']] = int(r['n'] or 0)
+    columns = {t: [] for t in tables}
+    for c in db.execute(
+        "SELECT table_name AS t, column_name AS column_name, data_type AS data_type, is_nullable AS is_nullable, "
+        "column_default AS column_default, column_key AS column_key "
+        "FROM information_schema.columns WHERE table_schema = DATABASE() ORDER BY table_name, ordinal_position"
+    ).fetchall():
+        if c['t'] in columns:
+            columns[c['t']].append({
+                'name': c['column_name'], 'type': c['data_type'], 'notnull': 0 if c['is_nullable'] == 'YES' else 1,
+                'dflt_value': c['column_default'], 'pk': 1 if c['column_key'] == 'PRI' else 0,
+            })
+    fks = {t: [] for t in tables}
+    for fk in db.execute(
+        "SELECT k.table_name AS t, k.column_name AS column_name, k.referenced_table_name AS referenced_table_name, "
+        "k.referenced_column_name AS referenced_column_name, rc.update_rule AS update_rule, rc.delete_rule AS delete_rule "
+        "FROM information_schema.key_column_usage k "
+        "LEFT JOIN information_schema.referential_constraints rc "
+        "ON k.constraint_name = rc.constraint_name AND k.table_schema = rc.constraint_schema "
+        "WHERE k.table_schema = DATABASE() AND k.referenced_table_name IS NOT NULL "
+        "ORDER BY k.table_name, k.constraint_name, k.ordinal_position"
+    ).fetchall():
+        if fk['t'] in fks:
+            fks[fk['t']].append({'table': fk['referenced_table_name'], 'from': fk['column_name'], 'to': fk['referenced_column_name'],
+                                 'on_update': fk['update_rule'], 'on_delete': fk['delete_rule']})
+    return tables, columns, fks, stats
+
+def _row_counts(db, tables, exact, stats):
+    # Approximate counts come from table statistics (InnoDB table_rows, sqlite_stat1 or
+    # MAX(rowid)); exact counts are still a scan per table, but one round-trip in total.
+    if not tables:
+        return {}
+    if not exact and stats is not None:
+        return {t: stats.get(t, 0) for t in tables}
+    if not exact:
+        has_stat1 = db.execute("SELECT COUNT(*) FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone()[0]
+        counts = {}
+        if has_stat1:
+            for r in db.execute('SELECT tbl, stat FROM sqlite_stat1').fetchall():
+                if r['tbl'] in tables and r['tbl'] not in counts:
+                    counts[r['tbl']] = int(r['stat'].split()[0])
+        missing = [t for t in tables if t not in counts]
+        if missing:
+            sql = ' UNION ALL '.join(f"SELECT '{t}' AS t, COALESCE(MAX(rowid), 0) AS n FROM \"{t}\"" for t in missing)
+            counts.update({r['t']: r['n'] for r in db.execute(sql).fetchall()})
+        return counts
+    q = '`' if db.engine == 'mysql' else '"'
+    sql = ' UNION ALL '.join(f"SELECT '{t}' AS t, COUNT(*) AS n FROM {q}{t}{q}" for t in tables)
+    return {r['t']: int(r['n']) for r in db.execute(sql).fetchall()}
+
+@app.route('/api/db/summary')
+@cached_json(ttl=DB_SUMMARY_TTL)
+def api_db_summary():
+    # Without ?tables= this is an overview (schema + approximate counts, no samples);
+    # the viewer asks for ?tables=a,b to get sample rows for the tables it expands.
+    db = get_db()
+    if db.engine == 'sqlite':
+        tables, columns, fks, stats = _sqlite_schema(db)
+    else:
+        tables, columns, fks, stats = _mysql_schema(db)
+    selected = tables
+    detail = bool(request.args.get('tables'))
+    if detail:
+        wanted = {t.strip() for t in request.args['tables'].split(',') if t.strip()}
+        unknown = wanted.difference(tables)
+        if unknown:
+            return jsonify({'error': f"unknown tables: {', '.join(sorted(unknown))}"}), 400
+        selected = [t for t in tables if t in wanted]
+    exact = (request.args.get('count') or ('exact' if detail else 'approx')) == 'exact'
+    counts = _row_counts(db, selected, exact, stats)
+    q = '`' if db.engine == 'mysql' else '"'
+    summary = {}
+    for t in selected:
+        summary[t] = {
+            'columns': columns[t],
+            'foreign_keys': fks[t],
+            'row_count': int(counts.get(t) or 0),
+            'row_count_exact': exact,
+        }
+        if detail:
+            summary[t]['sample_rows'] = db.rows(f'SELECT * FROM {q}{t}{q} LIMIT 5')
+    if db.engine == 'sqlite':
+        db_path = DB_PATH
+    else:
+        cfg = _mysql_cfg()
+        db_path = {'host': cfg['host'], 'port': cfg['port'], 'db': cfg['db'], 'user': cfg['user']}
+    return jsonify({'db_path': db_path, 'tables': tables, 'summary': summary})
+
+@app.route('/api/db/pool')
+def api_db_pool():
+    stats = get_pool().stats()
+    if get_replicas() is not None:
+        stats['replicas'] = get_replicas().stats()
+    return jsonify(stats)
+
+@app.route('/api/cache/stats')
+def api_cache_stats():
+    out = response_cache.stats()
+    if _shared is not None:
+        out['snapshot'] = _shared.snapshot.stats()
+    return jsonify(out)
+
+# Public fields of /api/medicines and the SQL that produces each of them.
+MEDICINE_FIELDS = {
+    'id': 'm.id', 'slug': 'm.slug', 'name': 'm.name', 'generic_name': 'm.generic_name',
+    'brand': 'm.brand', 'description': 'm.description', 'price': 'm.price', 'stock': 'm.stock',
+    'image_url': 'm.image_url', 'category_id': 'm.category_id', 'category_name': 'c.name AS category_name',
+}
+# stock only when asked for (fields=...,stock): it changes with every order, and leaving
+# it out keeps checkout from evicting every cached page
+MEDICINE_DEFAULT_FIELDS = tuple(f for f in MEDICINE_FIELDS if f != 'stock')
+# sort name -> (keyset column, output key, direction); ties are broken by m.id
+MEDICINE_SORTS = {
+    'name': ('m.name', 'name', 'ASC'),
+    'price_asc': ('m.price', 'price', 'ASC'),
+    'price_desc': ('m.price', 'price', 'DESC'),
+    'newest': ('m.id', 'id', 'DESC'),
+}
+MEDICINES_DEFAULT_LIMIT = 24
+MEDICINES_MAX_LIMIT = 100
+
+def encode_cursor(values):
+    raw = json.dumps(values, separators=(',', ':'), default=float).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(token):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    except (ValueError, TypeError):
+        raise ValueError('invalid cursor')
+    if not isinstance(values, list) or len(values) != 2:
+        raise ValueError('invalid cursor')
+    return values
+
+def build_medicines_query(fields=None, sort='name', category_id=None, brand=None, min_price=None, max_price=None, q=None, after=None, limit=MEDICINES_DEFAULT_LIMIT):
+    # Keyset pagination: `after` is the (sort key, id) of the last row already sent, so
+    # every page is an index range read of `limit` rows regardless of its position.
+    key_col, key_name, direction = MEDICINE_SORTS[sort]
+    fields = list(fields or MEDICINE_DEFAULT_FIELDS)
+    select = [MEDICINE_FIELDS[f] for f in fields]
+    for col, name in (('m.id', 'id'), (key_col, key_name)):
+        if name not in fields:
+            select.append(col)
+    sql = 'SELECT ' + ', '.join(select) + ' FROM medicines m'
+    if 'category_name' in fields:
+        sql += ' LEFT JOIN categories c ON m.category_id = c.id'
+    where, params = [], []
+    if category_id is not None:
+        where.append('m.category_id = ?')
+        params.append(category_id)
+    if brand:
+        where.append('m.brand = ?')
+        params.append(brand)
+    if min_price is not None:
+        where.append('m.price >= ?')
+        params.append(min_price)
+    if max_price is not None:
+        where.append('m.price <= ?')
+        params.append(max_price)
+    if q:
+        like = '%' + q.replace('!', '!!').replace('%', '!%').replace('_', '!_') + '%'
+        where.append("(m.name LIKE ? ESCAPE '!' OR m.generic_name LIKE ? ESCAPE '!' OR m.brand LIKE ? ESCAPE '!')")
+        params.extend([like, like, like])
+    if after is not None:
+        op = '>' if direction == 'ASC' else '<'
+        if key_col == 'm.id':
+            where.append(f'm.id {op} ?')
+            params.append(after[1])
+        else:
+            # the leading `key >=` conjunct is what lets both engines seek the index
+            where.append(f'{key_col} {op}= ? AND ({key_col} {op} ? OR m.id {op} ?)')
+            params.extend([after[0], after[0], after[1]])
+    if where:
+        sql += ' WHERE ' + ' AND '.join(where)
+    if key_col == 'm.id':
+        sql += f' ORDER BY m.id {direction}'
+    else:
+        sql += f' ORDER BY {key_col} {direction}, m.id {direction}'
+    sql += ' LIMIT ?'
+    params.append(limit + 1)
+    return sql, params
+
+MEDICINE_BRANDS_SQL = 'SELECT DISTINCT brand FROM medicines WHERE brand IS NOT NULL ORDER BY brand'
+CATEGORIES_SQL = 'SELECT id, name FROM categories ORDER BY name'
+DOCTORS_SQL = 'SELECT id, name, specialty, experience_years, consultation_fee, image_url FROM doctors ORDER BY name'
+LAB_TESTS_SQL = '''
+    SELECT lt.id, lt.name, lt.category, lt.price, l.name AS lab_name, l.city
+    FROM lab_tests lt
+    LEFT JOIN labs l ON lt.lab_id = l.id
+    ORDER BY lt.name
+'''
+
+# (name, sql, sample params) for every catalog query; `flask check-indexes` fails if any
+# of them plans a full table scan or a filesort.
+CATALOG_EXPLAIN_CHECKS = [
+    ('medicines', *build_medicines_query()),
+    ('medicines page 2', *build_medicines_query(after=['M', 1])),
+    ('medicines by price', *build_medicines_query(sort='price_desc', after=[100.0, 1])),
+    ('medicines by category', *build_medicines_query(category_id=1, after=['M', 1])),
+    ('medicines by brand', *build_medicines_query(brand='Generic')),
+    ('medicine brands', MEDICINE_BRANDS_SQL, ()),
+    ('categories', CATEGORIES_SQL, ()),
+    ('doctors', DOCTORS_SQL, ()),
+    ('lab_tests', LAB_TESTS_SQL, ()),
+]
+
+def explain_catalog_queries(db, min_rows=None):
+    # MySQL legitimately prefers a scan + filesort for tiny tables, so plan steps
+    # estimated below min_rows rows are not reported there.
+    if min_rows is None:
+        min_rows = _env_int('EXPLAIN_MIN_ROWS', 1000)
+    problems = []
+    for name, sql, params in CATALOG_EXPLAIN_CHECKS:
+        if db.engine == 'sqlite':
+            for r in db.execute('EXPLAIN QUERY PLAN ' + sql, params).fetchall():
+                detail = r[3]
+                if 'TEMP B-TREE' in detail:
+                    problems.append((name, 'filesort', detail))
+                elif detail.startswith('SCAN ') and ' USING ' not in detail:
+                    problems.append((name, 'full scan', detail))
+        else:
+            for r in db.execute('EXPLAIN ' + sql, params).fetchall():
+                if int(r.get('rows') or 0) < min_rows:
+                    continue
+                detail = f"table={r.get('table')} type={r.get('type')} key={r.get('key')} extra={r.get('Extra')}"
+                if r.get('type') == 'ALL':
+                    problems.append((name, 'full scan', detail))
+                if 'Using filesort' in (r.get('Extra') or ''):
+                    problems.append((name, 'filesort', detail))
+    return problems
+
+@app.cli.command('migrate')
+def migrate_command():
+    """Apply pending schema migrations."""
     db = get_db()
-    rows = db.execute('''
-        SELECT lt.id, lt.name, lt.category, lt.price, l.name AS lab_name, l.city
-        FROM lab_tests lt
-        LEFT JOIN labs l ON lt.lab_id = l.id
-        ORDER BY lt.name
-    ''').fetchall()
-    return jsonify([dict(r) for r in rows])
+    done = run_migrations(db.raw, db.engine)
+    print(f'applied migrations: {done}' if done else 'schema is up to date')
+
+@app.cli.command('check-indexes')
+def check_indexes_command():
+    """EXPLAIN every catalog query; exit 1 on a full scan or filesort."""
+    problems = explain_catalog_queries(get_db())
+    for name, kind, detail in problems:
+        print(f'{name}: {kind}: {detail}')
+    if problems:
+        raise SystemExit(1)
+    print(f'{len(CATALOG_EXPLAIN_CHECKS)} catalog queries use indexes')
+
+def _float_arg(args, name):
+    value = args.get(name)
+    if value in (None, ''):
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        raise ValueError(f'{name} must be a number')
+
+def parse_medicines_args(args):
+    # query string of /api/medicines -> keyword arguments for build_medicines_query
+    # (category is a name, resolved by the caller); raises ValueError with the message
+    sort = args.get('sort') or 'name'
+    if sort not in MEDICINE_SORTS:
+        raise ValueError(f"sort must be one of {', '.join(MEDICINE_SORTS)}")
+    fields = None
+    if args.get('fields'):
+        fields = [f.strip() for f in args['fields'].split(',') if f.strip()]
+        unknown = [f for f in fields if f not in MEDICINE_FIELDS]
+        if unknown:
+            raise ValueError(f"unknown fields: {', '.join(unknown)}")
+    return {
+        'fields': fields,
+        'sort': sort,
+        'limit': min(max(int(args.get('limit') or MEDICINES_DEFAULT_LIMIT), 1), MEDICINES_MAX_LIMIT),
+        'after': decode_cursor(args['cursor']) if args.get('cursor') else None,
+        'min_price': _float_arg(args, 'min_price'),
+        'max_price': _float_arg(args, 'max_price'),
+        'category_id': int(args['category_id']) if args.get('category_id') else None,
+        'category': args.get('category') or None,
+        'brand': args.get('brand'),
+        'q': (args.get('q') or '').strip(),
+    }
+
+def medicines_page(rows, query):
+    # Rows fetched with limit + 1 -> the response body
+    limit, fields = query['limit'], query['fields']
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        _, key_name, _ = MEDICINE_SORTS[query['sort']]
+        next_cursor = encode_cursor([rows.value(-1, key_name), rows.value(-1, 'id')])
+    if fields and list(rows.columns) != fields:
+        rows = rows.project(fields)
+    return {'items': rows, 'next_cursor': next_cursor}
+
+def medicines_cache_tables(args):
+    # stock changes with every order: only the pages that ask for it depend on it
+    fields = {f.strip() for f in (args.get('fields') or '').split(',')}
+    return ('medicines', 'categories', 'medicine_stock') if 'stock' in fields else ('medicines', 'categories')
+
+@app.route('/api/medicines')
+@replica_reads
+@cached_json(tables_for=medicines_cache_tables)
+def api_medicines():
+    db = get_db()
+    try:
+        query = parse_medicines_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if query['category_id'] is None and query['category']:
+        row = db.execute('SELECT id FROM categories WHERE LOWER(name) = LOWER(?)', (query['category'],)).fetchone()
+        if not row:
+            return jsonify({'items': [], 'next_cursor': None})
+        query['category_id'] = row['id']
+    sql, params = build_medicines_query(query['fields'], query['sort'], query['category_id'], query['brand'], query['min_price'],
+                                        query['max_price'], query['q'], query['after'], query['limit'])
+    return jsonify(medicines_page(db.rows(sql, params), query))
+
+@app.route('/api/medicines/brands')
+@replica_reads
+@cached_json('medicines')
+def api_medicine_brands():
+    db = get_db()
+    rows = db.execute(MEDICINE_BRANDS_SQL).fetchall()
+    return jsonify([r['brand'] for r in rows])
+
+class SearchIndex:
+    # In-process inverted index over medicine name, generic name, brand and category.
+    # The last query token matches as a prefix (autocomplete); a token with no exact or
+    # prefix hit falls back to edit-distance-1 terms via a deletion-neighbourhood map.
+    # Ranking: names starting with the query come first (whole word before prefix, then
+    # by name), the rest by summed field-weighted score. Postings and names are kept
+    # sorted so the top-k are read off in order instead of scoring every candidate, and
+    # writers call upsert()/remove() so the index never needs a full rebuild.
+    FIELD_WEIGHTS = (('name', 3.0), ('generic_name', 2.0), ('brand', 1.5), ('category_name', 1.0))
+    PREFIX_QUALITY = 0.8
+    FUZZY_QUALITY = 0.5
+    NAME_PREFIX_BONUS = 1.0
+    MIN_FUZZY_LEN = 4
+    MAX_PREFIX_TERMS = 64
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._docs = {}
+        self._doc_terms = {}
+        self._keys = {}
+        self._names = []
+        self._postings = {}
+        self._terms = []
+        self._deletes = {}
+
+    @staticmethod
+    def tokenize(text):
+        return re.findall(r'[a-z0-9]+', (text or '').lower())
+
+    @staticmethod
+    def _delete_variants(term):
+        return {term[:i] + term[i + 1:] for i in range(len(term))} | {term}
+
+    def __len__(self):
+        return len(self._docs)
+
+    @classmethod
+    def build(cls, docs):
+        # bulk load: append everything, sort each list once
+        index = cls()
+        for doc in docs:
+            index._add(doc, sort=False)
+        index._names.sort()
+        index._terms = sorted(index._postings)
+        for posting in index._postings.values():
+            posting.sort()
+        return index
+
+    def upsert(self, doc):
+        with self._lock:
+            self._remove_locked(doc['id'])
+            self._add(doc, sort=True)
+
+    def _add(self, doc, sort):
+        doc_id = doc['id']
+        terms = {}
+        for field, weight in self.FIELD_WEIGHTS:
+            for t in self.tokenize(doc.get(field)):
+                if weight > terms.get(t, 0.0):
+                    terms[t] = weight
+        key = ' '.join(self.tokenize(doc.get('name')))
+        insert = bisect.insort if sort else list.append
+        self._docs[doc_id] = doc
+        self._doc_terms[doc_id] = terms
+        self._keys[doc_id] = key
+        insert(self._names, (key, doc_id))
+        for t, weight in terms.items():
+            posting = self._postings.get(t)
+            if posting is None:
+                posting = self._postings[t] = []
+                if sort:
+                    bisect.insort(self._terms, t)
+                if len(t) >= self.MIN_FUZZY_LEN:
+                    for d in self._delete_variants(t):
+                        self._deletes.setdefault(d, set()).add(t)
+            insert(posting, (-weight, key, doc_id))
+
+    def remove(self, doc_id):
+        with self._lock:
+            self._remove_locked(doc_id)
+
+    def _remove_locked(self, doc_id):
+        if doc_id not in self._docs:
+            return
+        del self._docs[doc_id]
+        key = self._keys.pop(doc_id)
+        del self._names[bisect.bisect_left(self._names, (key, doc_id))]
+        for t, weight in self._doc_terms.pop(doc_id).items():
+            posting = self._postings[t]
+            del posting[bisect.bisect_left(posting, (-weight, key, doc_id))]
+            if posting:
+                continue
+            del self._postings[t]
+            del self._terms[bisect.bisect_left(self._terms, t)]
+            if len(t) >= self.MIN_FUZZY_LEN:
+                for d in self._delete_variants(t):
+                    variants = self._deletes[d]
+                    variants.discard(t)
+                    if not variants:
+                        del self._deletes[d]
+
+    def _expand(self, token, prefix):
+        # -> {term: match quality} for the vocabulary terms `token` matches
+        out = {}
+        if token in self._postings:
+            out[token] = 1.0
+        if prefix:
+            i = bisect.bisect_left(self._terms, token)
+            for term in self._terms[i:i + self.MAX_PREFIX_TERMS + 1]:
+                if not term.startswith(token):
+                    break
+                out.setdefault(term, self.PREFIX_QUALITY)
+        if not out and len(token) >= self.MIN_FUZZY_LEN:
+            for d in self._delete_variants(token):
+                for term in self._deletes.get(d, ()):
+                    out[term] = self.FUZZY_QUALITY
+        return out
+
+    def _score(self, doc_id, expansions):
+        total = 0.0
+        terms = self._doc_terms[doc_id]
+        for exp in expansions:
+            best = 0.0
+            for t, weight in terms.items():
+                q = exp.get(t)
+                if q is not None and weight * q > best:
+                    best = weight * q
+            if not best:
+                return None
+            total += best
+        return total
+
+    def search(self, query, limit=10, category=None, brand=None):
+        tokens = self.tokenize(query)
+        if not tokens:
+            return []
+        category = category.lower() if category else None
+        def accept(doc_id):
+            doc = self._docs[doc_id]
+            if category and (doc.get('category_name') or '').lower() != category:
+                return False
+            return not brand or doc.get('brand') == brand
+        with self._lock:
+            expansions = [self._expand(t, i == len(tokens) - 1) for i, t in enumerate(tokens)]
+            if not all(expansions):
+                return []
+            found = {}
+            # 1) names starting with the phrase: whole-word match, then prefix match
+            phrase = ' '.join(tokens)
+            for lo, hi in ((phrase, phrase + '!'), (phrase + '0', phrase + '{')):
+                i = bisect.bisect_left(self._names, (lo,))
+                while i < len(self._names) and len(found) < limit and self._names[i][0] < hi:
+                    doc_id = self._names[i][1]
+                    if accept(doc_id):
+                        score = self._score(doc_id, expansions)
+                        if score is not None:
+                            found[doc_id] = score + self.NAME_PREFIX_BONUS
+                    i += 1
+            # 2) everything else, best first. Each posting is sorted by (-weight, name),
+            # so lazily merging the postings of the rarest token's terms yields documents
+            # in descending order of that token's contribution; once even a perfect match
+            # on the remaining tokens could not beat the current k-th best, stop.
+            need = limit - len(found)
+            if need > 0:
+                order = sorted(range(len(expansions)), key=lambda i: sum(len(self._postings[t]) for t in expansions[i]))
+                rarest = expansions[order[0]]
+                rest_bound = sum(self.FIELD_WEIGHTS[0][1] * max(expansions[i].values()) for i in order[1:])
+                merged = heapq.merge(*(
+                    ((neg_w * q, key, doc_id) for neg_w, key, doc_id in self._postings[t])
+                    for t, q in rarest.items()
+                ))
+                top, seen, seq = [], set(found), 0
+                for neg_contrib, _, doc_id in merged:
+                    if len(top) == need and rest_bound - neg_contrib <= top[0][0]:
+                        break
+                    if doc_id in seen:
+                        continue
+                    seen.add(doc_id)
+                    if not accept(doc_id):
+                        continue
+                    score = -neg_contrib if len(expansions) == 1 else self._score(doc_id, expansions)
+                    if score is None:
+                        continue
+                    seq += 1
+                    entry = (score, -seq, doc_id)
+                    if len(top) < need:
+                        heapq.heappush(top, entry)
+                    elif entry > top[0]:
+                        heapq.heapreplace(top, entry)
+                for score, _, doc_id in sorted(top, reverse=True):
+                    found[doc_id] = score
+            return [dict(self._docs[doc_id], score=round(score, 3)) for doc_id, score in found.items()]
+
+
+SEARCH_INDEX_SQL = '''
+    SELECT m.id, m.slug, m.name, m.generic_name, m.brand, m.description, m.price, m.image_url,
+           c.name AS category_name
+    FROM medicines m
+    LEFT JOIN categories c ON m.category_id = c.id
+'''
+SEARCH_INDEX_REFRESH = _env_float('SEARCH_INDEX_REFRESH', 60.0)
+_search_index = None
+_search_index_state = {'fingerprint': None, 'checked_at': 0.0}
+_search_index_lock = threading.Lock()
+
+def _medicines_fingerprint(db):
+    # changes on any insert or delete, on any UPDATE of an indexed column (revision, see
+    # MEDICINE_REVISION_COLUMNS) and when a category is renamed
+    row = db.execute('SELECT COUNT(*) AS n, MAX(id) AS max_id, SUM(revision) AS revisions FROM medicines').fetchone()
+    categories = tuple((r['id'], r['name']) for r in db.execute('SELECT id, name FROM categories ORDER BY id').fetchall())
+    return (row['n'], row['max_id'], row['revisions'], categories)
+
+def get_search_index(db):
+    # Built on first use. Writers that call search_index_sync() update it in place; any
+    # other write to medicines or categories through this process makes the next search
+    # re-check the fingerprint, and every SEARCH_INDEX_REFRESH seconds it catches writes
+    # from elsewhere.
+    global _search_index
+    now = time.monotonic()
+    if _search_index is not None and now - _search_index_state['checked_at'] < SEARCH_INDEX_REFRESH:
+        return _search_index
+    with _search_index_lock:
+        if _search_index is not None and now - _search_index_state['checked_at'] < SEARCH_INDEX_REFRESH:
+            return _search_index
+        fingerprint = _medicines_fingerprint(db)
+        if _search_index is None or fingerprint != _search_index_state['fingerprint']:
+            docs = _shared.snapshot.documents(SEARCH_DOCUMENTS) if _shared is not None else None
+            if docs is None:
+                docs = (dict(r) for r in db.execute(SEARCH_INDEX_SQL).fetchall())
+            _search_index = SearchIndex.build(docs)
+        _search_index_state['fingerprint'] = fingerprint
+        _search_index_state['checked_at'] = time.monotonic()
+        return _search_index
+
+def search_index_sync(db, ids):
+    # Re-read the given medicines and update the index in place (no-op until it is built).
+    index = _search_index
+    if index is None or not ids:
+        return
+    ids = list(ids)
+    found = set()
+    for i in range(0, len(ids), 500):
+        chunk = ids[i:i + 500]
+        sql = SEARCH_INDEX_SQL + ' WHERE m.id IN (' + ', '.join('?' * len(chunk)) + ')'
+        for r in db.execute(sql, chunk).fetchall():
+            index.upsert(dict(r))
+            found.add(r['id'])
+    for doc_id in ids:
+        if doc_id not in found:
+            index.remove(doc_id)
+    with _search_index_lock:
+        _search_index_state['fingerprint'] = _medicines_fingerprint(db)
+
+@on_tables_written
+def _recheck_search_index(tables):
+    # writes that didn't go through search_index_sync(): re-fingerprint on next search
+    if tables & {'medicines', 'categories'}:
+        _search_index_state['checked_at'] = 0.0
+
+@app.route('/api/medicines/search')
+def api_medicines_search():
+    q = (request.args.get('q') or '').strip()
+    if not q:
+        return jsonify({'error': 'q query param required'}), 400
+    try:
+        limit = min(max(int(request.args.get('limit') or 10), 1), MEDICINES_MAX_LIMIT)
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+    index = get_search_index(get_db())
+    start = time.perf_counter()
+    items = index.search(q, limit, request.args.get('category'), request.args.get('brand'))
+    took_ms = (time.perf_counter() - start) * 1000.0
+    return jsonify({'items': items, 'took_ms': round(took_ms, 3)})
+
+@app.route('/api/categories')
+@replica_reads
+@cached_json('categories')
+def api_categories():
+    return jsonify(get_db().rows(CATEGORIES_SQL))
+
+@app.route('/api/doctors')
+@replica_reads
+@cached_json('doctors')
+def api_doctors():
+    return jsonify(get_db().rows(DOCTORS_SQL))
+
+@app.route('/api/lab-tests')
+@replica_reads
+@cached_json('lab_tests', 'labs')
+def api_lab_tests():
+    return jsonify(get_db().rows(LAB_TESTS_SQL))
+
+# Stateless session tokens: base64url(JSON claims) "." base64url(HMAC-SHA256). Set
+# SESSION_SECRET so tokens survive restarts and are accepted by every worker; the
+# random fallback is only good for a single development process.
+SESSION_SECRET = (os.environ.get('SESSION_SECRET') or secrets.token_hex(32)).encode()
+SESSION_TTL = _env_int('SESSION_TTL', 7 * 24 * 3600)
+
+
+class RevocationCache:
+    # Revoked token ids (kept until the token would have expired anyway) plus a
+    # per-user "not before" time that kills every older token of that user at once.
+    # publish(kind, key, value), when set, passes each revocation on to other processes,
+    # which replay it with apply().
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._jti = {}
+        self._users = {}
+        self.publish = None
+
+    def revoke(self, jti, exp):
+        self.apply('jti', jti, exp)
+        if self.publish is not None:
+            self.publish('jti', jti, exp)
+
+    def revoke_user(self, uid):
+        now = time.time()
+        self.apply('uid', uid, now)
+        if self.publish is not None:
+            self.publish('uid', uid, now)
+
+    def apply(self, kind, key, value):
+        with self._lock:
+            if kind == 'uid':
+                self._users[key] = max(self._users.get(key, 0.0), value)
+                return
+            self._jti[key] = value
+            if len(self._jti) % 256 == 0:
+                now = time.time()
+                self._jti = {k: v for k, v in self._jti.items() if v > now}
+
+    def is_revoked(self, claims):
+        with self._lock:
+            if claims.get('jti') in self._jti:
+                return True
+            cutoff = self._users.get(claims.get('uid'))
+        return cutoff is not None and claims.get('iat', 0) <= cutoff
+
+
+revoked_sessions = RevocationCache()
+
+def _b64(raw):
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def _unb64(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+def issue_token(user):
+    now = time.time()
+    claims = {'uid': user['id'], 'role': user.get('role') or 'customer', 'email': user.get('email'),
+              'iat': now, 'exp': int(now) + SESSION_TTL, 'jti': secrets.token_urlsafe(9)}
+    body = _b64(json.dumps(claims, separators=(',', ':')).encode())
+    sig = _b64(hmac.new(SESSION_SECRET, body.encode(), hashlib.sha256).digest())
+    return body + '.' + sig, claims
+
+def verify_token(token):
+    # -> claims, or None for malformed, forged, expired or revoked tokens
+    try:
+        body, sig = token.split('.', 1)
+        expected = _b64(hmac.new(SESSION_SECRET, body.encode(), hashlib.sha256).digest())
+        if not hmac.compare_digest(sig, expected):
+            return None
+        claims = json.loads(_unb64(body))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(claims, dict) or claims.get('exp', 0) < time.time() or revoked_sessions.is_revoked(claims):
+        return None
+    return claims
+
+def current_session():
+    # claims of the bearer token on this request (verified once, in memory), or None
+    if '_session' not in g:
+        auth = request.headers.get('Authorization') or ''
+        token = auth[7:].strip() if auth[:7].lower() == 'bearer ' else None
+        g._session = verify_token(token) if token else None
+    return g._session
+
+def require_auth(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if current_session() is None:
+            return jsonify({'error': 'authentication required'}), 401
+        return view(*args, **kwargs)
+    return wrapper
+
+def require_role(*roles):
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            claims = current_session()
+            if claims is None:
+                return jsonify({'error': 'authentication required'}), 401
+            if claims.get('role') not in roles:
+                return jsonify({'error': 'forbidden'}), 403
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def _session_payload(user):
+    token, claims = issue_token(user)
+    return {'token': token, 'expires_at': claims['exp']}
+
+@app.route('/api/auth/session')
+@require_auth
+def api_auth_session():
+    claims = current_session()
+    return jsonify({k: claims[k] for k in ('uid', 'role', 'email', 'exp')})
+
+@app.route('/api/auth/logout', methods=['POST'])
+@require_auth
+def api_auth_logout():
+    claims = current_session()
+    revoked_sessions.revoke(claims['jti'], claims['exp'])
+    return jsonify({'status': 'logged out'})
 
 @app.route('/api/user', methods=['GET', 'POST', 'DELETE'])
+@replica_reads
 def api_user():
     db = get_db()
     if os.environ.get('FLASK_ENV') == 'development':
-        db.set_trace_callback(print)
+        db.set_trace_callback(lambda sql: app.logger.debug('sql: %s', normalize_sql(sql)))
     from flask import request
+    session = current_session()
     if request.method == 'GET':
         email = request.args.get('email')
+        if session and not email:
+            row = db.execute('SELECT id, name, email, phone, role, language, currency, created_at FROM users WHERE id = ?', (session['uid'],)).fetchone()
+            if not row:
+                return jsonify({'error': 'not found'}), 404
+            return jsonify(dict(row))
         if not email:
             return jsonify({'error': 'email query param required'}), 400
         row = db.execute('SELECT id, name, email, phone, role, language, currency, created_at FROM users WHERE email = ?', (email,)).fetchone()
@@ -725,37 +2741,189 @@ def api_user():
         name = data.get('name') or 'User'
         email = data.get('email')
         phone = data.get('phone')
-        role = data.get('role') or 'customer'
         language = data.get('language')
         currency = data.get('currency')
         if not email:
             return jsonify({'error': 'email is required'}), 400
-        # Upsert by email
+        # Upsert by email. `role` is never taken from the request: it ends up in session
+        # tokens, so it is only set server-side (`flask set-role`).
         existing = db.execute('SELECT id FROM users WHERE email = ?', (email,)).fetchone()
         if existing:
-            db.execute('UPDATE users SET name = ?, phone = ?, role = ?, language = ?, currency = ? WHERE id = ?',
-                       (name, phone, role, language, currency, existing['id']))
+            db.execute('UPDATE users SET name = ?, phone = ?, language = ?, currency = ? WHERE id = ?',
+                       (name, phone, language, currency, existing['id']))
             db.commit()
             row = db.execute('SELECT id, name, email, phone, role, language, currency, created_at FROM users WHERE id = ?', (existing['id'],)).fetchone()
             return jsonify({'status': 'updated', 'user': dict(row)})
         else:
             db.execute('INSERT INTO users(name, email, phone, role, language, currency) VALUES(?, ?, ?, ?, ?, ?)',
-                       (name, email, phone, role, language, currency))
+                       (name, email, phone, 'customer', language, currency))
             db.commit()
             row = db.execute('SELECT id, name, email, phone, role, language, currency, created_at FROM users WHERE email = ?', (email,)).fetchone()
             return jsonify({'status': 'created', 'user': dict(row)}), 201
     else:  # DELETE
         data = request.get_json(silent=True) or {}
         email = data.get('email') or request.args.get('email')
-        if not email:
+        if session:
+            user = {'id': session['uid']}
+        elif not email:
             return jsonify({'error': 'email is required to delete'}), 400
-        user = db.execute('SELECT id FROM users WHERE email = ?', (email,)).fetchone()
-        if not user:
-            return jsonify({'error': 'not found'}), 404
-        db.execute('DELETE FROM users WHERE id = ?', (user['id'],))
+        else:
+            user = db.execute('SELECT id FROM users WHERE email = ?', (email,)).fetchone()
+            if not user:
+                return jsonify({'error': 'not found'}), 404
+        cur = db.execute('DELETE FROM users WHERE id = ?', (user['id'],))
         db.commit()
+        revoked_sessions.revoke_user(user['id'])
+        if not cur.rowcount:
+            return jsonify({'error': 'not found'}), 404
         return jsonify({'status': 'deleted'}), 200
 
+class HashPoolBusy(Exception):
+    pass
+
+
+class HashPool:
+    # Password hashing (scrypt/pbkdf2 release the GIL) runs on at most `workers` threads.
+    # Up to `max_queue` more requests may wait for a slot; beyond that callers get
+    # HashPoolBusy straight away instead of piling CPU work onto the worker. So does a
+    # caller whose hash hasn't finished within `timeout`.
+    def __init__(self, workers=2, max_queue=16, timeout=10.0):
+        self.workers = max(1, workers)
+        self.max_queue = max(0, max_queue)
+        self.timeout = timeout
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._stats = {'submitted': 0, 'rejected': 0, 'completed': 0, 'timeouts': 0, 'max_pending': 0, 'busy_time_total_ms': 0.0}
+
+    def _timed(self, fn, args):
+        start = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000.0
+            with self._lock:
+                self._pending -= 1
+                self._stats['completed'] += 1
+                self._stats['busy_time_total_ms'] += elapsed
+
+    def run(self, fn, *args):
+        with self._lock:
+            if self._pending >= self.workers + self.max_queue:
+                self._stats['rejected'] += 1
+                raise HashPoolBusy()
+            self._pending += 1
+            self._stats['submitted'] += 1
+            self._stats['max_pending'] = max(self._stats['max_pending'], self._pending)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='pwhash')
+            executor = self._executor
+        future = executor.submit(self._timed, fn, args)
+        try:
+            return future.result(timeout=self.timeout)
+        except FuturesTimeout:
+            with self._lock:
+                self._stats['timeouts'] += 1
+                if future.cancel():  # still queued: it will never run _timed
+                    self._pending -= 1
+            raise HashPoolBusy()
+
+    def reset(self):
+        # drop the executor (e.g. in a freshly forked child, where its threads don't exist)
+        with self._lock:
+            self._executor = None
+            self._pending = 0
+
+    def stats(self):
+        with self._lock:
+            out = dict(self._stats)
+            out.update({'workers': self.workers, 'max_queue': self.max_queue, 'pending': self._pending})
+        return out
+
+
+class AttemptLimiter:
+    # Sliding-window counters keyed by e.g. 'email:x' / 'ip:y'. The number of tracked
+    # keys is capped (least recently touched are forgotten first) so a spray of random
+    # emails can't grow memory without bound.
+    def __init__(self, window=300.0, max_keys=100000):
+        self.window = window
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._hits = OrderedDict()
+
+    def _recent(self, key, now):
+        q = self._hits.get(key)
+        if q is None:
+            return None
+        while q and now - q[0] > self.window:
+            q.popleft()
+        if not q:
+            del self._hits[key]
+            return None
+        return q
+
+    def retry_after(self, key, limit):
+        # seconds until `key` drops below `limit` attempts, 0 when it is allowed now
+        now = time.monotonic()
+        with self._lock:
+            q = self._recent(key, now)
+            if q is None or len(q) < limit:
+                return 0
+            return max(1, int(q[-limit] + self.window - now) + 1)
+
+    def hit(self, key):
+        now = time.monotonic()
+        with self._lock:
+            q = self._recent(key, now)
+            if q is None:
+                q = self._hits[key] = deque()
+            q.append(now)
+            self._hits.move_to_end(key)
+            while len(self._hits) > self.max_keys:
+                self._hits.popitem(last=False)
+
+    def reset(self, key):
+        with self._lock:
+            self._hits.pop(key, None)
+
+
+PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD') or 'scrypt'
+PASSWORD_SALT_LENGTH = _env_int('PASSWORD_SALT_LENGTH', 16)
+LOGIN_MAX_FAILURES_PER_EMAIL = _env_int('LOGIN_MAX_FAILURES_PER_EMAIL', 5)
+LOGIN_MAX_ATTEMPTS_PER_IP = _env_int('LOGIN_MAX_ATTEMPTS_PER_IP', 30)
+hash_pool = HashPool(workers=_env_int('PASSWORD_HASH_WORKERS', 2), max_queue=_env_int('PASSWORD_HASH_QUEUE', 16),
+                     timeout=_env_float('PASSWORD_HASH_TIMEOUT', 10.0))
+login_failures = AttemptLimiter(window=_env_float('LOGIN_WINDOW', 300.0))
+auth_attempts = AttemptLimiter(window=_env_float('LOGIN_WINDOW', 300.0))
+_hash_prefix = {}
+
+def hash_password(password):
+    return hash_pool.run(generate_password_hash, password, PASSWORD_HASH_METHOD, PASSWORD_SALT_LENGTH)
+
+def verify_password(pwd_hash, password):
+    return hash_pool.run(check_password_hash, pwd_hash, password)
+
+def password_needs_rehash(pwd_hash):
+    # compare the stored "method:params" prefix with what the current settings produce
+    prefix = _hash_prefix.get(PASSWORD_HASH_METHOD)
+    if prefix is None:
+        prefix = _hash_prefix[PASSWORD_HASH_METHOD] = hash_password('').split('$', 1)[0]
+    return pwd_hash.split('$', 1)[0] != prefix
+
+def _throttled(retry_after):
+    resp = jsonify({'error': 'too many attempts, try again later'})
+    resp.status_code = 429
+    resp.headers['Retry-After'] = str(retry_after)
+    return resp
+
+@app.errorhandler(HashPoolBusy)
+def handle_hash_pool_busy(e):
+    return _throttled(1)
+
+@app.route('/api/auth/stats')
+def api_auth_stats():
+    return jsonify({'hash_pool': hash_pool.stats(), 'hash_method': PASSWORD_HASH_METHOD})
+
 @app.route('/api/auth/signup', methods=['POST'])
 def api_auth_signup():
     db = get_db()
@@ -764,21 +2932,26 @@ def api_auth_signup():
     name = data.get('name') or 'User'
     email = data.get('email')
     password = data.get('password')
-    role = data.get('role') or 'customer'
     phone = data.get('phone')
     language = data.get('language')
     currency = data.get('currency')
     if not email or not password:
         return jsonify({'error': 'email and password are required'}), 400
+    ip_key = 'ip:' + (request.remote_addr or '')
+    retry = auth_attempts.retry_after(ip_key, LOGIN_MAX_ATTEMPTS_PER_IP)
+    if retry:
+        return _throttled(retry)
+    auth_attempts.hit(ip_key)
     existing = db.execute('SELECT id FROM users WHERE email = ?', (email,)).fetchone()
     if existing:
         return jsonify({'error': 'account already exists'}), 409
-    pwd_hash = generate_password_hash(password)
+    pwd_hash = hash_password(password)
     db.execute('INSERT INTO users(name, email, phone, role, language, currency, password_hash) VALUES(?, ?, ?, ?, ?, ?, ?)',
-               (name, email, phone, role, language, currency, pwd_hash))
+               (name, email, phone, 'customer', language, currency, pwd_hash))  # see api_user on roles
     db.commit()
     row = db.execute('SELECT id, name, email, phone, role, language, currency, created_at FROM users WHERE email = ?', (email,)).fetchone()
-    return jsonify({'status': 'created', 'user': dict(row)}), 201
+    user = dict(row)
+    return jsonify({'status': 'created', 'user': user, **_session_payload(user)}), 201
 
 @app.route('/api/auth/login', methods=['POST'])
 def api_auth_login():
@@ -789,15 +2962,1874 @@ def api_auth_login():
     password = data.get('password')
     if not email or not password:
         return jsonify({'error': 'email and password are required'}), 400
+    # throttling is decided before any lookup or hash so brute force costs us nothing
+    email_key = 'email:' + email.strip().lower()
+    ip_key = 'ip:' + (request.remote_addr or '')
+    retry = max(login_failures.retry_after(email_key, LOGIN_MAX_FAILURES_PER_EMAIL),
+                auth_attempts.retry_after(ip_key, LOGIN_MAX_ATTEMPTS_PER_IP))
+    if retry:
+        return _throttled(retry)
+    auth_attempts.hit(ip_key)
     row = db.execute('SELECT id, name, email, phone, role, language, currency, created_at, password_hash FROM users WHERE email = ?', (email,)).fetchone()
     if not row:
+        login_failures.hit(email_key)
         return jsonify({'error': 'not found'}), 404
-    if not row['password_hash'] or not check_password_hash(row['password_hash'], password):
+    if not row['password_hash'] or not verify_password(row['password_hash'], password):
+        login_failures.hit(email_key)
         return jsonify({'error': 'incorrect password'}), 401
+    login_failures.reset(email_key)
+    try:
+        if password_needs_rehash(row['password_hash']):
+            db.execute('UPDATE users SET password_hash = ? WHERE id = ?', (hash_password(password), row['id']))
+            db.commit()
+    except HashPoolBusy:
+        pass  # upgrade on a later login
     user = {k: row[k] for k in ['id', 'name', 'email', 'phone', 'role', 'language', 'currency', 'created_at']}
-    return jsonify({'status': 'ok', 'user': user})
+    return jsonify({'status': 'ok', 'user': user, **_session_payload(user)})
+
+
+CHECKOUT_MAX_LINES = _env_int('CHECKOUT_MAX_LINES', 50)
+CHECKOUT_MAX_QUANTITY = _env_int('CHECKOUT_MAX_QUANTITY', 100)
+CHECKOUT_RETRIES = _env_int('CHECKOUT_RETRIES', 3)
+
+
+class OutOfStock(Exception):
+    def __init__(self, medicine_id):
+        super().__init__(medicine_id)
+        self.medicine_id = medicine_id
+
+
+class UnknownMedicine(LookupError):
+    def __init__(self, medicine_ids):
+        super().__init__(medicine_ids)
+        self.medicine_ids = medicine_ids
+
+
+def _parse_cart(items):
+    # [{medicine_id, quantity}, ...] -> [(medicine_id, quantity)] merged and sorted by id;
+    # every checkout touches medicine rows in id order, so two carts can't deadlock
+    if not isinstance(items, list) or not items:
+        raise ValueError('items must be a non-empty list')
+    cart = {}
+    for item in items:
+        try:
+            mid, qty = int(item['medicine_id']), int(item.get('quantity', 1))
+        except (KeyError, TypeError, ValueError, AttributeError):
+            raise ValueError('each item needs an integer medicine_id and quantity')
+        if qty < 1:
+            raise ValueError('quantity must be positive')
+        cart[mid] = cart.get(mid, 0) + qty
+        if cart[mid] > CHECKOUT_MAX_QUANTITY:
+            raise ValueError(f'at most {CHECKOUT_MAX_QUANTITY} units per medicine')
+    if len(cart) > CHECKOUT_MAX_LINES:
+        raise ValueError(f'at most {CHECKOUT_MAX_LINES} distinct medicines per order')
+    return sorted(cart.items())
+
+def _is_lock_conflict(e):
+    # InnoDB deadlock / lock wait timeout, or SQLite busy past busy_timeout
+    if isinstance(e, sqlite3.OperationalError):
+        return 'locked' in str(e) or 'busy' in str(e)
+    return bool(e.args) and e.args[0] in (1205, 1213)
+
+def place_order(db, user_id, cart):
+    # One transaction: conditional stock decrements (never below zero), then the order,
+    # its items in one batch, the pending payment row and the jobs that update the sales
+    # rollups, low-stock list and reward points once it has committed.
+    # Returns (order_id, total).
+    db.begin_write()
+    ids = [mid for mid, _ in cart]
+    marks = ','.join('?' * len(ids))
+    rows = db.execute(f'SELECT id, price FROM medicines WHERE id IN ({marks})', ids).fetchall()
+    prices = {r['id']: r['price'] for r in rows}
+    missing = [mid for mid in ids if mid not in prices]
+    if missing:
+        raise UnknownMedicine(missing)
+    for mid, qty in cart:
+        cur = db.execute('UPDATE medicines SET stock = stock - ? WHERE id = ? AND stock >= ?', (qty, mid, qty))
+        if cur.rowcount != 1:
+            raise OutOfStock(mid)
+    total = sum(prices[mid] * qty for mid, qty in cart)
+    order_id = db.execute('INSERT INTO orders(user_id, status, total_amount) VALUES(?, ?, ?)',
+                          (user_id, 'placed', total)).lastrowid
+    db.executemany('INSERT INTO order_items(order_id, medicine_id, quantity, price) VALUES(?, ?, ?, ?)',
+                   [(order_id, mid, qty, prices[mid]) for mid, qty in cart])
+    db.execute('INSERT INTO transactions(user_id, order_id, type, amount, status) VALUES(?, ?, ?, ?, ?)',
+               (user_id, order_id, 'payment', total, 'pending'))
+    job_queue.enqueue(db, 'order_rollups', {'order_id': order_id})
+    job_queue.enqueue(db, 'reward_accrual', {'order_id': order_id})
+    db.commit()
+    return order_id, total
+
+@app.route('/api/checkout', methods=['POST'])
+@require_auth
+def api_checkout():
+    data = request.get_json(silent=True) or {}
+    try:
+        cart = _parse_cart(data.get('items'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    db = get_db()
+    user_id = current_session()['uid']
+    for attempt in range(CHECKOUT_RETRIES):
+        try:
+            order_id, total = place_order(db, user_id, cart)
+            break
+        except OutOfStock as e:
+            db.rollback()
+            return jsonify({'error': 'insufficient stock', 'medicine_id': e.medicine_id}), 409
+        except UnknownMedicine as e:
+            db.rollback()
+            return jsonify({'error': 'unknown medicine', 'medicine_ids': e.medicine_ids}), 404
+        except Exception as e:
+            db.rollback()
+            if not _is_lock_conflict(e) or attempt == CHECKOUT_RETRIES - 1:
+                raise
+            time.sleep(0.005 * (attempt + 1))
+    return jsonify({'status': 'placed', 'order_id': order_id, 'total_amount': total,
+                    'items': [{'medicine_id': mid, 'quantity': qty} for mid, qty in cart]}), 201
+
+
+IMPORT_BATCH_SIZE = _env_int('IMPORT_BATCH_SIZE', 1000)
+IMPORT_MAX_ERRORS = _env_int('IMPORT_MAX_ERRORS', 100)
+IMPORT_ROLES = tuple(r.strip() for r in (os.environ.get('IMPORT_ROLES') or 'admin').split(',') if r.strip())
+
+
+class ImportRowError(ValueError):
+    pass
+
+
+def read_records(stream, fmt):
+    # yields (line, dict) from a text stream without reading it all; bad NDJSON lines
+    # come through as (line, ImportRowError) so the caller can report and carry on
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line_no, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            rec = json.loads(line)
+        except ValueError as e:
+            yield line_no, ImportRowError(f'invalid JSON: {e}')
+            continue
+        yield line_no, rec if isinstance(rec, dict) else ImportRowError('expected a JSON object')
+
+def _text(rec, field, required=False):
+    value = rec.get(field)
+    value = str(value).strip() if value is not None else ''
+    if not value:
+        if required:
+            raise ImportRowError(f'{field} is required')
+        return None
+    return value
+
+def _number(rec, field, cast, required=False):
+    value = rec.get(field)
+    if value is None or (isinstance(value, str) and not value.strip()):
+        if required:
+            raise ImportRowError(f'{field} is required')
+        return None
+    try:
+        value = cast(value)
+    except (TypeError, ValueError):
+        raise ImportRowError(f'{field} must be a number')
+    if value < 0:
+        raise ImportRowError(f'{field} must not be negative')
+    return value
+
+def _slugify(text):
+    return re.sub(r'[^a-z0-9]+', '-', text.lower()).strip('-')
+
+def _same_value(old, new):
+    if old is None or new is None:
+        return old == new
+    if isinstance(new, (int, float)):
+        return abs(float(old) - float(new)) < 0.005  # DECIMAL(10,2) vs float input
+    return str(old) == new
+
+
+class NameMap:
+    # name -> id for small lookup tables (categories, labs), loaded once per import;
+    # unknown names are inserted on first use inside the current batch's transaction
+    def __init__(self, db, table):
+        self._db = db
+        self._table = table
+        self._ids = {}
+        for r in db.execute(f'SELECT id, name FROM {table} ORDER BY id').fetchall():
+            self._ids.setdefault(r['name'].lower(), r['id'])
+        self.created = 0
+
+    def resolve(self, name, **extra):
+        key = name.lower()
+        if key not in self._ids:
+            cols = ['name', *extra]
+            marks = ', '.join('?' * len(cols))
+            self._ids[key] = self._db.execute(f'INSERT INTO {self._table}({", ".join(cols)}) VALUES({marks})',
+                                              (name, *extra.values())).lastrowid
+            self.created += 1
+        return self._ids[key]
+
+
+def _medicine_record(rec, maps):
+    name = _text(rec, 'name', required=True)
+    row = {'slug': _text(rec, 'slug') or _slugify(' '.join(filter(None, (name, _text(rec, 'brand'))))),
+           'name': name, 'price': _number(rec, 'price', float, required=True)}
+    for field in ('generic_name', 'brand', 'description', 'image_url'):
+        if field in rec:
+            row[field] = _text(rec, field)
+    if 'stock' in rec:
+        row['stock'] = _number(rec, 'stock', int)
+    category = _text(rec, 'category')
+    if category:
+        row['category_id'] = maps['categories'].resolve(category)
+    elif 'category_id' in rec:
+        row['category_id'] = _number(rec, 'category_id', int)
+    return (row['slug'],), row
+
+def _lab_test_record(rec, maps):
+    row = {'name': _text(rec, 'name', required=True), 'lab_id': None}
+    lab = _text(rec, 'lab')
+    if lab:
+        city = _text(rec, 'lab_city')
+        row['lab_id'] = maps['labs'].resolve(lab, **({'city': city} if city else {}))
+    if 'category' in rec:
+        row['category'] = _text(rec, 'category')
+    if 'price' in rec:
+        row['price'] = _number(rec, 'price', float)
+    return (row['name'], row['lab_id']), row
+
+# kind -> (table, key columns, importable columns, insert defaults, lookup maps, parser).
+# Columns missing from a record keep their current value on update (stock in
+# particular, so a supplier price list doesn't reset inventory).
+IMPORT_KINDS = {
+    'medicines': ('medicines', ('slug',), ('slug', 'name', 'generic_name', 'brand', 'description', 'price', 'stock', 'category_id', 'image_url'),
+                  {'stock': 0}, ('categories',), _medicine_record),
+    'lab-tests': ('lab_tests', ('name', 'lab_id'), ('name', 'category', 'price', 'lab_id'), {}, ('labs',), _lab_test_record),
+}
+
+
+def import_catalog(db, kind, records, batch_size=None):
+    # Streams records into `kind`, one transaction per batch. Each batch costs one
+    # lookup of the existing rows by key; new rows go in as multi-row INSERTs, changed
+    # rows as batched UPDATEs and unchanged rows cost nothing, so re-importing the same
+    # file is read-only. Returns a report with counts, rows/sec and per-row errors.
+    table, key_cols, columns, defaults, map_tables, parse = IMPORT_KINDS[kind]
+    batch_size = batch_size or IMPORT_BATCH_SIZE
+    maps = {t: NameMap(db, t) for t in map_tables}
+    report = {'kind': kind, 'rows': 0, 'inserted': 0, 'updated': 0, 'unchanged': 0, 'duplicates': 0, 'error_count': 0, 'errors': []}
+    start = time.perf_counter()
+    batch = {}
+
+    def flush():
+        lookup = key_cols[0]
+        keys = list({k[0] for k in batch})
+        marks = ','.join('?' * len(keys))
+        existing = {}
+        for r in db.execute(f'SELECT id, {", ".join(columns)} FROM {table} WHERE {lookup} IN ({marks}) ORDER BY id', keys).fetchall():
+            existing.setdefault(tuple(r[c] for c in key_cols), r)
+        inserts, updates = [], {}
+        for key, row in batch.items():
+            old = existing.get(key)
+            if old is None:
+                row = {**defaults, **row}
+                inserts.append(tuple(row.get(c) for c in columns))
+                continue
+            changed = tuple(c for c in columns if c in row and not _same_value(old[c], row[c]))
+            if changed:
+                updates.setdefault(changed, []).append(tuple(row[c] for c in changed) + (old['id'],))
+            else:
+                report['unchanged'] += 1
+        per_stmt = max(1, 999 // len(columns))  # SQLite's historical bound-parameter limit
+        for i in range(0, len(inserts), per_stmt):
+            chunk = inserts[i:i + per_stmt]
+            values = ', '.join(['(' + ', '.join('?' * len(columns)) + ')'] * len(chunk))
+            db.execute(f'INSERT INTO {table}({", ".join(columns)}) VALUES {values}', [v for r in chunk for v in r])
+        for changed, params in updates.items():
+            db.executemany(f'UPDATE {table} SET {", ".join(c + " = ?" for c in changed)} WHERE id = ?', params)
+        touched = []
+        if table == 'medicines' and (inserts or updates):
+            # ids of the rows this batch wrote, for the low-stock list and the search index
+            stocked = [p[-1] for changed, params in updates.items() if 'stock' in changed for p in params]
+            touched = [p[-1] for params in updates.values() for p in params]
+            slugs = [r[columns.index('slug')] for r in inserts]
+            for i in range(0, len(slugs), 500):
+                chunk = slugs[i:i + 500]
+                added = [r['id'] for r in db.execute(f'SELECT id FROM medicines WHERE slug IN ({",".join("?" * len(chunk))})',
+                                                      chunk).fetchall()]
+                touched += added
+                stocked += added
+            for i in range(0, len(stocked), 500):
+                sync_low_stock(db, stocked[i:i + 500])
+        db.commit()
+        if touched and _search_index is not None:
+            search_index_sync(db, touched)  # in place instead of a full rebuild
+        report['inserted'] += len(inserts)
+        report['updated'] += sum(len(p) for p in updates.values())
+        batch.clear()
+
+    try:
+        for line, rec in records:
+            report['rows'] += 1
+            try:
+                if isinstance(rec, Exception):
+                    raise rec
+                key, row = parse(rec, maps)
+            except ImportRowError as e:
+                report['error_count'] += 1
+                if len(report['errors']) < IMPORT_MAX_ERRORS:
+                    report['errors'].append({'line': line, 'error': str(e)})
+                continue
+            if key in batch:
+                report['duplicates'] += 1  # the later row in the file wins
+            batch[key] = row
+            if len(batch) >= batch_size:
+                flush()
+        if batch:
+            flush()
+        db.commit()  # names created by rows that all turned out unchanged
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        report['created'] = {t: m.created for t, m in maps.items()}
+        report['seconds'] = round(elapsed, 3)
+        report['rows_per_sec'] = round(report['rows'] / elapsed, 1) if elapsed else None
+    return report
+
+def _import_format(name, declared=None):
+    fmt = (declared or '').lower()
+    if not fmt:
+        lowered = (name or '').lower()
+        fmt = 'csv' if 'csv' in lowered else 'ndjson' if ('ndjson' in lowered or 'jsonl' in lowered or 'json' in lowered) else ''
+    if fmt not in ('csv', 'ndjson'):
+        raise ValueError('format must be csv or ndjson')
+    return fmt
+
+@app.route('/api/import/<kind>', methods=['POST'])
+@require_role(*IMPORT_ROLES)
+def api_import(kind):
+    # the request body is the file itself, read as a stream (constant memory)
+    if kind not in IMPORT_KINDS:
+        return jsonify({'error': f'kind must be one of {sorted(IMPORT_KINDS)}'}), 404
+    try:
+        fmt = _import_format(request.mimetype, request.args.get('format'))
+        batch_size = int(request.args['batch_size']) if request.args.get('batch_size') else None
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    stream = io.TextIOWrapper(request.stream, encoding='utf-8-sig', newline='')
+    return jsonify(import_catalog(get_db(), kind, read_records(stream, fmt), batch_size))
+
+@app.cli.command('import-catalog')
+@click.argument('kind', type=click.Choice(sorted(IMPORT_KINDS)))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'ndjson']), default=None, help='Defaults to the file extension.')
+@click.option('--batch-size', type=int, default=None)
+def import_catalog_command(kind, path, fmt, batch_size):
+    """Stream a CSV/NDJSON catalog file into medicines or lab tests."""
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        report = import_catalog(get_db(), kind, read_records(f, _import_format(path, fmt)), batch_size)
+    print(json.dumps(report, indent=2))
+    if report['error_count']:
+        raise SystemExit(1)
+
+
+EXPORT_FETCH_SIZE = _env_int('EXPORT_FETCH_SIZE', 2000)
+EXPORT_CHUNK_BYTES = _env_int('EXPORT_CHUNK_BYTES', 64 * 1024)
+EXPORT_ALL_ROLES = tuple(r.strip() for r in (os.environ.get('EXPORT_ALL_ROLES') or 'admin,finance').split(',') if r.strip())
+
+# kind -> (select, owner column, time column, id column)
+EXPORTS = {
+    'orders': ('SELECT o.id, o.user_id, o.status, o.total_amount, o.created_at FROM orders o',
+               'o.user_id', 'o.created_at', 'o.id'),
+    'order-items': ('SELECT oi.id, oi.order_id, o.user_id, oi.medicine_id, m.name AS medicine_name, oi.quantity, oi.price, o.created_at '
+                    'FROM order_items oi JOIN orders o ON o.id = oi.order_id LEFT JOIN medicines m ON m.id = oi.medicine_id',
+                    'o.user_id', 'o.created_at', 'oi.id'),
+    'transactions': ('SELECT t.id, t.user_id, t.order_id, t.type, t.amount, t.status, t.created_at FROM transactions t',
+                     't.user_id', 't.created_at', 't.id'),
+    'lab-results': ('SELECT r.id, r.lab_order_id, lo.user_id, lt.name AS test_name, l.name AS lab_name, r.status, r.result_summary, '
+                    'r.result_url, r.reported_at FROM lab_results r JOIN lab_orders lo ON lo.id = r.lab_order_id '
+                    'LEFT JOIN lab_tests lt ON lt.id = lo.lab_test_id LEFT JOIN labs l ON l.id = lt.lab_id',
+                    'lo.user_id', 'r.reported_at', 'r.id'),
+}
+
+
+class RowStream:
+    # Unbuffered query on its own pooled connection: pymysql's SSCursor (rows are read
+    # off the socket as we go) or SQLite's stepping cursor, fetched EXPORT_FETCH_SIZE rows
+    # at a time, so memory stays flat however many rows the query returns.
+    def __init__(self, sql, params=()):
+        self._engine = _db_engine()
+        self._pool = get_pool()
+        self._conn = self._pool.acquire()
+        self._done = False
+        try:
+            if self._engine == 'mysql':
+                import pymysql
+                self._cur = self._conn.cursor(pymysql.cursors.SSCursor)
+                self._cur.execute(sql.replace('?', '%s'), params)
+            else:
+                self._cur = self._conn.execute(sql, params)
+        except Exception:
+            self._pool.discard(self._conn)
+            self._conn = None
+            raise
+        self.columns = [d[0] for d in self._cur.description]
+
+    def __iter__(self):
+        while True:
+            rows = self._cur.fetchmany(EXPORT_FETCH_SIZE)
+            if not rows:
+                break
+            yield from rows
+        self._done = True
+
+    def close(self):
+        conn, self._conn = self._conn, None
+        if conn is None:
+            return
+        if self._done or self._engine == 'sqlite':
+            self._pool.release(conn)
+        else:
+            # the client went away mid-export: dropping the connection is cheaper than
+            # draining the rest of an unbuffered result set
+            self._pool.discard(conn)
+
+
+def export_chunks(rows, fmt):
+    # encodes a RowStream as CSV or NDJSON in ~EXPORT_CHUNK_BYTES pieces
+    buf = io.StringIO()
+    try:
+        if fmt == 'csv':
+            writer = csv.writer(buf)
+            writer.writerow(rows.columns)
+            for row in rows:
+                writer.writerow([_export_value(v) for v in row])
+                if buf.tell() >= EXPORT_CHUNK_BYTES:
+                    yield buf.getvalue()
+                    buf.seek(0)
+                    buf.truncate()
+        else:
+            encode = json.JSONEncoder(separators=(',', ':'), default=_export_value).encode
+            cols = rows.columns
+            for row in rows:
+                buf.write(encode(dict(zip(cols, row))))
+                buf.write('\n')
+                if buf.tell() >= EXPORT_CHUNK_BYTES:
+                    yield buf.getvalue()
+                    buf.seek(0)
+                    buf.truncate()
+        if buf.tell():
+            yield buf.getvalue()
+    finally:
+        rows.close()
+
+def _arg_datetime(name):
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value).isoformat(sep=' ')
+    except ValueError:
+        raise ValueError(f'{name} must be an ISO date or datetime')
+
+@app.route('/api/export/<kind>')
+@require_auth
+def api_export(kind):
+    # ?format=ndjson|csv&since=&until=&after=<id>; customers get their own rows,
+    # EXPORT_ALL_ROLES everyone's (or one user's with ?user_id=)
+    if kind not in EXPORTS:
+        return jsonify({'error': f'kind must be one of {sorted(EXPORTS)}'}), 404
+    select, owner_col, time_col, id_col = EXPORTS[kind]
+    fmt = request.args.get('format') or 'ndjson'
+    if fmt not in ('ndjson', 'csv'):
+        return jsonify({'error': 'format must be ndjson or csv'}), 400
+    claims = current_session()
+    user_id = request.args.get('user_id') if claims['role'] in EXPORT_ALL_ROLES else claims['uid']
+    where, params = [], []
+    try:
+        if user_id not in (None, ''):
+            where.append(f'{owner_col} = ?')
+            params.append(int(user_id))
+        for name, op in (('since', '>='), ('until', '<')):
+            value = _arg_datetime(name)
+            if value:
+                where.append(f'{time_col} {op} ?')
+                params.append(value)
+        if request.args.get('after'):
+            where.append(f'{id_col} > ?')
+            params.append(int(request.args['after']))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    sql = select + (' WHERE ' + ' AND '.join(where) if where else '') + f' ORDER BY {id_col}'
+    rows = RowStream(sql, params)
+    resp = app.response_class(export_chunks(rows, fmt), mimetype='text/csv' if fmt == 'csv' else 'application/x-ndjson')
+    resp.call_on_close(rows.close)
+    resp.headers['Content-Disposition'] = f'attachment; filename={kind}.{fmt}'
+    resp.headers['Cache-Control'] = 'no-store'
+    resp.headers['X-Accel-Buffering'] = 'no'  # don't let a proxy buffer the stream
+    return resp
+
+
+DELIVERY_RIDER_CAPACITY = _env_int('DELIVERY_RIDER_CAPACITY', 30)
+DELIVERY_ASSIGN_LIMIT = _env_int('DELIVERY_ASSIGN_LIMIT', 50000)
+DELIVERY_COMMIT_ROWS = _env_int('DELIVERY_COMMIT_ROWS', 5000)
+DELIVERY_ACTIVE_STATUSES = ('assigned', 'picked_up')
+DISPATCH_ROLES = tuple(r.strip() for r in (os.environ.get('DISPATCH_ROLES') or 'admin').split(',') if r.strip())
+
+
+class RiderPool:
+    # Least-loaded-first matching. Riders sit in one min-heap per pincode, per city and
+    # (riders with no service area) a global one, keyed by (load, id). A rider is in
+    # several heaps, so entries go stale when its load changes; stale entries are
+    # dropped when they surface instead of being searched for and removed.
+    def __init__(self, riders):
+        self.load = {}
+        self.capacity = {}
+        self._heaps = {}
+        self._rider_areas = {}
+        for r in riders:
+            rid = r['id']
+            self.load[rid] = r['active_load']
+            self.capacity[rid] = r['capacity'] or DELIVERY_RIDER_CAPACITY
+            self._rider_areas[rid] = list(self._areas(r['city'], r['pincode']))
+            for area in self._rider_areas[rid]:
+                self._heaps.setdefault(area, []).append((r['active_load'], rid))
+        for heap in self._heaps.values():
+            heapq.heapify(heap)
+
+    @staticmethod
+    def _areas(city, pincode):
+        city = (city or '').strip().lower()
+        pincode = (pincode or '').strip()
+        if pincode:
+            yield ('pin', pincode)
+        if city:
+            yield ('city', city)
+        if not city and not pincode:
+            yield ('any',)
+
+    def _pop(self, area):
+        heap = self._heaps.get(area)
+        while heap:
+            load, rid = heap[0]
+            if load != self.load[rid] or load >= self.capacity[rid]:
+                heapq.heappop(heap)
+                continue
+            return rid
+        return None
+
+    def take(self, city, pincode):
+        # nearest area first: same pincode, same city, then riders without an area
+        city = (city or '').strip().lower()
+        pincode = (pincode or '').strip()
+        for area in (('pin', pincode) if pincode else None, ('city', city) if city else None, ('any',)):
+            if area is None:
+                continue
+            rid = self._pop(area)
+            if rid is not None:
+                self.load[rid] += 1
+                if self.load[rid] < self.capacity[rid]:
+                    for key in self._rider_areas[rid]:
+                        heapq.heappush(self._heaps[key], (self.load[rid], rid))
+                return rid
+        return None
+
+
+def assign_deliveries(db, limit=None):
+    # Batch dispatcher: matches up to `limit` unassigned scheduled deliveries (oldest
+    # first) to active riders, grouped by the address's pincode/city, and writes the
+    # result as one UPDATE ... WHERE id IN (...) per rider, committed every
+    # DELIVERY_COMMIT_ROWS rows.
+    start = time.perf_counter()
+    limit = limit or DELIVERY_ASSIGN_LIMIT
+    marks = ','.join('?' * len(DELIVERY_ACTIVE_STATUSES))
+    riders = db.execute(f"""
+        SELECT p.id, p.city, p.pincode, p.capacity, COUNT(d.id) AS active_load
+        FROM delivery_persons p
+        LEFT JOIN deliveries d ON d.delivery_person_id = p.id AND d.status IN ({marks})
+        WHERE p.active = 1
+        GROUP BY p.id, p.city, p.pincode, p.capacity
+    """, DELIVERY_ACTIVE_STATUSES).fetchall()
+    pool = RiderPool(riders)
+    pending = db.execute("""
+        SELECT d.id, a.city, a.pincode
+        FROM deliveries d LEFT JOIN addresses a ON a.id = d.address_id
+        WHERE d.status = 'scheduled' AND d.delivery_person_id IS NULL
+        ORDER BY d.id
+        LIMIT ?
+    """, (limit,)).fetchall()
+    by_rider, unmatched = {}, 0
+    for d in pending:
+        rid = pool.take(d['city'], d['pincode'])
+        if rid is None:
+            unmatched += 1
+        else:
+            by_rider.setdefault(rid, []).append(d['id'])
+    assigned = conflicts = statements = uncommitted = 0
+    try:
+        for rid, ids in by_rider.items():
+            for i in range(0, len(ids), 900):
+                chunk = ids[i:i + 900]
+                cur = db.execute(f"UPDATE deliveries SET delivery_person_id = ?, status = 'assigned' "
+                                 f"WHERE id IN ({','.join('?' * len(chunk))}) AND delivery_person_id IS NULL AND status = 'scheduled'",
+                                 (rid, *chunk))
+                statements += 1
+                assigned += cur.rowcount
+                conflicts += len(chunk) - cur.rowcount  # taken by a concurrent dispatcher
+                uncommitted += len(chunk)
+                if uncommitted >= DELIVERY_COMMIT_ROWS:
+                    db.commit()
+                    uncommitted = 0
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return {'pending': len(pending), 'assigned': assigned, 'unmatched': unmatched, 'conflicts': conflicts,
+            'riders': len(riders), 'riders_used': len(by_rider), 'statements': statements,
+            'seconds': round(time.perf_counter() - start, 3)}
+
+@app.route('/api/deliveries/assign', methods=['POST'])
+@require_role(*DISPATCH_ROLES)
+def api_deliveries_assign():
+    try:
+        limit = int(request.args['limit']) if request.args.get('limit') else None
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+    return jsonify(assign_deliveries(get_db(), limit))
+
+@app.cli.command('assign-deliveries')
+@click.option('--limit', type=int, default=None, help='Deliveries to match in this run.')
+def assign_deliveries_command(limit):
+    """Assign pending deliveries to active riders."""
+    print(json.dumps(assign_deliveries(get_db(), limit), indent=2))
+
+
+SLOT_MINUTES = _env_int('SLOT_MINUTES', 30)
+SLOT_HORIZON_DAYS = _env_int('SLOT_HORIZON_DAYS', 14)
+SLOT_INDEX_REFRESH = _env_int('SLOT_INDEX_REFRESH', 60)
+SLOT_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def _minutes(value):
+    # TIME comes back as a timedelta from pymysql and as 'HH:MM[:SS]' text from SQLite
+    if hasattr(value, 'total_seconds'):
+        return int(value.total_seconds()) // 60
+    parts = str(value).split(':')
+    return int(parts[0]) * 60 + int(parts[1])
+
+def _slot_datetime(value):
+    # slots are naive local times; an ISO string with an offset is converted to one
+    if not isinstance(value, datetime):
+        value = datetime.fromisoformat(str(value).replace('T', ' '))
+    if value.tzinfo is not None:
+        value = value.astimezone().replace(tzinfo=None)
+    return value.replace(second=0, microsecond=0)
+
+
+class SlotIndex:
+    # Free appointment slots over a rolling horizon. Per doctor: the weekly windows from
+    # doctor_availability and a sorted list of free slot starts (bisect insert/remove on
+    # book/cancel). "Next free slots for a specialty" is a lazy k-way merge over those
+    # doctors' lists, so it reads only as many slots as it returns.
+    def __init__(self, doctors, windows, booked, start, days):
+        self.start = start
+        self.end = start + timedelta(days=days)
+        self._lock = threading.Lock()
+        self.doctors = {d['id']: {'id': d['id'], 'name': d['name'], 'specialty': d['specialty']} for d in doctors}
+        self._specialties = {}
+        for d in doctors:
+            self._specialties.setdefault((d['specialty'] or '').strip().lower(), []).append(d['id'])
+        self._windows = {}
+        for w in windows:
+            # day_of_week: ISO 1 = Monday .. 7 = Sunday (0 is accepted for Sunday)
+            self._windows.setdefault(w['doctor_id'], []).append((int(w['day_of_week']) % 7, _minutes(w['start_time']), _minutes(w['end_time'])))
+        self._free = {}
+        for doc_id in self.doctors:
+            taken = booked.get(doc_id, set())
+            self._free[doc_id] = [t for t in self._slots(doc_id) if t not in taken]
+
+    def _slots(self, doc_id):
+        windows = self._windows.get(doc_id)
+        if not windows:
+            return
+        day = self.start.replace(hour=0, minute=0, second=0, microsecond=0)
+        while day < self.end:
+            iso = day.isoweekday() % 7
+            for dow, lo, hi in sorted(windows, key=lambda w: w[1]):
+                if dow != iso:
+                    continue
+                for m in range(lo, hi - SLOT_MINUTES + 1, SLOT_MINUTES):
+                    t = day + timedelta(minutes=m)
+                    if self.start <= t < self.end:
+                        yield t
+            day += timedelta(days=1)
+
+    def is_slot(self, doc_id, t):
+        # t is a bookable slot start for this doctor (free or not)
+        if not (self.start <= t < self.end) or doc_id not in self.doctors:
+            return False
+        m = t.hour * 60 + t.minute
+        return any(dow == t.isoweekday() % 7 and lo <= m <= hi - SLOT_MINUTES and (m - lo) % SLOT_MINUTES == 0
+                   for dow, lo, hi in self._windows.get(doc_id, ()))
+
+    def book(self, doc_id, t):
+        with self._lock:
+            free = self._free.get(doc_id)
+            if free is None:
+                return
+            i = bisect.bisect_left(free, t)
+            if i < len(free) and free[i] == t:
+                del free[i]
+
+    def release(self, doc_id, t):
+        if not self.is_slot(doc_id, t):
+            return
+        with self._lock:
+            free = self._free[doc_id]
+            i = bisect.bisect_left(free, t)
+            if i == len(free) or free[i] != t:
+                free.insert(i, t)
+
+    def free_slots(self, doc_id, after, limit):
+        with self._lock:
+            free = self._free.get(doc_id, [])
+            i = bisect.bisect_left(free, after)
+            return free[i:i + limit]
+
+    def next_free(self, specialty, after, limit):
+        # [(slot, doctor_id)] in time order (ties by doctor id) across the specialty
+        ids = self._specialties.get((specialty or '').strip().lower(), []) if specialty else list(self.doctors)
+        with self._lock:
+            runs = []
+            for doc_id in ids:
+                free = self._free[doc_id]
+                tail = range(bisect.bisect_left(free, after), len(free))
+                runs.append(zip(map(free.__getitem__, tail), itertools.repeat(doc_id)))
+            return list(itertools.islice(heapq.merge(*runs), limit))
+
+
+_slot_index = None
+_slot_index_state = {'built_at': 0.0, 'day': None}
+_slot_index_lock = threading.Lock()
+
+def get_slot_index(db):
+    # Rebuilt every SLOT_INDEX_REFRESH seconds (bookings made by other processes), when
+    # the day rolls over (moves the horizon) or when doctors/availability change.
+    global _slot_index
+    now = datetime.now().replace(second=0, microsecond=0)
+    def fresh():
+        return (_slot_index is not None and time.monotonic() - _slot_index_state['built_at'] < SLOT_INDEX_REFRESH
+                and _slot_index_state['day'] == now.date())
+    if fresh():
+        return _slot_index
+    with _slot_index_lock:
+        if fresh():
+            return _slot_index
+        doctors = db.execute('SELECT id, name, specialty FROM doctors').fetchall()
+        windows = db.execute('SELECT doctor_id, day_of_week, start_time, end_time FROM doctor_availability').fetchall()
+        booked = {}
+        for r in db.execute('SELECT doctor_id, booked_slot FROM appointments WHERE booked_slot >= ?',
+                            (now.strftime(SLOT_FORMAT),)).fetchall():
+            booked.setdefault(r['doctor_id'], set()).add(_slot_datetime(r['booked_slot']))
+        _slot_index = SlotIndex(doctors, windows, booked, now, SLOT_HORIZON_DAYS)
+        _slot_index_state.update(built_at=time.monotonic(), day=now.date())
+        return _slot_index
+
+@on_tables_written
+def _invalidate_slot_index(tables):
+    # appointment writes made here update the index in place (book/release)
+    if tables & {'doctors', 'doctor_availability'}:
+        _slot_index_state['built_at'] = 0.0
+
+def _is_slot_conflict(e):
+    # the unique (doctor_id, booked_slot) index said no; other constraint failures (FK,
+    # NOT NULL) are errors
+    if isinstance(e, sqlite3.IntegrityError):
+        return str(e).startswith('UNIQUE constraint failed') and 'appointments.booked_slot' in str(e)
+    return bool(e.args) and e.args[0] == 1062 and 'uq_appointments_doctor_slot' in str(e.args[-1])
+
+def _slot_args():
+    after = request.args.get('after')
+    after = _slot_datetime(after) if after else datetime.now()
+    limit = min(max(int(request.args.get('limit') or 10), 1), MEDICINES_MAX_LIMIT)
+    return after, limit
+
+@app.route('/api/doctors/<int:doctor_id>/slots')
+def api_doctor_slots(doctor_id):
+    try:
+        after, limit = _slot_args()
+    except ValueError:
+        return jsonify({'error': 'after must be an ISO datetime and limit an integer'}), 400
+    index = get_slot_index(get_db())
+    if doctor_id not in index.doctors:
+        return jsonify({'error': 'not found'}), 404
+    return jsonify({'doctor_id': doctor_id, 'slot_minutes': SLOT_MINUTES,
+                    'slots': [t.strftime(SLOT_FORMAT) for t in index.free_slots(doctor_id, after, limit)]})
+
+@app.route('/api/slots')
+def api_slots():
+    # ?specialty=&after=&limit=: earliest free slots across all (matching) doctors
+    try:
+        after, limit = _slot_args()
+    except ValueError:
+        return jsonify({'error': 'after must be an ISO datetime and limit an integer'}), 400
+    index = get_slot_index(get_db())
+    items = [{'start': t.strftime(SLOT_FORMAT), **index.doctors[doc_id]}
+             for t, doc_id in index.next_free(request.args.get('specialty'), after, limit)]
+    return jsonify({'slot_minutes': SLOT_MINUTES, 'items': items})
+
+@app.route('/api/appointments', methods=['POST'])
+@require_auth
+def api_book_appointment():
+    data = request.get_json(silent=True) or {}
+    try:
+        doctor_id = int(data['doctor_id'])
+        start = _slot_datetime(data['start'])
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'error': 'doctor_id and start (ISO datetime) are required'}), 400
+    db = get_db()
+    index = get_slot_index(db)
+    if not index.is_slot(doctor_id, start) or start < datetime.now():
+        return jsonify({'error': 'not an available slot for this doctor'}), 400
+    slot = start.strftime(SLOT_FORMAT)
+    try:
+        cur = db.execute('INSERT INTO appointments(user_id, doctor_id, scheduled_at, status, booked_slot) VALUES(?, ?, ?, ?, ?)',
+                         (current_session()['uid'], doctor_id, slot, 'scheduled', slot))
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        if not _is_slot_conflict(e):
+            raise
+        index.book(doctor_id, start)  # the unique (doctor_id, booked_slot) index said no
+        return jsonify({'error': 'slot already booked'}), 409
+    index.book(doctor_id, start)
+    return jsonify({'status': 'scheduled', 'id': cur.lastrowid, 'doctor_id': doctor_id, 'start': slot}), 201
+
+@app.route('/api/appointments/<int:appointment_id>/cancel', methods=['POST'])
+@require_auth
+def api_cancel_appointment(appointment_id):
+    db = get_db()
+    row = db.execute('SELECT doctor_id, booked_slot FROM appointments WHERE id = ? AND user_id = ?',
+                     (appointment_id, current_session()['uid'])).fetchone()
+    if not row:
+        return jsonify({'error': 'not found'}), 404
+    cur = db.execute("UPDATE appointments SET status = 'cancelled', booked_slot = NULL WHERE id = ? AND booked_slot IS NOT NULL",
+                     (appointment_id,))
+    db.commit()
+    if cur.rowcount:
+        get_slot_index(db).release(row['doctor_id'], _slot_datetime(row['booked_slot']))
+    return jsonify({'status': 'cancelled'})
+
+
+REWARD_RUPEES_PER_POINT = _env_int('REWARD_RUPEES_PER_POINT', 10)
+REWARD_HISTORY_LIMIT = _env_int('REWARD_HISTORY_LIMIT', 50)
+
+
+def reward_balance(db, user_id):
+    # snapshot + the ledger entries appended since it was taken: two index seeks. The
+    # delta is normally empty: accruals and redemptions fold their entries into the
+    # snapshot as they write them, and compact_reward_balances() sweeps up the rest
+    snap = db.execute('SELECT points_balance, ledger_id FROM reward_points WHERE user_id = ?', (user_id,)).fetchone()
+    base, since = (snap['points_balance'] or 0, snap['ledger_id'] or 0) if snap else (0, 0)
+    delta = db.execute('SELECT COALESCE(SUM(delta), 0) AS d FROM reward_ledger WHERE user_id = ? AND id > ?',
+                       (user_id, since)).fetchone()['d']
+    return int(base + delta)
+
+def lock_reward_balances(db, user_ids):
+    # Every writer of a user's ledger entries (accruals, redemptions, compaction) first
+    # locks that user's reward_points row and keeps it until it commits: FOR UPDATE on
+    # MySQL, on SQLite the write lock covers it. A lock holder therefore sees no
+    # uncommitted entries of these users, and their MAX(id) is a safe snapshot
+    # watermark. Always in user_id order, so two writers can't deadlock. Call inside
+    # begin_write(); the caller commits.
+    user_ids = sorted(set(user_ids))
+    ignore = 'INSERT OR IGNORE' if db.engine == 'sqlite' else 'INSERT IGNORE'
+    for i in range(0, len(user_ids), 500):
+        chunk = user_ids[i:i + 500]
+        db.executemany(f'{ignore} INTO reward_points(user_id, points_balance, ledger_id) VALUES(?, 0, 0)', [(u,) for u in chunk])
+        if db.engine == 'mysql':
+            db.execute(f'SELECT id FROM reward_points WHERE user_id IN ({",".join("?" * len(chunk))}) ORDER BY user_id FOR UPDATE',
+                       chunk)
+
+def fold_reward_entries(db, user_ids):
+    # Moves these (locked, see lock_reward_balances) users' new ledger entries into their
+    # snapshots: one UPDATE per 500 users. Returns the number of snapshots changed.
+    user_ids = sorted(set(user_ids))
+    now = datetime.now().strftime(SLOT_FORMAT)
+    pending = 'FROM reward_ledger l WHERE l.user_id = reward_points.user_id AND l.id > COALESCE(reward_points.ledger_id, 0)'
+    changed = 0
+    for i in range(0, len(user_ids), 500):
+        chunk = user_ids[i:i + 500]
+        changed += db.execute(f'UPDATE reward_points SET points_balance = COALESCE(points_balance, 0) + '
+                              f'(SELECT COALESCE(SUM(l.delta), 0) {pending}), '
+                              f'ledger_id = (SELECT MAX(l.id) FROM reward_ledger l WHERE l.user_id = reward_points.user_id), '
+                              f'updated_at = ? WHERE user_id IN ({",".join("?" * len(chunk))}) AND EXISTS (SELECT 1 {pending})',
+                              (now, *chunk)).rowcount
+    return changed
+
+def compact_reward_balances(db, batch=500):
+    # Folds every user's new ledger entries into their snapshot, `batch` users per
+    # transaction. There is no global watermark: ids are handed out before commit, so
+    # MAX(id) can be ahead of entries still in flight. Returns the snapshots changed.
+    users = [r['user_id'] for r in db.execute(
+        'SELECT DISTINCT l.user_id FROM reward_ledger l LEFT JOIN reward_points r ON r.user_id = l.user_id '
+        'WHERE l.id > COALESCE(r.ledger_id, 0) ORDER BY l.user_id').fetchall()]
+    db.rollback()
+    changed = 0
+    for i in range(0, len(users), batch):
+        try:
+            db.begin_write()
+            lock_reward_balances(db, users[i:i + batch])
+            changed += fold_reward_entries(db, users[i:i + batch])
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+    return changed
+
+def _accrue_points(db, where, params):
+    # locks the snapshots of the users whose orders match `where` (see
+    # lock_reward_balances), then one INSERT ... SELECT over those orders, each entry tied
+    # to the order and its payment transaction, and folds the new entries into those
+    # snapshots while the locks are held. Orders that already have an accrual are
+    # skipped (and the unique (order_id, reason) index backs that up).
+    users = [r['user_id'] for r in db.execute(f'SELECT DISTINCT o.user_id FROM orders o WHERE {where}', params).fetchall()]
+    lock_reward_balances(db, users)
+    points = ('CAST(o.total_amount / ? AS INTEGER)' if db.engine == 'sqlite'
+              else 'CAST(FLOOR(o.total_amount / ?) AS SIGNED)')
+    cur = db.execute(f"""
+        INSERT INTO reward_ledger(user_id, delta, reason, order_id, transaction_id)
+        SELECT o.user_id, {points}, 'order_accrual', o.id,
+               (SELECT MIN(t.id) FROM transactions t WHERE t.order_id = o.id AND t.type = 'payment')
+        FROM orders o
+        WHERE {where}
+          AND COALESCE(o.status, '') NOT IN ('cancelled', 'refunded')
+          AND o.total_amount >= ?
+          AND NOT EXISTS (SELECT 1 FROM reward_ledger l WHERE l.order_id = o.id AND l.reason = 'order_accrual')
+    """, (REWARD_RUPEES_PER_POINT, *params, REWARD_RUPEES_PER_POINT))
+    if cur.rowcount:
+        fold_reward_entries(db, users)
+    return cur.rowcount
+
+def accrue_reward_points(db, day):
+    # Credits every order placed on `day` (a date) that has no accrual yet, so re-running a
+    # day is harmless. Checkout credits each order through a 'reward_accrual' job; this
+    # is the backfill for orders those jobs missed.
+    start = datetime(day.year, day.month, day.day)
+    try:
+        db.begin_write()
+        credited = _accrue_points(db, 'o.created_at >= ? AND o.created_at < ?',
+                                  (start.strftime(SLOT_FORMAT), (start + timedelta(days=1)).strftime(SLOT_FORMAT)))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return credited
+
+def credit_order_points(db, order_ids):
+    # the 'reward_accrual' job: the same rules for just these orders (inside the job's
+    # write transaction; the caller commits)
+    return _accrue_points(db, f'o.id IN ({",".join("?" * len(order_ids))})', order_ids)
+
+@app.route('/api/rewards')
+@replica_reads
+@require_auth
+def api_rewards():
+    # balance plus one page of history, newest first (?before=<entry id> for the next)
+    db = get_db()
+    user_id = current_session()['uid']
+    try:
+        before = int(request.args.get('before') or 0)
+        limit = min(max(int(request.args.get('limit') or 20), 1), REWARD_HISTORY_LIMIT)
+    except ValueError:
+        return jsonify({'error': 'before and limit must be integers'}), 400
+    sql = 'SELECT id, delta, reason, reward, order_id, transaction_id, created_at FROM reward_ledger WHERE user_id = ?'
+    params = [user_id]
+    if before:
+        sql += ' AND id < ?'
+        params.append(before)
+    history = db.rows(sql + ' ORDER BY id DESC LIMIT ?', params + [limit + 1])
+    return jsonify({'balance': reward_balance(db, user_id), 'history': history[:limit],
+                    'next_before': history.value(limit - 1, 'id') if len(history) > limit else None})
+
+@app.route('/api/rewards/redeem', methods=['POST'])
+@require_auth
+def api_rewards_redeem():
+    data = request.get_json(silent=True) or {}
+    try:
+        points = int(data.get('points'))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'points must be an integer'}), 400
+    if points <= 0:
+        return jsonify({'error': 'points must be positive'}), 400
+    reward = str(data['reward'])[:128] if data.get('reward') else None  # shown in the history, not trusted
+    try:
+        transaction_id = int(data['transaction_id']) if data.get('transaction_id') is not None else None
+    except (TypeError, ValueError):
+        return jsonify({'error': 'transaction_id must be an integer'}), 400
+    db = get_db()
+    user_id = current_session()['uid']
+    try:
+        # Holding this user's snapshot lock (see lock_reward_balances), nobody else can
+        # add to their ledger, so concurrent redemptions can't overdraw the balance. The
+        # reads come after the lock, so on InnoDB their snapshot includes every entry.
+        db.begin_write()
+        lock_reward_balances(db, [user_id])
+        if transaction_id is not None and not db.execute('SELECT id FROM transactions WHERE id = ? AND user_id = ?',
+                                                         (transaction_id, user_id)).fetchone():
+            db.rollback()
+            return jsonify({'error': 'transaction not found'}), 404
+        balance = reward_balance(db, user_id)
+        if balance < points:
+            db.rollback()
+            return jsonify({'error': 'not enough points', 'balance': balance}), 409
+        entry = db.execute("INSERT INTO reward_ledger(user_id, delta, reason, reward, transaction_id) VALUES(?, ?, 'redemption', ?, ?)",
+                           (user_id, -points, reward, transaction_id)).lastrowid
+        db.execute('UPDATE reward_points SET points_balance = ?, ledger_id = ?, updated_at = ? WHERE user_id = ?',
+                   (balance - points, entry, datetime.now().strftime(SLOT_FORMAT), user_id))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return jsonify({'status': 'redeemed', 'entry_id': entry, 'balance': balance - points}), 201
+
+@app.cli.command('accrue-points')
+@click.option('--day', default=None, help='YYYY-MM-DD; defaults to yesterday.')
+def accrue_points_command(day):
+    """Credit reward points for a day's orders and compact balances."""
+    day = datetime.strptime(day, '%Y-%m-%d').date() if day else (datetime.now() - timedelta(days=1)).date()
+    db = get_db()
+    start = time.perf_counter()
+    credited = accrue_reward_points(db, day)
+    compacted = compact_reward_balances(db)
+    print(json.dumps({'day': day.isoformat(), 'orders_credited': credited, 'balances_compacted': compacted,
+                      'seconds': round(time.perf_counter() - start, 3)}))
+
+
+LOW_STOCK_THRESHOLD = _env_int('LOW_STOCK_THRESHOLD', 20)
+DASHBOARD_ROLES = tuple(r.strip() for r in (os.environ.get('DASHBOARD_ROLES') or 'admin,finance').split(',') if r.strip())
+DASHBOARD_MAX_DAYS = _env_int('DASHBOARD_MAX_DAYS', 366)
+
+
+def _upsert_add(db, table, keys, counters, rows, fixed=()):
+    # INSERT the rows (columns: keys, fixed, counters), or add their counters to the
+    # existing row with the same key
+    cols = keys + fixed + counters
+    sql = f'INSERT INTO {table}({", ".join(cols)}) VALUES({", ".join("?" * len(cols))}) '
+    if db.engine == 'sqlite':
+        sql += f'ON CONFLICT({", ".join(keys)}) DO UPDATE SET ' + ', '.join(f'{c} = {c} + excluded.{c}' for c in counters)
+    else:
+        sql += 'ON DUPLICATE KEY UPDATE ' + ', '.join(f'{c} = {c} + VALUES({c})' for c in counters)
+    db.executemany(sql, rows)
+
+def _order_city_sql(order_alias):
+    return (f"COALESCE((SELECT a.city FROM addresses a WHERE a.user_id = {order_alias}.user_id "
+            f"ORDER BY a.is_default DESC, a.id LIMIT 1), '')")
+
+def record_order_rollups(db, order_ids):
+    # Adds the given orders to the rollups and refreshes low_stock for their medicines
+    # (the 'order_rollups' job, which runs once checkout has committed). Rows are upserted
+    # in key order, so concurrent batches touch them in the same order too.
+    marks = ','.join('?' * len(order_ids))
+    orders = {r['id']: (str(r['created_at'])[:10], r['city'] or '') for r in db.execute(
+        f"SELECT o.id, o.created_at, {_order_city_sql('o')} AS city FROM orders o "
+        f"WHERE o.id IN ({marks}) AND COALESCE(o.status, '') NOT IN ('cancelled', 'refunded')", order_ids).fetchall()}
+    if not orders:
+        return
+    items = db.execute(f'SELECT oi.order_id, oi.medicine_id, COALESCE(m.category_id, 0) AS category_id, oi.quantity, oi.price '
+                       f'FROM order_items oi LEFT JOIN medicines m ON m.id = oi.medicine_id '
+                       f'WHERE oi.order_id IN ({",".join("?" * len(orders))})', list(orders)).fetchall()
+    by_medicine, by_category, by_city = {}, {}, {}
+    for r in items:
+        day, city = orders[r['order_id']]
+        revenue = r['price'] * r['quantity']
+        for totals, key in ((by_medicine, (day, r['medicine_id'], r['category_id'])), (by_category, (day, r['category_id'])),
+                            (by_city, (day, city))):
+            units, rev, seen = totals.get(key, (0, 0, set()))
+            seen.add(r['order_id'])
+            totals[key] = (units + r['quantity'], rev + revenue, seen)
+    _upsert_add(db, 'sales_daily_medicine', ('day', 'medicine_id'), ('units', 'revenue', 'orders'),
+                [(*key, units, rev, len(seen)) for key, (units, rev, seen) in sorted(by_medicine.items())],
+                fixed=('category_id',))
+    _upsert_add(db, 'sales_daily_category', ('day', 'category_id'), ('units', 'revenue', 'orders'),
+                [(*key, units, rev, len(seen)) for key, (units, rev, seen) in sorted(by_category.items())])
+    _upsert_add(db, 'orders_daily_city', ('day', 'city'), ('orders', 'revenue'),
+                [(*key, len(seen), rev) for key, (_, rev, seen) in sorted(by_city.items())])
+    if items:
+        sync_low_stock(db, sorted({r['medicine_id'] for r in items}))
+
+def sync_low_stock(db, medicine_ids):
+    marks = ','.join('?' * len(medicine_ids))
+    db.execute(f'DELETE FROM low_stock WHERE medicine_id IN ({marks})', medicine_ids)
+    db.execute(f'INSERT INTO low_stock(medicine_id, stock, updated_at) SELECT id, stock, ? FROM medicines '
+               f'WHERE id IN ({marks}) AND stock < ?',
+               (datetime.now().strftime(SLOT_FORMAT), *medicine_ids, LOW_STOCK_THRESHOLD))
+
+def rebuild_low_stock(db):
+    # one range scan of idx_medicines_stock
+    db.execute('DELETE FROM low_stock')
+    db.execute('INSERT INTO low_stock(medicine_id, stock, updated_at) SELECT id, stock, ? FROM medicines WHERE stock < ?',
+               (datetime.now().strftime(SLOT_FORMAT), LOW_STOCK_THRESHOLD))
+
+def rebuild_rollups(db):
+    # Recomputes every rollup from orders/order_items in one transaction (backfills,
+    # or after orders were changed outside checkout).
+    day = 'date(o.created_at)' if db.engine == 'sqlite' else 'DATE(o.created_at)'
+    live = "COALESCE(o.status, '') NOT IN ('cancelled', 'refunded')"
+    try:
+        db.begin_write()
+        db.execute("DELETE FROM jobs WHERE kind = 'order_rollups'")  # this counts their orders already
+        for table in ('sales_daily_medicine', 'sales_daily_category', 'orders_daily_city'):
+            db.execute(f'DELETE FROM {table}')
+        db.execute(f"""
+            INSERT INTO sales_daily_medicine(day, medicine_id, category_id, units, revenue, orders)
+            SELECT {day}, oi.medicine_id, COALESCE(MAX(m.category_id), 0), SUM(oi.quantity), SUM(oi.quantity * oi.price), COUNT(DISTINCT o.id)
+            FROM orders o JOIN order_items oi ON oi.order_id = o.id LEFT JOIN medicines m ON m.id = oi.medicine_id
+            WHERE {live}
+            GROUP BY {day}, oi.medicine_id
+        """)
+        db.execute(f"""
+            INSERT INTO sales_daily_category(day, category_id, units, revenue, orders)
+            SELECT {day}, COALESCE(m.category_id, 0), SUM(oi.quantity), SUM(oi.quantity * oi.price), COUNT(DISTINCT o.id)
+            FROM orders o JOIN order_items oi ON oi.order_id = o.id LEFT JOIN medicines m ON m.id = oi.medicine_id
+            WHERE {live}
+            GROUP BY {day}, COALESCE(m.category_id, 0)
+        """)
+        db.execute(f"""
+            INSERT INTO orders_daily_city(day, city, orders, revenue)
+            SELECT d, city, COUNT(*), SUM(total_amount)
+            FROM (SELECT {day} AS d, {_order_city_sql('o')} AS city, o.total_amount FROM orders o WHERE {live}) x
+            GROUP BY d, city
+        """)
+        rebuild_low_stock(db)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+def _dashboard_range():
+    # ?from=YYYY-MM-DD&to=YYYY-MM-DD (inclusive), default the last 30 days
+    today = datetime.now().date()
+    end = datetime.strptime(request.args['to'], '%Y-%m-%d').date() if request.args.get('to') else today
+    start = datetime.strptime(request.args['from'], '%Y-%m-%d').date() if request.args.get('from') else end - timedelta(days=29)
+    if start > end or (end - start).days >= DASHBOARD_MAX_DAYS:
+        raise ValueError(f'from must not be after to, and the range at most {DASHBOARD_MAX_DAYS} days')
+    return start.isoformat(), end.isoformat()
+
+def dashboard_route(rule):
+    # GET, DASHBOARD_ROLES only, read from a replica; view(start, end) gets the validated date range
+    def decorator(view):
+        @app.route(rule, endpoint=view.__name__)
+        @replica_reads
+        @require_role(*DASHBOARD_ROLES)
+        @functools.wraps(view)
+        def wrapper():
+            try:
+                start, end = _dashboard_range()
+                limit = min(max(int(request.args.get('limit') or 10), 1), MEDICINES_MAX_LIMIT)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            return jsonify({'from': start, 'to': end, 'items': view(get_db(), start, end, limit)})
+        return wrapper
+    return decorator
+
+@dashboard_route('/api/dashboard/sales')
+def api_dashboard_sales(db, start, end, limit):
+    # orders and revenue per day (the city rollup counts each order exactly once)
+    return db.rows('SELECT day, SUM(orders) AS orders, SUM(revenue) AS revenue FROM orders_daily_city '
+                   'WHERE day BETWEEN ? AND ? GROUP BY day ORDER BY day', (start, end))
+
+@dashboard_route('/api/dashboard/categories')
+def api_dashboard_categories(db, start, end, limit):
+    return db.rows('SELECT s.category_id, COALESCE(c.name, ?) AS name, SUM(s.units) AS units, SUM(s.revenue) AS revenue '
+                   'FROM sales_daily_category s LEFT JOIN categories c ON c.id = s.category_id '
+                   'WHERE s.day BETWEEN ? AND ? GROUP BY s.category_id, c.name ORDER BY revenue DESC',
+                      ('Uncategorized', start, end))
+
+@dashboard_route('/api/dashboard/top-medicines')
+def api_dashboard_top_medicines(db, start, end, limit):
+    return db.rows('SELECT t.medicine_id, m.name, t.units, t.revenue FROM ('
+                   'SELECT medicine_id, SUM(units) AS units, SUM(revenue) AS revenue FROM sales_daily_medicine '
+                   'WHERE day BETWEEN ? AND ? GROUP BY medicine_id ORDER BY revenue DESC LIMIT ?) t '
+                   'LEFT JOIN medicines m ON m.id = t.medicine_id ORDER BY t.revenue DESC', (start, end, limit))
+
+@dashboard_route('/api/dashboard/cities')
+def api_dashboard_cities(db, start, end, limit):
+    return db.rows('SELECT city, SUM(orders) AS orders, SUM(revenue) AS revenue FROM orders_daily_city '
+                   'WHERE day BETWEEN ? AND ? GROUP BY city ORDER BY orders DESC LIMIT ?', (start, end, limit))
+
+@app.route('/api/dashboard/low-stock')
+@replica_reads
+@require_role(*DASHBOARD_ROLES)
+def api_dashboard_low_stock():
+    rows = get_db().rows('SELECT l.medicine_id, m.name, l.stock, l.updated_at FROM low_stock l '
+                         'LEFT JOIN medicines m ON m.id = l.medicine_id ORDER BY l.stock, l.medicine_id')
+    return jsonify({'threshold': LOW_STOCK_THRESHOLD, 'items': rows})
+
+@app.cli.command('rebuild-rollups')
+def rebuild_rollups_command():
+    """Recompute the sales/inventory rollup tables from orders."""
+    start = time.perf_counter()
+    rebuild_rollups(get_db())
+    print(f'rollups rebuilt in {time.perf_counter() - start:.2f}s')
+
+
+@app.cli.command('seed-db')
+def seed_db_command():
+    """Insert the demo catalog and sample rows into empty tables."""
+    init_db()
+    added = seed_db(get_db())
+    print(', '.join(f'{table}: {n}' for table, n in added.items()) if added else 'nothing to seed')
+
+
+@app.cli.command('set-role')
+@click.argument('email')
+@click.argument('role')
+def set_role_command(email, role):
+    """Give a user a role (e.g. admin, finance or customer)."""
+    db = get_db()
+    cur = db.execute('UPDATE users SET role = ? WHERE email = ?', (role, email))
+    db.commit()
+    if not cur.rowcount:
+        raise click.ClickException(f'no user with email {email}')
+    print(f'{email}: {role} (takes effect at their next login)')
+
+
+JOBS_WORKERS = _env_int('JOBS_WORKERS', 2)
+JOBS_ROLES = tuple(r.strip() for r in (os.environ.get('JOBS_ROLES') or 'admin').split(',') if r.strip())
+metrics.counter('genricycle_jobs_total', 'Background jobs finished, by kind and outcome (done, retried, dead).')
+metrics.histogram('genricycle_job_latency_seconds', 'Time from enqueue to done, per job.', _LATENCY_BUCKETS + (30.0, 60.0, 300.0))
+metrics.histogram('genricycle_job_run_seconds', 'Handler time per batch.', _LATENCY_BUCKETS)
+metrics.histogram('genricycle_job_batch_size', 'Jobs handled per batch.', (1, 2, 5, 10, 20, 50, 100, 200, 500))
+
+
+class JobQueue:
+    # Durable background jobs in the `jobs` table. enqueue() inserts through the caller's
+    # DBProxy, so a job commits or rolls back with the transaction that asked for it.
+    # Worker threads claim due jobs of one kind, up to that handler's batch_size, by
+    # leasing them (status 'running', run_at = end of the lease, so the jobs of a worker
+    # that died come back). The handler gets all their payloads in one transaction that
+    # also deletes them. If it raises, a batch is retried one job at a time; a failing job
+    # goes back to 'queued' with exponential backoff, and to 'dead' after max_attempts.
+    def __init__(self, workers=2, poll=1.0, lease=60.0, max_attempts=5, backoff=2.0, backoff_max=300.0):
+        self.workers = workers
+        self.poll = poll
+        self.lease = lease
+        self.max_attempts = max(1, max_attempts)
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self._handlers = {}
+        self._threads = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._stats = {'batches': 0, 'done': 0, 'retried': 0, 'dead': 0}
+
+    def handler(self, kind, batch_size=1):
+        # fn(db, payloads) handles up to batch_size jobs of `kind`; it must not commit
+        def decorator(fn):
+            self._handlers[kind] = (fn, max(1, batch_size))
+            return fn
+        return decorator
+
+    def enqueue(self, db, kind, payload, delay=0.0):
+        if kind not in self._handlers:
+            raise ValueError(f'no handler for job kind {kind!r}')
+        now = time.time()
+        cur = db.execute('INSERT INTO jobs(kind, payload, status, attempts, run_at, created_at) VALUES(?, ?, ?, 0, ?, ?)',
+                         (kind, json.dumps(payload, separators=(',', ':')), 'queued', now + delay, now))
+        self.start()
+        return cur.lastrowid
+
+    def wake(self):
+        self._wake.set()
+
+    def start(self, workers=None):
+        # Idempotent. With JOBS_WORKERS=0 this process only enqueues; `flask run-jobs`
+        # (or any process that runs workers) picks its jobs up.
+        workers = self.workers if workers is None else workers
+        if self._threads or workers <= 0:
+            return
+        with self._lock:
+            if self._threads:
+                return
+            self._stop.clear()
+            self._threads = [threading.Thread(target=self._work, name=f'jobs-{i}', daemon=True) for i in range(workers)]
+            for t in self._threads:
+                t.start()
+
+    def stop(self, timeout=None):
+        with self._lock:
+            threads, self._threads = self._threads, []
+        self._stop.set()
+        self._wake.set()
+        for t in threads:
+            t.join(timeout)
+
+    def reset(self):
+        # in a freshly forked child, where the parent's worker threads don't exist
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def _work(self):
+        db = DBProxy(None, _db_engine())
+        while not self._stop.is_set():
+            self._wake.clear()
+            try:
+                done = self.run_once(db)
+            except Exception:
+                app.logger.exception('job worker failed')
+                done = 0
+            finally:
+                db.close()
+            if not done:
+                self._wake.wait(self.poll)
+
+    def run_once(self, db):
+        # claims and runs one batch; returns how many jobs it claimed (0: nothing due)
+        kind, jobs, token = self._claim(db)
+        if jobs:
+            self._run(db, kind, jobs, token)
+        return len(jobs)
+
+    def _claim(self, db):
+        kinds = list(self._handlers)
+        now = time.time()
+        due = f"status IN ('queued', 'running') AND run_at <= ? AND kind IN ({','.join('?' * len(kinds))})"
+        # a plain read first, so an idle poll takes no write lock
+        row = db.execute(f'SELECT kind FROM jobs WHERE {due} ORDER BY run_at LIMIT 1', (now, *kinds)).fetchone()
+        if row is None:
+            db.rollback()
+            return None, [], None
+        kind = row['kind']
+        db.begin_write()
+        rows = db.execute(f"SELECT id, payload, attempts, created_at FROM jobs WHERE {due} AND kind = ? ORDER BY run_at, id LIMIT ?"
+                          + (' FOR UPDATE SKIP LOCKED' if db.engine == 'mysql' else ''),
+                          (now, *kinds, kind, self._handlers[kind][1])).fetchall()
+        if not rows:
+            db.rollback()
+            return None, [], None
+        token = secrets.token_hex(8)
+        db.execute(f"UPDATE jobs SET status = 'running', attempts = attempts + 1, run_at = ?, locked_by = ? "
+                   f"WHERE id IN ({','.join('?' * len(rows))})", (now + self.lease, token, *(r['id'] for r in rows)))
+        db.commit()
+        return kind, [{'id': r['id'], 'payload': json.loads(r['payload']), 'attempts': r['attempts'] + 1,
+                       'created_at': r['created_at']} for r in rows], token
+
+    def _run(self, db, kind, jobs, token):
+        fn = self._handlers[kind][0]
+        t0 = time.perf_counter()
+        try:
+            db.begin_write()
+            marks = ','.join('?' * len(jobs))
+            # jobs whose lease ran out may have been claimed again (or cancelled) meanwhile
+            mine = {r['id'] for r in db.execute(f'SELECT id FROM jobs WHERE id IN ({marks}) AND locked_by = ?'
+                                                + (' FOR UPDATE' if db.engine == 'mysql' else ''),
+                                                (*(j['id'] for j in jobs), token)).fetchall()}
+            jobs = [j for j in jobs if j['id'] in mine]
+            if jobs:
+                db.execute(f'DELETE FROM jobs WHERE id IN ({",".join("?" * len(jobs))})', [j['id'] for j in jobs])
+                fn(db, [j['payload'] for j in jobs])
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            if len(jobs) > 1:
+                for job in jobs:
+                    self._run(db, kind, [job], token)
+            elif jobs:
+                self._failed(db, kind, jobs[0], token, e)
+            return
+        finished = time.time()
+        metrics.observe('genricycle_job_run_seconds', time.perf_counter() - t0, (('kind', kind),))
+        metrics.observe('genricycle_job_batch_size', len(jobs), (('kind', kind),))
+        metrics.inc('genricycle_jobs_total', (('kind', kind), ('outcome', 'done')), len(jobs))
+        for job in jobs:
+            metrics.observe('genricycle_job_latency_seconds', finished - job['created_at'], (('kind', kind),))
+        with self._lock:
+            self._stats['batches'] += 1
+            self._stats['done'] += len(jobs)
+
+    def _failed(self, db, kind, job, token, error):
+        dead = job['attempts'] >= self.max_attempts
+        delay = min(self.backoff * 2 ** (job['attempts'] - 1), self.backoff_max) * random.uniform(0.5, 1.0)
+        message = f'{type(error).__name__}: {error}'[:2000]
+        db.execute('UPDATE jobs SET status = ?, run_at = ?, locked_by = NULL, last_error = ? WHERE id = ? AND locked_by = ?',
+                   ('dead' if dead else 'queued', time.time() + delay, message, job['id'], token))
+        db.commit()
+        outcome = 'dead' if dead else 'retried'
+        metrics.inc('genricycle_jobs_total', (('kind', kind), ('outcome', outcome)))
+        with self._lock:
+            self._stats[outcome] += 1
+        if dead:
+            app.logger.error('job %s (%s) is dead after %d attempts: %s', job['id'], kind, job['attempts'], message)
+        else:
+            app.logger.warning('job %s (%s) failed, retrying in %.0fs: %s', job['id'], kind, delay, message)
+
+    def depth(self, db):
+        # -> rows of (kind, status, n, oldest created_at)
+        return db.execute('SELECT kind, status, COUNT(*) AS n, MIN(created_at) AS oldest FROM jobs GROUP BY kind, status').fetchall()
+
+    def stats(self):
+        with self._lock:
+            out = dict(self._stats)
+            out['threads'] = len(self._threads)
+        return out
+
+
+job_queue = JobQueue(workers=JOBS_WORKERS, poll=_env_float('JOBS_POLL_INTERVAL', 1.0), lease=_env_float('JOBS_LEASE', 60.0),
+                     max_attempts=_env_int('JOBS_MAX_ATTEMPTS', 5), backoff=_env_float('JOBS_BACKOFF', 2.0),
+                     backoff_max=_env_float('JOBS_BACKOFF_MAX', 300.0))
+
+@on_tables_written
+def _wake_job_workers(tables):
+    if 'jobs' in tables:
+        job_queue.wake()
+
+@job_queue.handler('order_rollups', batch_size=100)
+def _order_rollups_job(db, payloads):
+    record_order_rollups(db, sorted({p['order_id'] for p in payloads}))
+
+@job_queue.handler('reward_accrual', batch_size=200)
+def _reward_accrual_job(db, payloads):
+    credit_order_points(db, sorted({p['order_id'] for p in payloads}))
+
+@app.route('/api/jobs')
+@require_role(*JOBS_ROLES)
+def api_jobs():
+    # queue depth per kind and status, and the latest dead jobs
+    db = get_db()
+    now = time.time()
+    kinds = {}
+    for r in job_queue.depth(db):
+        k = kinds.setdefault(r['kind'], {'queued': 0, 'running': 0, 'dead': 0, 'oldest_seconds': None})
+        k[r['status']] = r['n']
+        if r['status'] != 'dead':
+            k['oldest_seconds'] = round(max(k['oldest_seconds'] or 0.0, now - r['oldest']), 3)
+    dead = [dict(r, payload=json.loads(r['payload'])) for r in db.execute(
+        "SELECT id, kind, payload, attempts, last_error, created_at FROM jobs WHERE status = 'dead' "
+        "ORDER BY id DESC LIMIT 50").fetchall()]
+    return jsonify({'kinds': kinds, 'dead': dead, 'workers': job_queue.stats()})
+
+@app.route('/api/jobs/<int:job_id>/retry', methods=['POST'])
+@require_role(*JOBS_ROLES)
+def api_jobs_retry(job_id):
+    db = get_db()
+    cur = db.execute("UPDATE jobs SET status = 'queued', attempts = 0, run_at = ?, last_error = NULL "
+                     "WHERE id = ? AND status = 'dead'", (time.time(), job_id))
+    db.commit()
+    if cur.rowcount != 1:
+        return jsonify({'error': 'no dead job with that id'}), 404
+    return jsonify({'status': 'queued', 'id': job_id})
+
+@app.cli.command('run-jobs')
+@click.option('--once', is_flag=True, help='Run the jobs that are due now, then exit.')
+@click.option('--workers', type=int, default=None, help='Worker threads; defaults to JOBS_WORKERS (at least 1).')
+def run_jobs_command(once, workers):
+    """Process background jobs until interrupted (or, with --once, until none is due)."""
+    if once:
+        db = DBProxy(None, _db_engine())
+        start = time.perf_counter()
+        claimed = 0
+        try:
+            while True:
+                n = job_queue.run_once(db)
+                if not n:
+                    break
+                claimed += n
+        finally:
+            db.close()
+        print(json.dumps(dict(job_queue.stats(), claimed=claimed, seconds=round(time.perf_counter() - start, 3))))
+        return
+    job_queue.start(max(1, workers or JOBS_WORKERS))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        job_queue.stop()
+
+
+WARMUP_PATHS = [p.strip() for p in (os.environ.get('WARMUP_PATHS') or
+                '/api/categories,/api/doctors,/api/lab-tests,/api/medicines/brands,/api/medicines').split(',') if p.strip()]
+
+_warmup = {'state': 'cold', 'error': None, 'seconds': None, 'steps': {}}
+_warmup_lock = threading.Lock()
+
+def warm_up():
+    # Schema check, the pool's min connections, the search and slot indexes and the
+    # response cache for WARMUP_PATHS. Returns {step: ms}.
+    steps = {}
+
+    def step(name, fn):
+        t0 = time.perf_counter()
+        fn()
+        steps[name] = round((time.perf_counter() - t0) * 1000.0, 1)
+
+    step('schema', init_db)
+    step('pool', get_pool)
+    db = DBProxy(None, _db_engine())
+    try:
+        step('search_index', lambda: get_search_index(db))
+        step('slot_index', lambda: get_slot_index(db))
+    finally:
+        db.close()
+    client = app.test_client()
+    for path in WARMUP_PATHS:
+        resp = []
+        step(path, lambda: resp.append(client.get(path)))
+        if resp[0].status_code >= 500:
+            raise RuntimeError(f'{path} returned {resp[0].status_code}')
+    return steps
+
+def _run_warmup():
+    t0 = time.perf_counter()
+    try:
+        steps = warm_up()
+    except Exception as e:
+        app.logger.exception('warm-up failed')
+        with _warmup_lock:
+            _warmup.update(state='failed', error=str(e))
+        return
+    with _warmup_lock:
+        _warmup.update(state='ready', steps=steps, seconds=round(time.perf_counter() - t0, 3))
+
+def start_warmup(background=True):
+    # Idempotent; runs in the background so the process serves (and answers /readyz)
+    # meanwhile, or to completion with background=False. A failed warm-up is retried by
+    # the next call. Returns the state: 'warming', 'ready' or 'failed'.
+    with _warmup_lock:
+        if _warmup['state'] in ('warming', 'ready'):
+            return _warmup['state']
+        _warmup.update(state='warming', error=None)
+    if not background:
+        _run_warmup()
+        return _warmup['state']
+    threading.Thread(target=_run_warmup, name='warmup', daemon=True).start()
+    return 'warming'
+
+@app.route('/readyz')
+def readyz():
+    # 503 until this process has warmed up; the first probe starts the warm-up
+    start_warmup()
+    with _warmup_lock:
+        body = dict(_warmup)
+    body['schema'] = SCHEMA_FINGERPRINT
+    return jsonify(body), 200 if body['state'] == 'ready' else 503
+
+
+# Prefork workers (prefork.py): the master warms up once and forks; what the workers
+# then share lives in a SharedState. Without one (any other way of running the app)
+# none of this does anything.
+SEARCH_DOCUMENTS = 'search-index'
+SNAPSHOT_ENTRIES = {
+    # cached_json key (or SEARCH_DOCUMENTS) -> (tables it is read from, fn(db) -> JSON value)
+    '/api/categories?': (('categories',), lambda db: db.rows(CATEGORIES_SQL)),
+    '/api/doctors?': (('doctors',), lambda db: db.rows(DOCTORS_SQL)),
+    '/api/lab-tests?': (('lab_tests', 'labs'), lambda db: db.rows(LAB_TESTS_SQL)),
+    '/api/medicines/brands?': (('medicines',), lambda db: [r['brand'] for r in db.execute(MEDICINE_BRANDS_SQL).fetchall()]),
+    SEARCH_DOCUMENTS: (('medicines', 'categories'), lambda db: db.rows(SEARCH_INDEX_SQL)),
+}
+
+
+class SharedCounters:
+    # Named 64-bit counters in an anonymous shared mapping. Created before fork, so every
+    # worker sees the others' increments. bump() serializes writers on a process-shared
+    # lock; reads take none (a torn read only looks like one more change).
+    def __init__(self, names):
+        import multiprocessing
+        self.names = tuple(names)
+        self._offsets = {n: i * 8 for i, n in enumerate(self.names)}
+        self._format = f'{len(self.names)}Q'
+        self._mem = mmap.mmap(-1, 8 * len(self.names))
+        self._lock = multiprocessing.Lock()
+
+    def get(self, name):
+        return struct.unpack_from('Q', self._mem, self._offsets[name])[0]
+
+    def values(self):
+        return struct.unpack_from(self._format, self._mem)
+
+    def bump(self, names):
+        # -> {name: value before the increment}
+        before = {}
+        with self._lock:
+            for n in names:
+                before[n] = self.get(n)
+                struct.pack_into('Q', self._mem, self._offsets[n], before[n] + 1)
+        return before
+
+
+class CatalogSnapshot:
+    # The bodies of the catalog list endpoints and the search index's documents, written
+    # to one file that every worker memory-maps: N workers share a single copy in the page
+    # cache instead of each querying and caching its own. The 'snapshot' counter names the
+    # current file. An entry is served while none of its tables has been written through a
+    # worker since the file was built and the file is less than max_age seconds old (writes
+    # made elsewhere, e.g. `flask import-catalog` or another host, are only seen through
+    # that). A stale entry is not served: the request reads the worker's own cache or the
+    # database while a background thread of the first worker to notice rebuilds the file
+    # under an flock.
+    MAGIC = b'GCSNAP1\n'
+
+    def __init__(self, directory, counters, entries, max_age):
+        self.directory = directory
+        self.counters = counters
+        self.entries = entries
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._view = (-1, None, None)  # (sequence, mmap, header)
+        self._rebuilding = False
+        self._stats = {'hits': 0, 'stale': 0, 'rebuilds': 0, 'loads': 0}
+
+    def _path(self, seq):
+        return os.path.join(self.directory, f'catalog-{seq}.snap')
+
+    def _current(self):
+        seq = self.counters.get('snapshot')
+        view = self._view
+        if view[0] != seq:
+            try:
+                with open(self._path(seq), 'rb') as f:
+                    mem = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except FileNotFoundError:  # not built yet, or already replaced by a newer one
+                return view if view[1] is not None else None
+            start = len(self.MAGIC) + 4
+            end = start + struct.unpack_from('<I', mem, len(self.MAGIC))[0]
+            header = json.loads(mem[start:end])
+            header['base'] = end
+            view = self._view = (seq, mem, header)
+            with self._lock:
+                self._stats['loads'] += 1
+        return view
+
+    def _fresh(self, header, tables):
+        return (time.time() - header['built_at'] < self.max_age
+                and all(header['tables'][t] == self.counters.get(t) for t in tables))
+
+    def get(self, key):
+        # -> a ResponseCache-style entry (expires, body, etag, tables), or None
+        if key not in self.entries:
+            return None
+        view = self._current()
+        if view is None or not self._fresh(view[2], self.entries[key][0]):
+            with self._lock:
+                self._stats['stale'] += 1
+            self.refresh_later()
+            return None
+        _, mem, header = view
+        offset, length, etag = header['entries'][key]
+        with self._lock:
+            self._stats['hits'] += 1
+        start = header['base'] + offset
+        return (0.0, mem[start:start + length], etag, frozenset(self.entries[key][0]))
+
+    def documents(self, key):
+        # the JSON value stored under key, decoded, or None
+        entry = self.get(key)
+        return None if entry is None else json.loads(entry[1])
+
+    def refresh_later(self):
+        # one rebuild thread per process at a time; refresh() keeps it to one per group
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+
+        def run():
+            try:
+                self.refresh()
+            except Exception:
+                app.logger.exception('catalog snapshot rebuild failed')
+            finally:
+                with self._lock:
+                    self._rebuilding = False
+
+        threading.Thread(target=run, name='catalog-snapshot', daemon=True).start()
+
+    def refresh(self, blocking=False):
+        # Rebuild unless another process is already at it; True once a fresh file is current.
+        import fcntl
+        fd = os.open(os.path.join(self.directory, 'catalog.lock'), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                return False
+            view = self._current()
+            tables = {t for tables, _ in self.entries.values() for t in tables}
+            if view is None or not self._fresh(view[2], tables):
+                self._build()
+            return True
+        finally:
+            os.close(fd)
+
+    def _build(self):
+        seq = self.counters.get('snapshot')
+        # counters (and the time) read before the queries: a write that races the build
+        # leaves it stale
+        built = {t: self.counters.get(t) for tables, _ in self.entries.values() for t in tables}
+        built_at = time.time()
+        bodies = []
+        db = DBProxy(None, _db_engine())
+        try:
+            with app.app_context():
+                for key, (_, fn) in self.entries.items():
+                    bodies.append((key, app.json.response(fn(db)).get_data()))
+        finally:
+            db.close()
+        header, offset = {'tables': built, 'built_at': built_at, 'entries': {}}, 0
+        for key, body in bodies:
+            header['entries'][key] = [offset, len(body), hashlib.sha1(body).hexdigest()[:20]]
+            offset += len(body)
+        head = json.dumps(header).encode()
+        path = self._path(seq + 1)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(self.MAGIC + struct.pack('<I', len(head)) + head)
+            for _, body in bodies:
+                f.write(body)
+        os.replace(path + '.tmp', path)
+        self.counters.bump(('snapshot',))
+        try:
+            os.unlink(self._path(seq))  # workers still mapping it keep their pages
+        except FileNotFoundError:
+            pass
+        with self._lock:
+            self._stats['rebuilds'] += 1
+
+    def stats(self):
+        seq, mem, _ = self._current() or (0, None, None)
+        with self._lock:
+            out = dict(self._stats)
+        out.update({'sequence': seq, 'bytes': len(mem) if mem is not None else 0})
+        return out
+
+
+class RevocationLog:
+    # Append-only file of session revocations, one JSON line each. append() adds a line
+    # and bumps the 'revocations' counter; replay() applies the lines appended since this
+    # process last read the file (its own included; applying one twice is harmless).
+    def __init__(self, path, counters):
+        self.path = path
+        self.counters = counters
+        self._offset = 0
+        self._lock = threading.Lock()
+        open(path, 'ab').close()
+
+    def append(self, kind, key, value):
+        line = json.dumps([kind, key, value], separators=(',', ':')).encode() + b'\n'
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND)
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+        self.counters.bump(('revocations',))
+
+    def replay(self, cache):
+        with self._lock:
+            with open(self.path, 'rb') as f:
+                f.seek(self._offset)
+                data = f.read()
+            data = data[:data.rfind(b'\n') + 1]
+            self._offset += len(data)
+        for line in data.splitlines():
+            cache.apply(*json.loads(line))
+
+
+class SharedState:
+    # What prefork workers share, under `directory`: write counters for the catalog
+    # tables, the catalog snapshot and the revocation log. sync() reports the counters
+    # that moved since this process last looked, minus its own writes.
+    def __init__(self, directory):
+        self.directory = directory
+        self.counters = SharedCounters(sorted(CATALOG_TABLES) + ['snapshot', 'revocations'])
+        self.snapshot = CatalogSnapshot(directory, self.counters, SNAPSHOT_ENTRIES, response_cache.ttl)
+        self.revocations = RevocationLog(os.path.join(directory, 'revocations.log'), self.counters)
+        self._lock = threading.Lock()
+        self._seen = self.counters.values()
+
+    def publish_writes(self, tables):
+        before = self.counters.bump(tables)
+        with self._lock:
+            seen = dict(zip(self.counters.names, self._seen))
+            for t, value in before.items():
+                if seen[t] == value:  # up to date until this write, which we already handled
+                    seen[t] = value + 1
+            self._seen = tuple(seen[n] for n in self.counters.names)
+
+    def sync(self):
+        values = self.counters.values()
+        if values == self._seen:
+            return set()
+        with self._lock:
+            changed = {n for n, old, new in zip(self.counters.names, self._seen, values) if old != new}
+            self._seen = values
+        return changed
+
+
+_shared = None
+
+def share_between_workers(directory):
+    # In the prefork master, after warm-up and before forking: set up the SharedState
+    # the workers inherit and build the first catalog snapshot.
+    global _shared
+    shared = SharedState(directory)
+    shared.snapshot.refresh(blocking=True)
+    revoked_sessions.publish = shared.revocations.append
+    _shared = shared
+    return shared
+
+def before_fork():
+    # In the parent: close pooled connections so no socket or SQLite handle is shared
+    # with a child. They are reopened on first use.
+    global _pool, _replicas, _replicas_loaded
+    with _pool_lock:
+        pools = [_pool] if _pool is not None else []
+        pools += [r.pool for r in _replicas.replicas] if _replicas is not None else []
+        _pool, _replicas, _replicas_loaded = None, None, False
+    for pool in pools:
+        pool.close()
+
+def after_fork():
+    # In a freshly forked worker: forget the parent's pools (and the replica checker, hash
+    # and job threads, which don't exist here); connections are opened on first use.
+    global _pool, _replicas, _replicas_loaded, _sqlite_writer
+    _pool, _replicas, _replicas_loaded = None, None, False
+    _sqlite_writer = threading.Lock()
+    hash_pool.reset()
+    job_queue.reset()
+
+@on_tables_written
+def _publish_catalog_writes(tables):
+    catalog = CATALOG_TABLES & tables
+    if _shared is not None and catalog:
+        _shared.publish_writes(catalog)
+
+@app.before_request
+def _sync_shared_state():
+    # catalog writes and logouts that other workers handled since this one last looked
+    if _shared is None:
+        return
+    changed = _shared.sync()
+    catalog = CATALOG_TABLES & changed
+    if catalog:
+        response_cache.invalidate(catalog)
+        if catalog & {'medicines', 'categories'}:
+            _search_index_state['fingerprint'] = None  # rebuild, from the snapshot when it is fresh
+            _search_index_state['checked_at'] = 0.0
+    if 'revocations' in changed:
+        _shared.revocations.replay(revoked_sessions)
 
 
 if __name__ == '__main__':
     init_db()
+    # the debug reloader runs this twice; only its child serves requests
+    serving = os.environ.get('WERKZEUG_RUN_MAIN') == 'true'
+    if serving:
+        start_warmup()
+        job_queue.start()
     app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
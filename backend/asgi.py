@@ -0,0 +1,567 @@
+"""ASGI serving mode for backend/app.py.
+
+    uvicorn asgi:app --app-dir backend --host 0.0.0.0 --port 5000 --workers 2
+
+The I/O-bound catalog and account reads in ASYNC_ROUTES run as coroutines on an async
+connection pool (aiomysql, or aiosqlite when DB_ENGINE=sqlite), so a request waiting on
+the database holds no thread. Every other route (and the static pages) is handed to the
+Flask app on a bounded thread pool, so all of /api/* behaves as under
+`python backend/app.py`. In-flight requests per worker are capped by
+ASYNC_MAX_CONCURRENCY; a native request whose client disconnects is cancelled, along
+with its running statement.
+"""
+import asyncio
+import functools
+import sqlite3
+import sys
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl
+
+from werkzeug.http import parse_cookie, parse_etags
+
+import app as flask_app
+from app import (CACHE_ENABLED, CATEGORIES_SQL, DOCTORS_SQL, LAB_TESTS_SQL, MEDICINE_BRANDS_SQL, REPLICA_STICKY_SECONDS,
+                 PoolTimeout, QueryStats, Rows, _env_float, _env_int, build_medicines_query,
+                 medicines_cache_tables, medicines_page, metrics, normalize_sql, notify_tables_written, parse_medicines_args,
+                 read_primary_until, record_request, response_cache, verify_token, written_table)
+
+ASYNC_MAX_CONCURRENCY = _env_int('ASYNC_MAX_CONCURRENCY', 1000)
+ASYNC_QUEUE_TIMEOUT = _env_float('ASYNC_QUEUE_TIMEOUT', 5.0)
+ASYNC_WSGI_THREADS = _env_int('ASYNC_WSGI_THREADS', 16)
+ASYNC_SPOOL_BYTES = 1024 * 1024
+
+metrics.counter('genricycle_async_cancelled_total', 'Native ASGI requests cancelled because the client went away.')
+metrics.counter('genricycle_async_rejected_total', 'Requests refused with 503 after waiting ASYNC_QUEUE_TIMEOUT for a slot.')
+
+
+async def _sqlite_connect():
+    import aiosqlite
+    conn = await aiosqlite.connect(flask_app.DB_PATH, timeout=_env_int('SQLITE_BUSY_TIMEOUT_MS', 5000) / 1000.0)
+    conn.row_factory = sqlite3.Row
+    for name, value in flask_app.SQLITE_PRAGMAS:
+        await conn.execute(f'PRAGMA {name} = {value}')
+    return conn
+
+async def _mysql_connect(cfg=None):
+    # cfg: a replica's (read-only sessions), else the primary
+    import aiomysql
+    replica = cfg is not None
+    cfg = cfg or flask_app._mysql_cfg()
+    return await aiomysql.connect(host=cfg['host'], port=cfg['port'], user=cfg['user'], password=cfg['password'],
+                                  db=cfg['db'], cursorclass=aiomysql.DictCursor, autocommit=False,
+                                  init_command='SET SESSION TRANSACTION READ ONLY' if replica else None)
+
+async def _close(conn):
+    try:
+        result = conn.close()
+        if asyncio.iscoroutine(result):  # aiosqlite
+            await result
+    except Exception:
+        pass
+
+
+class AsyncPool:
+    # asyncio counterpart of app.ConnectionPool: at most max_size connections, waiters
+    # queue on a condition (no thread each) and give up after `timeout` with PoolTimeout.
+    def __init__(self, engine, min_size=1, max_size=20, timeout=5.0, connect=None):
+        self.engine = engine
+        self._connect = connect or (_sqlite_connect if engine == 'sqlite' else _mysql_connect)
+        self.min_size = max(0, min_size)
+        self.max_size = max(1, max_size, self.min_size)
+        self.timeout = timeout
+        self._idle = deque()
+        self._size = 0
+        self._cond = asyncio.Condition()
+        self._stats = {'checkouts': 0, 'created': 0, 'closed': 0, 'waits': 0, 'timeouts': 0, 'aborted': 0}
+
+    async def fill(self):
+        while self._size < self.min_size:
+            self._size += 1
+            conn = await self._create()
+            async with self._cond:
+                self._idle.append(conn)
+                self._cond.notify()
+
+    async def _create(self):
+        # the caller has already counted the connection in self._size
+        try:
+            conn = await self._connect()
+        except BaseException:
+            async with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        self._stats['created'] += 1
+        return conn
+
+    async def acquire(self):
+        async with self._cond:
+            if not self._idle and self._size >= self.max_size:
+                self._stats['waits'] += 1
+                try:
+                    await asyncio.wait_for(self._cond.wait_for(lambda: self._idle or self._size < self.max_size), self.timeout)
+                except asyncio.TimeoutError:
+                    self._stats['timeouts'] += 1
+                    raise PoolTimeout(f'no database connection available within {self.timeout}s (max_size={self.max_size})')
+            self._stats['checkouts'] += 1
+            if self._idle:
+                return self._idle.pop()
+            self._size += 1
+        return await self._create()
+
+    async def release(self, conn):
+        try:
+            await conn.rollback()
+        except Exception:
+            await self.discard(conn)
+            return
+        async with self._cond:
+            self._idle.append(conn)
+            self._cond.notify()
+
+    async def discard(self, conn):
+        await _close(conn)
+        async with self._cond:
+            self._size -= 1
+            self._stats['closed'] += 1
+            self._cond.notify()
+
+    async def abort(self, conn):
+        # The request owning `conn` was cancelled mid-statement: stop the statement
+        # server-side (KILL QUERY from a second connection / sqlite3 interrupt) and drop
+        # the connection, whose protocol state is unknown.
+        self._stats['aborted'] += 1
+        try:
+            if self.engine == 'mysql':
+                killer = await self._connect()
+                try:
+                    async with killer.cursor() as cur:
+                        await cur.execute(f'KILL QUERY {int(conn.thread_id())}')
+                finally:
+                    await _close(killer)
+            else:
+                await conn.interrupt()
+        except Exception:
+            flask_app.app.logger.warning('could not interrupt a cancelled query', exc_info=True)
+        await self.discard(conn)
+
+    async def close(self):
+        async with self._cond:
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+            self._stats['closed'] += len(idle)
+        for conn in idle:
+            await _close(conn)
+
+    def stats(self):
+        out = dict(self._stats)
+        out.update({'size': self._size, 'idle': len(self._idle), 'in_use': self._size - len(self._idle),
+                    'min_size': self.min_size, 'max_size': self.max_size})
+        return out
+
+
+class AsyncDBProxy:
+    # What app.DBProxy is to the Flask handlers: lazy checkout, `?` placeholders on both
+    # engines, statements timed into self.stats and write notifications on commit.
+    # Rows come back as dicts, or as app.Rows from rows(). `route()`, called at checkout,
+    # may return (replica, its pool) to read from instead; `pool` is the fallback when no
+    # connection to the replica can be had.
+    def __init__(self, pool, route=None):
+        self._pool = pool
+        self._route = route
+        self.replica = None
+        self._conn = None
+        self._written = set()
+        self.stats = QueryStats()
+
+    @property
+    def engine(self):
+        return self._pool.engine
+
+    async def _acquire(self):
+        route, self._route = self._route, None
+        target = route() if route is not None else None
+        if target is not None:
+            replica, pool = target
+            try:
+                conn = await pool.acquire()
+                self._pool, self.replica = pool, replica.name
+                return conn
+            except Exception as e:
+                if not isinstance(e, PoolTimeout):
+                    replica.fail(e)
+                metrics.inc('genricycle_db_primary_reads_total', (('reason', 'replica_error'),))
+        return await self._pool.acquire()
+
+    async def _run(self, sql, params, fetch):
+        if self._conn is None:
+            self._conn = await self._acquire()
+        conn = self._conn
+        table = written_table(sql)
+        if table:
+            self._written.add(table)
+        entry = self.stats.start(sql)
+        t0 = time.perf_counter()
+        try:
+            if self.engine == 'mysql':
+                if fetch == 'rows':
+                    import aiomysql
+                    cursor = conn.cursor(aiomysql.Cursor)
+                else:
+                    cursor = conn.cursor()
+                async with cursor as cur:
+                    await cur.execute(sql.replace('?', '%s'), params)
+                    rows = await cur.fetchall() if fetch else None
+                    if fetch == 'rows':
+                        rows = Rows([d[0] for d in cur.description], rows)
+                    result = rows if fetch else (cur.rowcount, cur.lastrowid)
+            elif fetch:
+                # one hop to aiosqlite's thread instead of execute + fetchall + close
+                rows = await conn.execute_fetchall(sql, params)
+                rows = result = Rows.from_sqlite(rows) if fetch == 'rows' else [dict(r) for r in rows]
+            else:
+                cur = await conn.execute(sql, params)
+                result = (cur.rowcount, cur.lastrowid)
+                await cur.close()
+        except asyncio.CancelledError:
+            self._conn = None
+            asyncio.ensure_future(self._pool.abort(conn))
+            raise
+        ms = (time.perf_counter() - t0) * 1000.0
+        self.stats.add(entry, ms, len(rows) if fetch else 0)
+        if ms >= flask_app.SLOW_QUERY_MS:
+            flask_app.app.logger.warning('slow query %.1fms: %s', ms, normalize_sql(sql))
+            metrics.inc('genricycle_db_slow_queries_total')
+        return result
+
+    async def fetchall(self, sql, params=()):
+        return list(await self._run(sql, params, True))
+
+    async def rows(self, sql, params=()):
+        # -> app.Rows, for results that are only sent back as JSON
+        return await self._run(sql, params, 'rows')
+
+    async def fetchone(self, sql, params=()):
+        rows = await self._run(sql, params, True)
+        return rows[0] if rows else None
+
+    async def execute(self, sql, params=()):
+        # -> (rowcount, lastrowid)
+        return await self._run(sql, params, False)
+
+    async def rollback(self):
+        self._written.clear()
+        if self._conn is not None:
+            await self._conn.rollback()
+
+    async def commit(self):
+        if self._conn is not None:
+            await self._conn.commit()
+        if self._written:
+            tables, self._written = self._written, set()
+            notify_tables_written(tables)
+
+    async def close(self):
+        self._written.clear()
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            await self._pool.release(conn)
+
+
+class Request:
+    def __init__(self, scope):
+        self.method = scope['method']
+        self.path = scope['path']
+        self.query = parse_qsl(scope['query_string'].decode('latin-1'), keep_blank_values=True)
+        self.args = {}
+        for k, v in self.query:
+            self.args.setdefault(k, v)
+        self.headers = {k.decode('latin-1').lower(): v.decode('latin-1') for k, v in scope['headers']}
+
+    def session(self):
+        auth = self.headers.get('authorization') or ''
+        token = auth[7:].strip() if auth[:7].lower() == 'bearer ' else None
+        return verify_token(token) if token else None
+
+
+def _dumps(obj):
+    return flask_app.app.json.dumpb(obj) + b'\n'
+
+# (method, path) -> (handler(req, db) -> (status, body), tables the response depends
+# on when it may be served from response_cache, or fn(args) -> those tables)
+ASYNC_ROUTES = {}
+
+def route(path, cached=None):
+    def decorator(fn):
+        ASYNC_ROUTES[('GET', path)] = (fn, cached if cached is None or callable(cached) else frozenset(cached))
+        return fn
+    return decorator
+
+@route('/api/medicines', cached=medicines_cache_tables)
+async def medicines(req, db):
+    try:
+        query = parse_medicines_args(req.args)
+    except ValueError as e:
+        return 400, {'error': str(e)}
+    if query['category_id'] is None and query['category']:
+        row = await db.fetchone('SELECT id FROM categories WHERE LOWER(name) = LOWER(?)', (query['category'],))
+        if not row:
+            return 200, {'items': [], 'next_cursor': None}
+        query['category_id'] = row['id']
+    sql, params = build_medicines_query(query['fields'], query['sort'], query['category_id'], query['brand'], query['min_price'],
+                                        query['max_price'], query['q'], query['after'], query['limit'])
+    return 200, medicines_page(await db.rows(sql, params), query)
+
+@route('/api/medicines/brands', cached=('medicines',))
+async def medicine_brands(req, db):
+    return 200, [r['brand'] for r in await db.fetchall(MEDICINE_BRANDS_SQL)]
+
+@route('/api/categories', cached=('categories',))
+async def categories(req, db):
+    return 200, await db.rows(CATEGORIES_SQL)
+
+@route('/api/doctors', cached=('doctors',))
+async def doctors(req, db):
+    return 200, await db.rows(DOCTORS_SQL)
+
+@route('/api/lab-tests', cached=('lab_tests', 'labs'))
+async def lab_tests(req, db):
+    return 200, await db.rows(LAB_TESTS_SQL)
+
+@route('/api/auth/session')
+async def auth_session(req, db):
+    claims = req.session()
+    if claims is None:
+        return 401, {'error': 'authentication required'}
+    return 200, {k: claims[k] for k in ('uid', 'role', 'email', 'exp')}
+
+@route('/api/user')
+async def user(req, db):
+    session, email = req.session(), req.args.get('email')
+    cols = 'SELECT id, name, email, phone, role, language, currency, created_at FROM users'
+    if session and not email:
+        row = await db.fetchone(cols + ' WHERE id = ?', (session['uid'],))
+    elif not email:
+        return 400, {'error': 'email query param required'}
+    else:
+        row = await db.fetchone(cols + ' WHERE email = ?', (email,))
+    return (200, row) if row else (404, {'error': 'not found'})
+
+
+async def _wait_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+async def _send(send, status, body, headers):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(k.encode('latin-1'), v.encode('latin-1')) for k, v in headers]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+class AsgiApp:
+    def __init__(self):
+        self.pool = None
+        self.replica_pools = {}
+        self._slots = None
+        self._executor = None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self._lifespan(receive, send)
+        if scope['type'] != 'http':
+            return
+        try:
+            await asyncio.wait_for(self._slots.acquire(), ASYNC_QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            metrics.inc('genricycle_async_rejected_total')
+            return await _send(send, 503, _dumps({'error': 'server busy, try again'}),
+                               [('content-type', 'application/json'), ('retry-after', '1')])
+        try:
+            native = ASYNC_ROUTES.get((scope['method'], scope['path']))
+            if native is not None:
+                await self._native(native, scope, receive, send)
+            else:
+                await self._wsgi(scope, receive, send)
+        finally:
+            self._slots.release()
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    await self.startup()
+                except Exception as e:
+                    await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def startup(self):
+        loop = asyncio.get_running_loop()
+        self._slots = asyncio.Semaphore(ASYNC_MAX_CONCURRENCY)
+        self._executor = ThreadPoolExecutor(ASYNC_WSGI_THREADS, thread_name_prefix='wsgi')
+        await loop.run_in_executor(self._executor, flask_app.init_db)
+        self.pool = AsyncPool(flask_app._db_engine(), min_size=_env_int('ASYNC_DB_POOL_MIN', 1),
+                              max_size=_env_int('ASYNC_DB_POOL_MAX', 20), timeout=_env_float('DB_POOL_TIMEOUT', 5.0))
+        await self.pool.fill()
+        replicas = flask_app.get_replicas()
+        for r in replicas.replicas if replicas is not None else ():
+            self.replica_pools[r.name] = AsyncPool('mysql', min_size=0, max_size=self.pool.max_size, timeout=self.pool.timeout,
+                                                   connect=functools.partial(_mysql_connect, r.cfg))
+        flask_app.start_warmup()  # caches and the sync pool used by the Flask routes
+        flask_app.job_queue.start()
+
+    async def shutdown(self):
+        flask_app.job_queue.stop(timeout=5)
+        if self.pool is not None:
+            await self.pool.close()
+        for pool in self.replica_pools.values():
+            await pool.close()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+    async def _native(self, native, scope, receive, send):
+        handler, tables = native
+        req = Request(scope)
+        if callable(tables):
+            tables = frozenset(tables(req.args))
+        t0 = time.perf_counter()
+        key = entry = None
+        if tables is not None and CACHE_ENABLED:
+            # same key as app.cached_json, so both modes share one response cache
+            key = req.path + '?' + '&'.join(f'{k}={v}' for k, v in sorted(req.query))
+            entry = response_cache.get(key)
+        db = AsyncDBProxy(self.pool, functools.partial(self._route, req))
+        status, headers = 200, [('content-type', 'application/json')]
+        if entry is None:
+            versions = response_cache.versions(tables) if key else None
+            task = asyncio.ensure_future(self._handle(handler, req, db))
+            watcher = asyncio.ensure_future(_wait_disconnect(receive))
+            try:
+                await asyncio.wait((task, watcher), return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                watcher.cancel()
+            if not task.done():
+                # client went away: cancelling the task interrupts its statement (AsyncDBProxy)
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+                metrics.inc('genricycle_async_cancelled_total')
+                return
+            status, payload = task.result()
+            body = _dumps(payload)
+            if key and status == 200 and not (db.replica and response_cache.written_within(tables, REPLICA_STICKY_SECONDS)):
+                entry = response_cache.put(key, tables, versions, body)
+        if entry is not None:
+            _, body, etag, _ = entry
+            # whole entity tags, weak comparison (W/ and * match), as cached_json does
+            if parse_etags(req.headers.get('if-none-match')).contains_weak(etag):
+                response_cache.count('not_modified')
+                status, body = 304, b''
+            headers += [('etag', f'"{etag}"'), ('cache-control', 'no-cache')]
+        for value in record_request(scope['path'], scope['method'], status, time.perf_counter() - t0, db.stats):
+            headers.append(('server-timing', value))
+        await _send(send, status, body, headers)
+
+    def _route(self, req):
+        # every native route only reads: a replica unless this client just wrote
+        replica = flask_app.route_read(read_primary_until(parse_cookie(req.headers.get('cookie') or '')))
+        return (replica, self.replica_pools[replica.name]) if replica is not None else None
+
+    async def _handle(self, handler, req, db):
+        try:
+            return await handler(req, db)
+        except PoolTimeout:
+            return 503, {'error': 'database busy, try again'}
+        finally:
+            await db.close()
+
+    async def _wsgi(self, scope, receive, send):
+        # Run the Flask app on the thread pool. The body is spooled (to disk past
+        # ASYNC_SPOOL_BYTES) so uploads such as /api/import stay out of memory, and
+        # streamed responses (/api/export) are forwarded chunk by chunk until the client
+        # disconnects.
+        loop = asyncio.get_running_loop()
+        body = tempfile.SpooledTemporaryFile(max_size=ASYNC_SPOOL_BYTES)
+        more = True
+        while more:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                body.close()
+                return
+            body.write(message.get('body', b''))
+            more = message.get('more_body', False)
+        body.seek(0)
+        environ = _environ(scope, body)
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started['status'] = int(status.split(' ', 1)[0])
+            started['headers'] = headers
+
+        def first_chunk():
+            result = flask_app.app(environ, start_response)
+            chunks = iter(result)
+            return result, chunks, next(chunks, None)
+
+        result, chunks, chunk = await loop.run_in_executor(self._executor, first_chunk)
+        gone = asyncio.ensure_future(_wait_disconnect(receive))
+        try:
+            await send({'type': 'http.response.start', 'status': started['status'],
+                        'headers': [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in started['headers']]})
+            while chunk is not None and not gone.done():
+                if chunk:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+                chunk = await loop.run_in_executor(self._executor, next, chunks, None)
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            gone.cancel()
+            if hasattr(result, 'close'):
+                await loop.run_in_executor(self._executor, result.close)
+            body.close()
+
+
+def _environ(scope, body):
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': str(server[0]),
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/' + scope.get('http_version', '1.1'),
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for k, v in scope['headers']:
+        name, value = k.decode('latin-1').upper().replace('-', '_'), v.decode('latin-1')
+        if name in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            environ[name] = value
+        else:
+            key = 'HTTP_' + name
+            environ[key] = environ[key] + ',' + value if key in environ else value
+    return environ
+
+
+app = AsgiApp()
+
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run('asgi:app', host='0.0.0.0', port=5000, workers=_env_int('ASGI_WORKERS', 1))
@@ -0,0 +1,201 @@
+"""Threaded WSGI server vs the ASGI mode (asgi.py) on I/O-bound endpoints.
+
+Starts each server in turn (one process each) against the same generated SQLite
+dataset, with every statement delayed by --db-latency-ms while it holds its pooled
+connection (a stand-in for a MySQL round trip) and the response cache off, then drives
+catalog and account reads with --concurrency open connections and ten times that.
+Reports throughput, p50/p95/p99, failures, peak server threads and peak RSS per mode
+and level:
+
+    python backend/bench_asgi.py --concurrency 50 --seconds 10 --db-latency-ms 5
+
+Needs uvicorn and aiosqlite.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+from bench_load import HERE, _free_port, _git_commit, _percentile, _rss_kb, generate
+
+SERVER = '''
+import asyncio, sys, time
+import app, asgi
+host, port, mode, latency = sys.argv[1], int(sys.argv[2]), sys.argv[3], float(sys.argv[4]) / 1000.0
+
+sync_run = app.DBProxy._run
+def delayed_run(self, method, sql, params, **kwargs):
+    self._connection()
+    time.sleep(latency)
+    return sync_run(self, method, sql, params, **kwargs)
+app.DBProxy._run = delayed_run
+
+async_run = asgi.AsyncDBProxy._run
+async def delayed_async_run(self, sql, params, fetch):
+    if self._conn is None:
+        self._conn = await self._pool.acquire()
+    await asyncio.sleep(latency)
+    return await async_run(self, sql, params, fetch)
+asgi.AsyncDBProxy._run = delayed_async_run
+
+if mode == 'wsgi':
+    from werkzeug.serving import make_server
+    make_server(host, port, app.app, threaded=True).serve_forever()
+else:
+    import uvicorn
+    uvicorn.run(asgi.app, host=host, port=port, log_level='warning', backlog=4096)
+'''
+
+
+def _paths(rnd, users, categories, token):
+    # (path, headers): catalog pages, reference lists, account lookups
+    return [
+        (f'/api/medicines?limit=24&category_id={rnd.choice(categories)}&sort={rnd.choice(("name", "price_asc"))}', ''),
+        ('/api/categories', ''),
+        ('/api/doctors', ''),
+        (f'/api/user?email=user-{rnd.randint(1, users)}@bench.test', ''),
+        ('/api/auth/session', f'Authorization: Bearer {token}\r\n'),
+    ]
+
+
+async def _get(host, port, path, headers):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        writer.write(f'GET {path} HTTP/1.1\r\nHost: {host}\r\n{headers}Connection: close\r\n\r\n'.encode())
+        data = await reader.read()
+    finally:
+        writer.close()
+    return int(data.split(b' ', 2)[1])
+
+
+async def _drive(host, port, concurrency, seconds, users, categories, token, seed):
+    results = []
+    deadline = time.monotonic() + seconds
+
+    async def client(n):
+        rnd = random.Random(seed + n)
+        while time.monotonic() < deadline:
+            path, headers = rnd.choice(_paths(rnd, users, categories, token))
+            t0 = time.perf_counter()
+            try:
+                status = await asyncio.wait_for(_get(host, port, path, headers), 30)
+            except (OSError, asyncio.TimeoutError, IndexError, ValueError) as e:
+                status = type(e).__name__
+            results.append((status, time.perf_counter() - t0))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(n) for n in range(concurrency)))
+    return results, time.perf_counter() - start
+
+
+class Sampler(threading.Thread):
+    # peak thread count and RSS of the server process while a level runs
+    def __init__(self, pid):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.threads = 0
+        self.stop = threading.Event()
+
+    def run(self):
+        while not self.stop.wait(0.05):
+            self.threads = max(self.threads, _rss_kb(self.pid, 'Threads') or 0)
+
+
+def run_mode(mode, args, env, users, categories, token):
+    host, port = '127.0.0.1', _free_port()
+    log = open(os.path.join(tempfile.gettempdir(), f'genricycle-bench-{mode}.log'), 'w')
+    proc = subprocess.Popen([sys.executable, '-c', SERVER, host, str(port), mode, str(args.db_latency_ms)],
+                            cwd=HERE, env=env, stdout=log, stderr=subprocess.STDOUT)
+    out = {}
+    try:
+        deadline = time.monotonic() + 60
+        while True:
+            if proc.poll() is not None:
+                raise SystemExit(f'{mode} server exited with status {proc.returncode}')
+            try:
+                if asyncio.run(_get(host, port, '/readyz', '')) == 200:
+                    break
+            except OSError:
+                pass
+            if time.monotonic() > deadline:
+                raise SystemExit(f'{mode} server did not become ready')
+            time.sleep(0.2)
+        for level in (args.concurrency, args.concurrency * 10):
+            sampler = Sampler(proc.pid)
+            sampler.start()
+            results, elapsed = asyncio.run(_drive(host, port, level, args.seconds, users, categories, token, args.seed))
+            sampler.stop.set()
+            sampler.join()
+            ok = sorted(t * 1000.0 for s, t in results if s == 200)
+            out[str(level)] = {
+                'requests': len(results),
+                'ok': len(ok),
+                'failed': len(results) - len(ok),
+                'statuses': dict(Counter(str(s) for s, _ in results)),
+                'requests_per_sec': round(len(ok) / elapsed, 1),
+                'latency_ms': {p: round(_percentile(ok, int(p[1:])), 2) for p in ('p50', 'p95', 'p99')} if ok else None,
+                'peak_threads': sampler.threads,
+            }
+            print(f'{mode} x{level}: {out[str(level)]["requests_per_sec"]} req/s, p99 '
+                  f'{(out[str(level)]["latency_ms"] or {}).get("p99")} ms, {out[str(level)]["failed"]} failed, '
+                  f'{sampler.threads} threads', file=sys.stderr)
+        out['peak_rss_kb'] = _rss_kb(proc.pid, 'VmHWM')
+    finally:
+        proc.terminate()
+        proc.wait()
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--concurrency', type=int, default=50, help='connections at the base level (then x10)')
+    parser.add_argument('--seconds', type=float, default=10.0, help='duration of each level')
+    parser.add_argument('--db-latency-ms', type=float, default=5.0)
+    parser.add_argument('--pool', type=int, default=20, help='DB connections per server (both modes)')
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--modes', default='wsgi,asgi')
+    parser.add_argument('--out')
+    parser.add_argument('--seed', type=int, default=21)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'asgi.db')
+    os.environ.update({'DB_ENGINE': 'sqlite', 'DB_PATH': path, 'SESSION_SECRET': 'bench-asgi-secret'})
+    import app
+    app.init_db()
+    generate(app, args.rows, args.seed)
+    db = app.DBProxy(None, 'sqlite')
+    try:
+        categories = [r['id'] for r in db.execute('SELECT id FROM categories').fetchall()]
+    finally:
+        db.close()
+    app.get_pool().close()
+    token = app.issue_token({'id': 1, 'email': None})[0]
+
+    env = dict(os.environ, CACHE_ENABLED='0', DB_POOL_MAX=str(args.pool), ASYNC_DB_POOL_MAX=str(args.pool),
+               DB_POOL_TIMEOUT='30', ASYNC_MAX_CONCURRENCY=str(args.concurrency * 20))
+    report = {'meta': {'commit': _git_commit()[0], 'concurrency': [args.concurrency, args.concurrency * 10],
+                       'seconds': args.seconds, 'db_latency_ms': args.db_latency_ms, 'pool': args.pool, 'rows': args.rows},
+              'modes': {}}
+    try:
+        for mode in args.modes.split(','):
+            report['modes'][mode] = run_mode(mode, args, env, args.rows, categories, token)
+    finally:
+        shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(text)
+    print(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
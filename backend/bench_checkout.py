@@ -0,0 +1,159 @@
+"""Concurrency stress test for POST /api/checkout.
+
+Many buyers race for one hot SKU (plus a few other SKUs per cart, listed in random
+order) until it sells out. Then waits for the background jobs checkout queued. Fails
+when stock goes negative, more units are sold than were stocked, orders, items and
+payment rows disagree, or the rollups and reward points don't match the orders once the
+jobs are done. Reports orders/sec and checkout latency. --job-delay-ms makes every job
+batch that much slower (a slow downstream step); checkout doesn't wait for it, but on
+SQLite a job holds the one write lock while it runs, so its p99 still moves there:
+
+    python backend/bench_checkout.py --buyers 200 --attempts 3000 --stock 1000
+
+Runs against a throwaway SQLite file unless DB_ENGINE/DB_PATH (or the MYSQL_*
+settings) are already set in the environment.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--buyers', type=int, default=200, help='concurrent client threads')
+    parser.add_argument('--attempts', type=int, default=3000, help='checkout requests in total')
+    parser.add_argument('--stock', type=int, default=1000, help='units of the hot SKU')
+    parser.add_argument('--other-skus', type=int, default=20)
+    parser.add_argument('--job-delay-ms', type=float, default=0.0, help='extra time per background job batch')
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    os.environ.setdefault('DB_ENGINE', 'sqlite')
+    if os.environ['DB_ENGINE'] == 'sqlite':
+        os.environ.setdefault('DB_PATH', os.path.join(tempfile.mkdtemp(), 'checkout.db'))
+    os.environ.setdefault('DB_POOL_MAX', '16')
+    os.environ.setdefault('DB_POOL_TIMEOUT', '60')
+    import app
+
+    app.init_db()
+    if args.job_delay_ms:
+        for kind, (fn, batch_size) in list(app.job_queue._handlers.items()):
+            def slow(db, payloads, fn=fn):
+                time.sleep(args.job_delay_ms / 1000.0)
+                return fn(db, payloads)
+            app.job_queue.handler(kind, batch_size)(slow)
+    db = app.DBProxy(None, app._db_engine())
+    try:
+        tag = f'bench-{int(time.time())}'
+        hot = db.execute('INSERT INTO medicines(slug, name, price, stock) VALUES(?, ?, ?, ?)',
+                         (tag, 'Checkout bench hot SKU', 10, args.stock)).lastrowid
+        others = [db.execute('INSERT INTO medicines(slug, name, price, stock) VALUES(?, ?, ?, ?)',
+                             (f'{tag}-{i}', f'Checkout bench SKU {i}', 5, args.attempts * 2)).lastrowid
+                  for i in range(args.other_skus)]
+        users = [db.execute('INSERT INTO users(name, email, role) VALUES(?, ?, ?)',
+                            (f'Buyer {i}', f'{tag}-{i}@example.com', 'customer')).lastrowid
+                 for i in range(args.buyers)]
+        db.commit()
+    finally:
+        db.close()
+    tokens = [app.issue_token({'id': uid, 'email': None})[0] for uid in users]
+
+    statuses = Counter()
+    latencies = []
+    lock = threading.Lock()
+    remaining = [args.attempts]
+    barrier = threading.Barrier(args.buyers)
+
+    def buyer(n):
+        rnd = random.Random(args.seed + n)
+        client = app.app.test_client()
+        headers = {'Authorization': 'Bearer ' + tokens[n]}
+        barrier.wait()
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            items = [{'medicine_id': hot, 'quantity': 1}]
+            items += [{'medicine_id': mid, 'quantity': 1} for mid in rnd.sample(others, min(len(others), rnd.randint(0, 3)))]
+            rnd.shuffle(items)
+            t0 = time.perf_counter()
+            resp = client.post('/api/checkout', json={'items': items}, headers=headers)
+            with lock:
+                statuses[resp.status_code] += 1
+                latencies.append((time.perf_counter() - t0) * 1000.0)
+
+    threads = [threading.Thread(target=buyer, args=(n,)) for n in range(args.buyers)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    db = app.DBProxy(None, app._db_engine())
+    try:
+        drain = time.perf_counter()
+        while db.execute("SELECT COUNT(*) AS c FROM jobs WHERE status <> 'dead'").fetchone()['c']:
+            db.rollback()
+            if time.perf_counter() - drain > 120:
+                break
+            time.sleep(0.05)
+        drain = time.perf_counter() - drain
+        dead_jobs = db.execute("SELECT COUNT(*) AS c FROM jobs WHERE status = 'dead'").fetchone()['c']
+        rolled_up = db.execute('SELECT COALESCE(SUM(units), 0) AS u FROM sales_daily_medicine WHERE medicine_id = ?',
+                               (hot,)).fetchone()['u']
+        final_stock = db.execute('SELECT stock FROM medicines WHERE id = ?', (hot,)).fetchone()['stock']
+        marks = ','.join('?' * len(users))
+        orders = db.execute(f'SELECT COUNT(*) AS c FROM orders WHERE user_id IN ({marks})', users).fetchone()['c']
+        payments = db.execute(f'SELECT COUNT(*) AS c FROM transactions WHERE user_id IN ({marks})', users).fetchone()['c']
+        sold = db.execute('SELECT COALESCE(SUM(quantity), 0) AS q FROM order_items WHERE medicine_id = ?', (hot,)).fetchone()['q']
+        credited = db.execute(f"SELECT COUNT(*) AS c FROM reward_ledger WHERE reason = 'order_accrual' AND user_id IN ({marks})",
+                              users).fetchone()['c']
+    finally:
+        db.close()
+
+    placed = statuses[201]
+    failures = []
+    if final_stock < 0:
+        failures.append('negative stock')
+    if sold != args.stock - final_stock or sold != placed:
+        failures.append('units sold do not match the stock decrement')
+    if orders != placed or payments != placed:
+        failures.append('orders/transactions do not match successful checkouts')
+    if set(statuses) - {201, 409}:
+        failures.append('unexpected response statuses')
+    if dead_jobs or rolled_up != sold or credited != placed:
+        failures.append('rollups or reward points do not match the orders after the jobs ran')
+
+    report = {
+        'engine': app._db_engine(),
+        'buyers': args.buyers,
+        'attempts': args.attempts,
+        'initial_stock': args.stock,
+        'final_stock': final_stock,
+        'orders_placed': placed,
+        'sold_out_responses': statuses[409],
+        'statuses': dict(statuses),
+        'seconds': round(elapsed, 2),
+        'orders_per_sec': round(placed / elapsed, 1),
+        'requests_per_sec': round(sum(statuses.values()) / elapsed, 1),
+        'latency_ms': {p: round(sorted(latencies)[min(len(latencies) - 1, int(len(latencies) * q))], 2)
+                       for p, q in (('p50', 0.5), ('p95', 0.95), ('p99', 0.99))} if latencies else None,
+        'job_delay_ms': args.job_delay_ms,
+        'jobs_drain_seconds': round(drain, 2),
+        'dead_jobs': dead_jobs,
+        'failures': failures,
+    }
+    print(json.dumps(report, indent=2))
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,86 @@
+"""Benchmark for the batch delivery dispatcher (assign_deliveries).
+
+Seeds riders spread over cities/pincodes and N unassigned deliveries, runs one
+assignment pass and checks that no delivery was assigned twice and no rider went
+over capacity:
+
+    python backend/bench_delivery.py --deliveries 50000 --riders 1000
+
+Runs against a throwaway SQLite file unless DB_ENGINE/DB_PATH (or the MYSQL_*
+settings) are already set in the environment.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--deliveries', type=int, default=50000)
+    parser.add_argument('--riders', type=int, default=1000)
+    parser.add_argument('--cities', type=int, default=25)
+    parser.add_argument('--pincodes-per-city', type=int, default=8)
+    parser.add_argument('--capacity', type=int, default=60)
+    parser.add_argument('--seed', type=int, default=11)
+    args = parser.parse_args()
+
+    os.environ.setdefault('DB_ENGINE', 'sqlite')
+    if os.environ['DB_ENGINE'] == 'sqlite':
+        os.environ.setdefault('DB_PATH', os.path.join(tempfile.mkdtemp(), 'delivery.db'))
+    import app
+
+    rnd = random.Random(args.seed)
+    areas = [(f'City {c}', f'{100000 + c * 100 + p}') for c in range(args.cities) for p in range(args.pincodes_per_city)]
+    app.init_db()
+    db = app.DBProxy(None, app._db_engine())
+    try:
+        tag = f'bench-{int(time.time())}'
+        user_id = db.execute('INSERT INTO users(name, email) VALUES(?, ?)', ('Delivery bench', f'{tag}@example.com')).lastrowid
+        order_id = db.execute('INSERT INTO orders(user_id, status, total_amount) VALUES(?, ?, ?)', (user_id, 'placed', 0)).lastrowid
+        rider_ids = []
+        for i in range(args.riders):
+            city, pincode = rnd.choice(areas)
+            # some riders cover the whole city, a few have no area at all
+            roll = rnd.random()
+            rider_ids.append(db.execute('INSERT INTO delivery_persons(name, city, pincode, capacity, active) VALUES(?, ?, ?, ?, 1)',
+                                        (f'{tag} rider {i}', None if roll < 0.05 else city,
+                                         pincode if roll > 0.3 else None, args.capacity)).lastrowid)
+        address_ids = [db.execute('INSERT INTO addresses(user_id, line1, city, pincode) VALUES(?, ?, ?, ?)',
+                                  (user_id, 'bench', city, pincode)).lastrowid for city, pincode in areas]
+        db.executemany("INSERT INTO deliveries(order_id, address_id, status) VALUES(?, ?, 'scheduled')",
+                       [(order_id, rnd.choice(address_ids)) for _ in range(args.deliveries)])
+        db.commit()
+
+        start = time.perf_counter()
+        report = app.assign_deliveries(db, args.deliveries)
+        elapsed = time.perf_counter() - start
+
+        marks = ','.join('?' * len(rider_ids))
+        loads = [r['n'] for r in db.execute(f"SELECT COUNT(*) AS n FROM deliveries WHERE status = 'assigned' AND delivery_person_id IN ({marks}) "
+                                            f'GROUP BY delivery_person_id', rider_ids).fetchall()]
+        assigned_rows = db.execute("SELECT COUNT(*) AS n FROM deliveries WHERE order_id = ? AND status = 'assigned'", (order_id,)).fetchone()['n']
+    finally:
+        db.close()
+
+    failures = []
+    if assigned_rows != report['assigned']:
+        failures.append('assigned rows do not match the report')
+    if loads and max(loads) > args.capacity:
+        failures.append('a rider is over capacity')
+    report.update({
+        'seconds': round(elapsed, 3),
+        'deliveries_per_sec': round(report['assigned'] / elapsed, 1) if elapsed else None,
+        'max_load': max(loads) if loads else 0,
+        'min_load': min(loads) if loads else 0,
+        'failures': failures,
+    })
+    print(json.dumps(report, indent=2))
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,140 @@
+"""Serialization benchmark for a 50k-row /api/medicines response.
+
+Fills a throwaway SQLite file with --rows medicines, then builds the response body the
+way api_medicines does (build_medicines_query + medicines_page + jsonify) three ways:
+
+    before   dict(r) per row, Flask's default JSON provider
+    stdlib   DBProxy.rows() + JSONProvider on the json module
+    orjson   DBProxy.rows() + JSONProvider on orjson
+
+each with SQLite's value types and with the ones pymysql returns (price as Decimal,
+created_at as datetime), timing fetch + encode and encode alone (best of --repeat):
+
+    python backend/bench_json.py --rows 50000
+
+Exits 1 if the providers don't produce the same document.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+os.environ['DB_ENGINE'] = 'sqlite'
+os.environ['DB_PATH'] = os.path.join(tempfile.mkdtemp(), 'json.db')
+
+import app
+from flask.json.provider import DefaultJSONProvider
+
+DECIMAL_COLUMNS, DATETIME_COLUMNS = ('price',), ('created_at',)
+
+
+def _fill(db, rows, seed):
+    rnd = random.Random(seed)
+    now = datetime.now().replace(microsecond=0)
+    db.executemany('INSERT INTO categories(id, name) VALUES(?, ?)', [(c, f'Category {c}') for c in range(1, 9)])
+    db.executemany('INSERT INTO medicines(id, slug, name, generic_name, brand, description, price, stock, image_url, '
+                   'category_id, created_at) VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                   [(i, f'json-{i}', f'Medicine {i} {rnd.choice(("Tablets", "Syrup", "Capsules"))}', f'Generic {i % 700}',
+                     f'Brand {i % 90}', 'Bench row for the serialization benchmark.', round(rnd.uniform(5, 2500), 2),
+                     rnd.randint(0, 900), f'https://example.com/img/{i}.jpg', rnd.randint(1, 8),
+                     (now - timedelta(minutes=i)).strftime('%Y-%m-%d %H:%M:%S')) for i in range(1, rows + 1)])
+    db.commit()
+
+
+def _mysql_value(name, value):
+    # what pymysql hands back for the same column: DECIMAL and DATETIME objects
+    if name in DECIMAL_COLUMNS:
+        return Decimal(f'{value:.2f}')
+    if name in DATETIME_COLUMNS:
+        return datetime.fromisoformat(value)
+    return value
+
+
+def _best(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        body = fn()
+        times.append(time.perf_counter() - t0)
+    return min(times) * 1000.0, body
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=50000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=22)
+    args = parser.parse_args()
+
+    app.SLOW_QUERY_MS = float('inf')  # 50k-row statements are slow on purpose; keep the log quiet
+    app.init_db()
+    db = app.DBProxy(None, 'sqlite')
+    _fill(db, args.rows, args.seed)
+    # every catalog field plus created_at, in api_medicines' order
+    sql, params = app.build_medicines_query(None, 'name', limit=args.rows)
+    sql = sql.replace(' FROM medicines m', ', m.created_at FROM medicines m', 1)
+    query = {'fields': None, 'sort': 'name', 'limit': args.rows}
+    providers = {'before': DefaultJSONProvider(app.app), 'stdlib': app.JSONProvider(app.app, 'stdlib'),
+                 'orjson': app.JSONProvider(app.app, 'orjson')}
+    if providers['orjson'].name != 'orjson':
+        del providers['orjson']
+
+    def fetch_dicts(types):
+        # the old handlers: sqlite3.Row, or a dict per row from pymysql's DictCursor
+        rows = db.execute(sql, params).fetchall()
+        if types == 'mysql':
+            rows = [{k: _mysql_value(k, r[k]) for k in r.keys()} for r in rows]
+        return rows
+
+    def build_dicts(rows):
+        return {'items': [dict(r) for r in rows][:args.rows], 'next_cursor': None}
+
+    def fetch_rows(types):
+        rows = db.rows(sql, params)
+        if types == 'mysql':
+            cols = rows.columns
+            rows = app.Rows(cols, [tuple(_mysql_value(k, v) for k, v in zip(cols, r)) for r in rows])
+        return rows
+
+    def build_rows(rows):
+        return app.medicines_page(rows, query)
+
+    report = {'meta': {'rows': args.rows, 'repeat': args.repeat, 'python': sys.version.split()[0]}, 'types': {}}
+    failures = []
+    try:
+        with app.app.app_context():
+            for types in ('sqlite', 'mysql'):
+                out, docs = {}, {}
+                for name, provider in providers.items():
+                    fetch, build = (fetch_dicts, build_dicts) if name == 'before' else (fetch_rows, build_rows)
+                    fetched = fetch(types)
+                    encode_ms, body = _best(lambda: provider.response(build(fetched)).get_data(), args.repeat)
+                    total_ms, _ = _best(lambda: provider.response(build(fetch(types))).get_data(), args.repeat)
+                    docs[name] = json.loads(body)
+                    out[name] = {'encode_ms': round(encode_ms, 1), 'fetch_and_encode_ms': round(total_ms, 1),
+                                 'bytes': len(body)}
+                for name, result in out.items():
+                    result['encode_speedup'] = round(out['before']['encode_ms'] / result['encode_ms'], 2)
+                    result['total_speedup'] = round(out['before']['fetch_and_encode_ms'] / result['fetch_and_encode_ms'], 2)
+                    if name != 'before' and docs[name] != docs['stdlib']:
+                        failures.append(f'{types}: {name} and stdlib documents differ')
+                # how the DECIMAL/DATETIME columns of the first row came out
+                out['sample'] = {name: {k: doc['items'][0][k] for k in DECIMAL_COLUMNS + DATETIME_COLUMNS}
+                                 for name, doc in docs.items()}
+                report['types'][types] = out
+                print(f"{types}: " + ', '.join(f"{n} {v['encode_ms']} ms" for n, v in out.items() if n != 'sample'),
+                      file=sys.stderr)
+    finally:
+        db.close()
+    report['failures'] = failures
+    print(json.dumps(report, indent=2))
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,570 @@
+"""Load test harness: drives every /api/* route against a generated dataset.
+
+Generates a synthetic dataset (1k, 100k or 1M rows in each large table), boots the
+app in a threaded server subprocess, runs each route with a pool of concurrent
+clients and writes throughput, p50/p95/p99 latency, DB queries per request (from the
+Server-Timing header) and the server's peak RSS to a JSON report. Two reports can be
+diffed; the exit status is 1 when the newer one regressed past --tolerance:
+
+    python backend/bench_load.py --scale 100k --concurrency 16 --requests 400 --out load-100k.json
+    python backend/bench_load.py --compare load-before.json load-after.json
+
+SQLite datasets are generated once per scale into the temp directory and copied for
+every run, so runs start from identical data. With DB_ENGINE=mysql the MYSQL_*
+database is filled in place (use a throwaway one). --url benchmarks a server that is
+already running (e.g. another serving mode) against a dataset made by --generate-only;
+pass --pid to get its RSS.
+"""
+import argparse
+import http.client
+import itertools
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SCALES = {'1k': 1000, '100k': 100000, '1m': 1000000}
+BATCH = 10000
+CITIES = [(f'Bench City {c}', [f'{560000 + c * 100 + p}' for p in range(6)]) for c in range(25)]
+SPECIALTIES = ['General Physician', 'Dermatologist', 'Cardiologist', 'Pediatrician', 'Orthopedic', 'ENT']
+WORDS = ['para', 'amox', 'cetir', 'ibu', 'metfor', 'azith', 'panto', 'losar', 'atorva', 'dolo', 'vita', 'omega']
+PASSWORD = 'bench-password'
+SERVER = ('import sys, app\n'
+          'from werkzeug.serving import make_server\n'
+          'make_server(sys.argv[1], int(sys.argv[2]), app.app, threaded=True).serve_forever()\n')
+
+
+def _sizes(rows):
+    # Tables that routes return whole (catalog lists, slot index, rider pool) are
+    # capped; everything else gets `rows` rows.
+    return {
+        'categories': 40,
+        'labs': 100,
+        'lab_tests': min(rows, 2000),
+        'doctors': max(10, min(rows // 200, 500)),
+        'riders': max(10, min(rows // 100, 2000)),
+    }
+
+
+def generate(app, rows, seed):
+    rnd = random.Random(seed)
+    now = datetime.now().replace(microsecond=0)
+    sizes = _sizes(rows)
+    app.SLOW_QUERY_MS = float('inf')  # bulk loads are slow on purpose; keep the log quiet
+    db = app.DBProxy(None, app._db_engine())
+    if db.engine == 'sqlite':
+        db.execute('PRAGMA synchronous = OFF')
+
+    def base(table):
+        return db.execute(f'SELECT COALESCE(MAX(id), 0) AS hi FROM {table}').fetchone()['hi']
+
+    def fill(table, columns, values):
+        sql = f"INSERT INTO {table}({', '.join(columns)}) VALUES({', '.join('?' * len(columns))})"
+        for batch in iter(lambda: list(itertools.islice(values, BATCH)), []):
+            db.executemany(sql, batch)
+            db.commit()
+
+    def stamp(days=90):
+        return (now - timedelta(seconds=rnd.randrange(days * 86400))).strftime('%Y-%m-%d %H:%M:%S')
+
+    try:
+        cat0 = base('categories')
+        fill('categories', ('id', 'name'), ((cat0 + i, f'Bench category {i}') for i in range(1, sizes['categories'] + 1)))
+        lab0 = base('labs')
+        fill('labs', ('id', 'name', 'city', 'contact'),
+             ((lab0 + i, f'Bench lab {i}', rnd.choice(CITIES)[0], '080-0000') for i in range(1, sizes['labs'] + 1)))
+        fill('lab_tests', ('name', 'category', 'price', 'lab_id'),
+             ((f'Bench test {i}', rnd.choice(('Blood', 'Urine', 'Imaging', 'Panel')), rnd.randint(100, 5000),
+               lab0 + rnd.randint(1, sizes['labs'])) for i in range(sizes['lab_tests'])))
+        doc0 = base('doctors')
+        fill('doctors', ('id', 'name', 'specialty', 'experience_years', 'consultation_fee'),
+             ((doc0 + i, f'Dr. Bench {i}', rnd.choice(SPECIALTIES), rnd.randint(1, 30), rnd.choice((300, 500, 800)))
+              for i in range(1, sizes['doctors'] + 1)))
+        # Mon-Sat (ISO 1-6) 09:00-17:00 for everyone (bench_load books slots inside that window)
+        fill('doctor_availability', ('doctor_id', 'day_of_week', 'start_time', 'end_time'),
+             ((doc0 + d, dow, '09:00', '17:00') for d in range(1, sizes['doctors'] + 1) for dow in range(1, 7)))
+        areas = [(city, pin) for city, pins in CITIES for pin in pins]
+        fill('delivery_persons', ('name', 'city', 'pincode', 'capacity', 'active'),
+             ((f'Bench rider {i}', *rnd.choice(areas), 40, 1) for i in range(sizes['riders'])))
+        rider0 = base('delivery_persons') - sizes['riders']
+
+        user0 = base('users')
+        fill('users', ('id', 'name', 'email', 'phone', 'role', 'created_at'),
+             ((user0 + i, f'Bench user {i}', f'user-{i}@bench.test', f'9{i:09d}', 'customer', stamp(365))
+              for i in range(1, rows + 1)))
+        addr0 = base('addresses')
+        fill('addresses', ('id', 'user_id', 'line1', 'city', 'pincode', 'is_default'),
+             ((addr0 + i, user0 + i, f'{i} Bench Road', *rnd.choice(areas), 1) for i in range(1, rows + 1)))
+        med0 = base('medicines')
+        fill('medicines', ('id', 'slug', 'name', 'generic_name', 'brand', 'price', 'stock', 'category_id'),
+             ((med0 + i, f'bench-{i}', f'{rnd.choice(WORDS).title()}bench {i}', f'{rnd.choice(WORDS)}generic',
+               f'Brand {rnd.randrange(200)}', round(rnd.uniform(5, 900), 2),
+               rnd.randint(0, 15) if rnd.random() < 0.05 else rnd.randint(50, 5000),
+               cat0 + rnd.randint(1, sizes['categories'])) for i in range(1, rows + 1)))
+
+        order0, prices = base('orders'), {}
+
+        def orders():
+            for i in range(1, rows + 1):
+                qty, price = rnd.randint(1, 4), round(rnd.uniform(5, 900), 2)
+                prices[order0 + i] = (qty, price)
+                yield (order0 + i, user0 + rnd.randint(1, rows), rnd.choice(('placed', 'paid', 'delivered', 'delivered')),
+                       round(qty * price, 2), stamp())
+        fill('orders', ('id', 'user_id', 'status', 'total_amount', 'created_at'), orders())
+        fill('order_items', ('order_id', 'medicine_id', 'quantity', 'price'),
+             ((oid, med0 + rnd.randint(1, rows), qty, price) for oid, (qty, price) in prices.items()))
+        owners = {r['id']: r['user_id'] for r in db.execute('SELECT id, user_id FROM orders WHERE id > ?', (order0,)).fetchall()}
+        fill('transactions', ('user_id', 'order_id', 'type', 'amount', 'status', 'created_at'),
+             ((owners[oid], oid, 'payment', round(qty * price, 2), 'success', stamp()) for oid, (qty, price) in prices.items()))
+        # 10% still waiting for a rider so /api/deliveries/assign has work
+        fill('deliveries', ('order_id', 'delivery_person_id', 'address_id', 'status', 'scheduled_at'),
+             ((oid, None if rnd.random() < 0.1 else rider0 + rnd.randint(1, sizes['riders']),
+               addr0 + owners[oid] - user0, None, stamp()) for oid in prices))
+        db.execute("UPDATE deliveries SET status = CASE WHEN delivery_person_id IS NULL THEN 'scheduled' ELSE 'delivered' END "
+                   'WHERE status IS NULL')
+        db.commit()
+        prices.clear()
+        owners.clear()
+        fill('appointments', ('user_id', 'doctor_id', 'scheduled_at', 'status'),
+             ((user0 + rnd.randint(1, rows), doc0 + rnd.randint(1, sizes['doctors']), stamp(), 'completed')
+              for _ in range(rows)))
+        lo0 = base('lab_orders')
+        test_ids = [r['id'] for r in db.execute('SELECT id FROM lab_tests').fetchall()]
+        fill('lab_orders', ('id', 'user_id', 'lab_test_id', 'scheduled_at', 'status'),
+             ((lo0 + i, user0 + rnd.randint(1, rows), rnd.choice(test_ids), stamp(), 'completed') for i in range(1, rows + 1)))
+        fill('lab_results', ('lab_order_id', 'result_summary', 'status', 'reported_at'),
+             ((lo0 + i, 'within normal range', 'ready', stamp()) for i in range(1, rows + 1)))
+        fill('reward_ledger', ('user_id', 'delta', 'reason', 'created_at'),
+             ((user0 + rnd.randint(1, rows), rnd.randint(1, 200), 'bench_accrual', stamp()) for _ in range(rows)))
+        db.execute('INSERT INTO reward_points(user_id, points_balance, ledger_id) '
+                   'SELECT DISTINCT user_id, 0, 0 FROM reward_ledger WHERE user_id > ?', (user0,))
+        db.commit()
+        app.compact_reward_balances(db)
+        app.rebuild_rollups(db)
+        db.commit()
+    finally:
+        db.close()
+
+
+class Context:
+    # ids and tokens the scenarios draw from, read back from the database so a cached
+    # dataset works without regenerating it
+    def __init__(self, app, requests, seed):
+        db = app.DBProxy(None, app._db_engine())
+        try:
+            users = db.execute('SELECT MIN(id) AS lo, MAX(id) AS hi FROM users WHERE email LIKE ?', ('user-%@bench.test',)).fetchone()
+            meds = db.execute('SELECT MIN(id) AS lo, MAX(id) AS hi FROM medicines WHERE slug LIKE ?', ('bench-%',)).fetchone()
+            if users['lo'] is None or meds['lo'] is None:
+                raise SystemExit('no bench dataset in this database; run without --skip-generate first')
+            self.categories = [r['id'] for r in db.execute('SELECT id FROM categories').fetchall()]
+            self.doctors = [r['id'] for r in db.execute('SELECT id FROM doctors WHERE name LIKE ?', ('Dr. Bench %',)).fetchall()]
+            self.brands = [r['brand'] for r in db.execute('SELECT DISTINCT brand FROM medicines WHERE brand IS NOT NULL LIMIT 50').fetchall()]
+            self.max_order = db.execute('SELECT MAX(id) AS hi FROM orders').fetchone()['hi'] or 0
+            self.max_transaction = db.execute('SELECT MAX(id) AS hi FROM transactions').fetchone()['hi'] or 0
+            lo, hi = users['lo'], users['hi']
+            self.token_users = list(range(lo, lo + min(200, max(1, (hi - lo) // 4))))
+            marks = ','.join('?' * len(self.token_users))
+            self.appointments = [(r['id'], r['user_id']) for r in db.execute(
+                f'SELECT id, user_id FROM appointments WHERE user_id IN ({marks}) LIMIT 2000', self.token_users).fetchall()]
+            # DELETE /api/user consumes one account per request, taken from the top of the range
+            self.doomed = itertools.count(hi, -1)
+            self.doomed_floor = max(self.token_users[-1] + 1, hi - requests)
+            self.users = (lo, hi)
+            self.medicines = (meds['lo'], meds['hi'])
+        finally:
+            db.close()
+        self.app = app
+        self.seed = seed
+        self.admin = app.issue_token({'id': lo, 'role': 'admin', 'email': None})[0]
+        self.tokens = {uid: app.issue_token({'id': uid, 'email': None})[0] for uid in self.token_users}
+        self.run_tag = f'{int(time.time())}-{os.getpid()}'
+        self.serial = itertools.count()
+
+    def user(self, rnd):
+        uid = rnd.choice(self.token_users)
+        return uid, {'Authorization': 'Bearer ' + self.tokens[uid]}
+
+    def admin_headers(self):
+        return {'Authorization': 'Bearer ' + self.admin}
+
+    def medicine(self, rnd):
+        return rnd.randint(*self.medicines)
+
+    def slot(self, rnd):
+        # a future slot inside every doctor's Mon-Sat 09:00-17:00 window
+        day = datetime.now().date() + timedelta(days=rnd.randint(1, max(1, self.app.SLOT_HORIZON_DAYS - 2)))
+        while day.weekday() == 6:
+            day += timedelta(days=1)
+        start = datetime.combine(day, datetime.min.time()) + timedelta(hours=9, minutes=self.app.SLOT_MINUTES * rnd.randrange(480 // self.app.SLOT_MINUTES))
+        return start.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _import_body(ctx, rnd):
+    lines = ['slug,name,price,stock,brand']
+    for _ in range(50):
+        i = ctx.medicine(rnd) - ctx.medicines[0] + 1
+        lines.append(f'bench-{i},Importbench {i},{rnd.randint(5, 900)}.00,{rnd.randint(50, 5000)},Brand {i % 200}')
+    return '\n'.join(lines).encode(), {'Content-Type': 'text/csv', **ctx.admin_headers()}
+
+
+def _delete_user(ctx, rnd):
+    uid = next(ctx.doomed)
+    if uid < ctx.doomed_floor:
+        raise SystemExit('ran out of accounts for DELETE /api/user; lower --requests')
+    token = ctx.app.issue_token({'id': uid, 'email': None})[0]
+    return 'DELETE', '/api/user', None, {'Authorization': 'Bearer ' + token}
+
+
+def _cancel(ctx, rnd):
+    appt, uid = rnd.choice(ctx.appointments)
+    return 'POST', f'/api/appointments/{appt}/cancel', None, {'Authorization': 'Bearer ' + ctx.tokens[uid]}
+
+
+def _dashboard(kind):
+    def build(ctx, rnd):
+        end = datetime.now().date() - timedelta(days=rnd.randrange(30))
+        start = end - timedelta(days=rnd.choice((7, 30, 90)))
+        return 'GET', f'/api/dashboard/{kind}?from={start}&to={end}&limit=10', None, ctx.admin_headers()
+    return build
+
+
+# name -> (request builder(ctx, rnd) -> (method, path, body, headers), statuses that
+# count as success besides 2xx). Every /api/* rule in app.py should appear here.
+SCENARIOS = {
+    'db.summary': (lambda c, r: ('GET', '/api/db/summary', None, None), ()),
+    'db.pool': (lambda c, r: ('GET', '/api/db/pool', None, None), ()),
+    'cache.stats': (lambda c, r: ('GET', '/api/cache/stats', None, None), ()),
+    'medicines': (lambda c, r: ('GET', f"/api/medicines?limit=24&sort={r.choice(('name', 'price_asc', 'newest'))}"
+                                f'&category_id={r.choice(c.categories)}', None, None), ()),
+    'medicines.page': (lambda c, r: ('GET', f"/api/medicines?limit=24&q={r.choice(WORDS)}&min_price={r.randint(0, 400)}", None, None), ()),
+    'medicines.brands': (lambda c, r: ('GET', '/api/medicines/brands', None, None), ()),
+    'medicines.search': (lambda c, r: ('GET', f'/api/medicines/search?q={r.choice(WORDS)}{r.choice(("", "bench", " generic"))}'.replace(' ', '+'), None, None), ()),
+    'categories': (lambda c, r: ('GET', '/api/categories', None, None), ()),
+    'doctors': (lambda c, r: ('GET', '/api/doctors', None, None), ()),
+    'lab-tests': (lambda c, r: ('GET', '/api/lab-tests', None, None), ()),
+    'auth.session': (lambda c, r: ('GET', '/api/auth/session', None, c.user(r)[1]), ()),
+    'auth.logout': (lambda c, r: ('POST', '/api/auth/logout', None,
+                                  {'Authorization': 'Bearer ' + c.app.issue_token({'id': r.choice(c.token_users), 'email': None})[0]}), ()),
+    'auth.stats': (lambda c, r: ('GET', '/api/auth/stats', None, None), ()),
+    'auth.signup': (lambda c, r: ('POST', '/api/auth/signup', {'name': 'Load signup', 'password': PASSWORD,
+                                                               'email': f'signup-{c.run_tag}-{next(c.serial)}@bench.test'}, None), ()),
+    'auth.login': (lambda c, r: ('POST', '/api/auth/login', {'email': f'login-{c.run_tag}@bench.test', 'password': PASSWORD}, None), ()),
+    'user.get': (lambda c, r: ('GET', f'/api/user?email=user-{r.randint(1, c.users[1] - c.users[0] + 1)}@bench.test', None, None), ()),
+    'user.post': (lambda c, r: ('POST', '/api/user', {'email': f'user-{r.randint(1, c.users[1] - c.users[0] + 1)}@bench.test',
+                                                      'name': 'Bench user', 'language': 'en'}, None), ()),
+    'user.delete': (_delete_user, ()),
+    'checkout': (lambda c, r: ('POST', '/api/checkout', {'items': [{'medicine_id': c.medicine(r), 'quantity': r.randint(1, 2)}
+                                                                   for _ in range(r.randint(1, 3))]}, c.user(r)[1]), (409,)),
+    'import.medicines': (lambda c, r: ('POST', '/api/import/medicines', *_import_body(c, r)), ()),
+    'export.orders': (lambda c, r: ('GET', f'/api/export/orders?after={max(0, c.max_order - 500)}', None, c.admin_headers()), ()),
+    'export.transactions': (lambda c, r: ('GET', f'/api/export/transactions?format=csv&after={max(0, c.max_transaction - 500)}',
+                                          None, c.admin_headers()), ()),
+    'deliveries.assign': (lambda c, r: ('POST', '/api/deliveries/assign?limit=50', None, c.admin_headers()), ()),
+    'doctor.slots': (lambda c, r: ('GET', f'/api/doctors/{r.choice(c.doctors)}/slots?limit=20', None, None), ()),
+    'slots': (lambda c, r: ('GET', f'/api/slots?specialty={r.choice(SPECIALTIES).replace(" ", "+")}&limit=20', None, None), ()),
+    'appointments.book': (lambda c, r: ('POST', '/api/appointments', {'doctor_id': r.choice(c.doctors), 'start': c.slot(r)},
+                                        c.user(r)[1]), (409,)),
+    'appointments.cancel': (_cancel, ()),
+    'rewards': (lambda c, r: ('GET', '/api/rewards?limit=20', None, c.user(r)[1]), ()),
+    'rewards.redeem': (lambda c, r: ('POST', '/api/rewards/redeem', {'points': r.randint(1, 5)}, c.user(r)[1]), (409,)),
+    'dashboard.sales': (_dashboard('sales'), ()),
+    'dashboard.categories': (_dashboard('categories'), ()),
+    'dashboard.top-medicines': (_dashboard('top-medicines'), ()),
+    'dashboard.cities': (_dashboard('cities'), ()),
+    'dashboard.low-stock': (lambda c, r: ('GET', '/api/dashboard/low-stock?limit=20', None, c.admin_headers()), ()),
+}
+
+
+def _request(host, port, method, path, body, headers):
+    headers = dict(headers or {})
+    if isinstance(body, dict):
+        body = json.dumps(body).encode()
+        headers['Content-Type'] = 'application/json'
+    conn = http.client.HTTPConnection(host, port, timeout=300)
+    try:
+        start = time.perf_counter()
+        conn.request(method, path, body=body, headers=headers)
+        resp = conn.getresponse()
+        resp.read()
+        elapsed = time.perf_counter() - start
+        queries = None
+        for value in (resp.headers.get_all('Server-Timing') or []):
+            # db;dur=1.23;desc="4 queries, 30 rows"
+            if value.startswith('db;') and 'desc="' in value:
+                queries = int(value.split('desc="', 1)[1].split(' ', 1)[0])
+        return resp.status, elapsed, queries
+    finally:
+        conn.close()
+
+
+def _percentile(values, p):
+    return values[min(len(values) - 1, max(0, int(round(p / 100.0 * len(values) + 0.5)) - 1))]
+
+
+def run_scenario(ctx, host, port, name, requests, concurrency, warmup):
+    build, accepted = SCENARIOS[name]
+    for i in range(warmup):
+        _request(host, port, *build(ctx, random.Random(ctx.seed - i)))
+    results = []
+    counter = itertools.count()
+    lock = threading.Lock()
+
+    def client(n):
+        rnd = random.Random(hash((ctx.seed, name, n)))
+        while next(counter) < requests:
+            try:
+                out = _request(host, port, *build(ctx, rnd))
+            except (OSError, http.client.HTTPException) as e:
+                out = (type(e).__name__, 0.0, None)
+            with lock:
+                results.append(out)
+
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(concurrency)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    statuses = Counter(str(s) for s, _, _ in results)
+    latencies = sorted(t * 1000.0 for s, t, _ in results if isinstance(s, int))
+    queries = [q for _, _, q in results if q is not None]
+    errors = sum(1 for s, _, _ in results if not (isinstance(s, int) and (200 <= s < 300 or s in accepted)))
+    return {
+        'requests': len(results),
+        'errors': errors,
+        'statuses': dict(statuses),
+        'seconds': round(elapsed, 3),
+        'requests_per_sec': round(len(results) / elapsed, 1) if elapsed else None,
+        'latency_ms': {
+            'p50': round(_percentile(latencies, 50), 2),
+            'p95': round(_percentile(latencies, 95), 2),
+            'p99': round(_percentile(latencies, 99), 2),
+            'max': round(latencies[-1], 2),
+            'mean': round(sum(latencies) / len(latencies), 2),
+        } if latencies else None,
+        'db_queries_per_request': {
+            'mean': round(sum(queries) / len(queries), 2),
+            'max': max(queries),
+        } if queries else None,
+    }
+
+
+def _rss_kb(pid, field):
+    # VmHWM = peak resident set size, VmRSS = current (Linux /proc only)
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _wait_for(host, port, proc, timeout=120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc is not None and proc.poll() is not None:
+            raise SystemExit(f'server exited with status {proc.returncode}')
+        try:
+            if _request(host, port, 'GET', '/readyz', None, None)[0] == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise SystemExit('server did not become ready')
+
+
+def _git_commit():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=HERE, capture_output=True, text=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=HERE,
+                                    capture_output=True, text=True).stdout.strip())
+        return commit or None, dirty
+    except OSError:
+        return None, None
+
+
+def compare(old_path, new_path, tolerance):
+    # Regression = throughput down or p95 up by more than `tolerance`, more DB queries per
+    # request, new errors, or peak RSS up by more than `tolerance`.
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    rows, regressions = [], []
+    for name, cur in new['scenarios'].items():
+        prev = old['scenarios'].get(name)
+        if not prev:
+            rows.append({'scenario': name, 'note': 'new'})
+            continue
+        row = {'scenario': name}
+        if prev['requests_per_sec'] and cur['requests_per_sec'] is not None:
+            row['rps_change'] = round(cur['requests_per_sec'] / prev['requests_per_sec'] - 1, 3)
+            if row['rps_change'] < -tolerance:
+                regressions.append(f'{name}: throughput {row["rps_change"]:+.0%}')
+        if prev['latency_ms'] and cur['latency_ms']:
+            row['p95_change'] = round(cur['latency_ms']['p95'] / max(prev['latency_ms']['p95'], 0.01) - 1, 3)
+            row['p99_change'] = round(cur['latency_ms']['p99'] / max(prev['latency_ms']['p99'], 0.01) - 1, 3)
+            if row['p95_change'] > tolerance:
+                regressions.append(f'{name}: p95 {row["p95_change"]:+.0%}')
+        if prev['db_queries_per_request'] and cur['db_queries_per_request']:
+            row['queries_change'] = round(cur['db_queries_per_request']['mean'] - prev['db_queries_per_request']['mean'], 2)
+            if row['queries_change'] >= 0.5:
+                regressions.append(f'{name}: {row["queries_change"]:+} queries per request')
+        if cur['errors'] > prev['errors']:
+            regressions.append(f'{name}: {cur["errors"]} errors (was {prev["errors"]})')
+        rows.append(row)
+    old_rss, new_rss = old.get('peak_rss_kb'), new.get('peak_rss_kb')
+    if old_rss and new_rss and new_rss > old_rss * (1 + tolerance):
+        regressions.append(f'peak RSS {new_rss / old_rss - 1:+.0%}')
+    for key in ('scale', 'engine', 'concurrency'):
+        if old['meta'].get(key) != new['meta'].get(key):
+            print(f'warning: {key} differs ({old["meta"].get(key)} vs {new["meta"].get(key)})', file=sys.stderr)
+    print(json.dumps({'old': old['meta'].get('commit'), 'new': new['meta'].get('commit'),
+                      'scenarios': rows, 'regressions': regressions}, indent=2))
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scale', choices=sorted(SCALES), default='1k', help='rows per large table')
+    parser.add_argument('--concurrency', type=int, default=16, help='client threads per scenario')
+    parser.add_argument('--requests', type=int, default=200, help='requests per scenario')
+    parser.add_argument('--warmup', type=int, default=2, help='unmeasured requests per scenario')
+    parser.add_argument('--only', help='comma-separated scenario names (default: all)')
+    parser.add_argument('--out', help='JSON report path (default: load-<scale>-<commit>.json in the temp dir)')
+    parser.add_argument('--regenerate', action='store_true', help='rebuild the cached SQLite dataset')
+    parser.add_argument('--skip-generate', action='store_true', help='MySQL: reuse the data already in the database')
+    parser.add_argument('--generate-only', action='store_true')
+    parser.add_argument('--url', help='benchmark this running server instead of starting one')
+    parser.add_argument('--pid', type=int, help='server pid for RSS when --url is given')
+    parser.add_argument('--seed', type=int, default=19)
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='diff two reports and exit')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed relative slowdown for --compare')
+    args = parser.parse_args()
+    if args.compare:
+        return compare(*args.compare, args.tolerance)
+
+    rows = SCALES[args.scale]
+    names = [n.strip() for n in args.only.split(',')] if args.only else list(SCENARIOS)
+    unknown = set(names) - set(SCENARIOS)
+    if unknown:
+        parser.error(f'unknown scenarios: {", ".join(sorted(unknown))}')
+
+    os.environ.setdefault('DB_ENGINE', 'sqlite')
+    os.environ.setdefault('SESSION_SECRET', 'bench-load-secret')  # the server must accept tokens minted here
+    os.environ.setdefault('LOGIN_MAX_ATTEMPTS_PER_IP', str(10 ** 9))  # every client is 127.0.0.1
+    os.environ.setdefault('DB_POOL_MAX', str(args.concurrency + 4))
+    os.environ.setdefault('DB_POOL_TIMEOUT', '60')
+    engine = os.environ['DB_ENGINE']
+    gen_seconds = None
+    if engine == 'sqlite' and 'DB_PATH' not in os.environ:
+        pristine = os.path.join(tempfile.gettempdir(), f'genricycle-bench-{args.scale}-{args.seed}.db')
+        if args.regenerate or not os.path.exists(pristine):
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(pristine + suffix):
+                    os.remove(pristine + suffix)
+            os.environ['DB_PATH'] = pristine
+            import app
+            start = time.perf_counter()
+            app.init_db()
+            generate(app, rows, args.seed)
+            gen_seconds = round(time.perf_counter() - start, 1)
+            app.get_pool().close()
+        run_path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+        shutil.copy(pristine, run_path)
+        os.environ['DB_PATH'] = run_path
+        import app
+        app.DB_PATH = run_path
+    else:
+        import app
+        app.init_db()
+        if not args.skip_generate:
+            start = time.perf_counter()
+            generate(app, rows, args.seed)
+            gen_seconds = round(time.perf_counter() - start, 1)
+    if args.generate_only:
+        print(json.dumps({'engine': engine, 'db_path': os.environ.get('DB_PATH'), 'generate_seconds': gen_seconds}))
+        return 0
+
+    ctx = Context(app, args.requests + args.warmup, args.seed)
+    proc = None
+    if args.url:
+        parts = urlsplit(args.url)
+        host, port, pid = parts.hostname, parts.port or 80, args.pid
+    else:
+        host, port = '127.0.0.1', _free_port()
+        log = open(os.path.join(tempfile.gettempdir(), 'genricycle-bench-server.log'), 'w')
+        proc = subprocess.Popen([sys.executable, '-c', SERVER, host, str(port)], cwd=HERE, env=os.environ.copy(),
+                                stdout=log, stderr=subprocess.STDOUT)
+        pid = proc.pid
+    try:
+        start = time.perf_counter()
+        _wait_for(host, port, proc)
+        ready_seconds = round(time.perf_counter() - start, 2)
+        status, _, _ = _request(host, port, 'POST', '/api/auth/signup',
+                                {'name': 'Load login', 'email': f'login-{ctx.run_tag}@bench.test', 'password': PASSWORD}, None)
+        if status != 201:
+            raise SystemExit(f'could not create the login account ({status})')
+        scenarios = {}
+        for name in names:
+            scenarios[name] = run_scenario(ctx, host, port, name, args.requests, args.concurrency, args.warmup)
+            scenarios[name]['rss_kb_after'] = _rss_kb(pid, 'VmRSS') if pid else None
+            print(f'{name}: {scenarios[name]["requests_per_sec"]} req/s, p95 {(scenarios[name]["latency_ms"] or {}).get("p95")} ms, '
+                  f'{scenarios[name]["errors"]} errors', file=sys.stderr)
+        peak = _rss_kb(pid, 'VmHWM') if pid else None
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+
+    commit, dirty = _git_commit()
+    report = {
+        'meta': {
+            'commit': commit,
+            'dirty': dirty,
+            'started_at': datetime.now().isoformat(timespec='seconds'),
+            'scale': args.scale,
+            'rows': rows,
+            'engine': engine,
+            'concurrency': args.concurrency,
+            'requests': args.requests,
+            'server': args.url or 'werkzeug threaded',
+            'generate_seconds': gen_seconds,
+            'ready_seconds': ready_seconds,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+        },
+        'peak_rss_kb': peak,
+        'errors': sum(s['errors'] for s in scenarios.values()),
+        'scenarios': scenarios,
+    }
+    out = args.out or os.path.join(tempfile.gettempdir(), f'load-{args.scale}-{(commit or "nogit")[:10]}.json')
+    with open(out, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(out)
+    return 1 if report['errors'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,204 @@
+"""Throughput of the prefork mode (prefork.py) by worker count on a CPU-bound mix.
+
+Generates a SQLite dataset (bench_load.generate) with --logins users that have a
+password, then for each worker count in --workers starts `prefork.py --workers N` and
+drives it for --seconds from --clients client processes with --concurrency connections
+each. The mix is --login-share logins (one password hash each) and catalog reads
+(medicine pages, search, brands, categories, doctors). Reports throughput, p50/p95/p99,
+failures, speedup and per-worker efficiency against the first count, and the workers'
+summed proportional set size (PSS, so memory shared copy-on-write or through the
+catalog snapshot is counted once):
+
+    python backend/bench_prefork.py --workers 1,2,4 --seconds 10
+
+Near-linear scaling needs as many free cores as workers plus clients; on fewer cores
+the extra workers only share the same CPUs.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+
+from bench_load import HERE, PASSWORD, _free_port, _git_commit, _percentile, generate
+
+CATALOG_WORDS = ('para', 'amox', 'cetir', 'ibu', 'metfor', 'azith', 'vita', 'omega')
+
+
+def _pss_kb(pid):
+    # proportional set size: shared pages are split between the processes mapping them
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            for line in f:
+                if line.startswith('Pss:'):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+def _children(pid):
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as f:
+            return [int(p) for p in f.read().split()]
+    except OSError:
+        return []
+
+
+async def _request(host, port, method, path, body=None):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        data = json.dumps(body).encode() if body is not None else b''
+        head = f'{method} {path} HTTP/1.1\r\nHost: {host}\r\nConnection: close\r\nContent-Length: {len(data)}\r\n'
+        if body is not None:
+            head += 'Content-Type: application/json\r\n'
+        writer.write(head.encode() + b'\r\n' + data)
+        response = await reader.read()
+    finally:
+        writer.close()
+    return int(response.split(b' ', 2)[1])
+
+
+def _pick(rnd, login_share, logins, categories):
+    if rnd.random() < login_share:
+        return 'POST', '/api/auth/login', {'email': f'user-{rnd.randint(1, logins)}@bench.test', 'password': PASSWORD}
+    return rnd.choice((
+        ('GET', f'/api/medicines?limit=24&category_id={rnd.choice(categories)}&sort={rnd.choice(("name", "price_asc"))}', None),
+        ('GET', f'/api/medicines/search?q={rnd.choice(CATALOG_WORDS)}&limit=10', None),
+        ('GET', '/api/medicines/brands', None),
+        ('GET', '/api/categories', None),
+        ('GET', '/api/doctors', None),
+    ))
+
+
+def _client(job):
+    # one client process: `concurrency` connections in a loop until the deadline
+    host, port, concurrency, deadline, login_share, logins, categories, seed = job
+    results = []
+
+    async def connection(n):
+        rnd = random.Random(seed * 1000 + n)
+        while time.time() < deadline:
+            method, path, body = _pick(rnd, login_share, logins, categories)
+            t0 = time.perf_counter()
+            try:
+                status = await asyncio.wait_for(_request(host, port, method, path, body), 30)
+            except (OSError, asyncio.TimeoutError, IndexError, ValueError) as e:
+                status = type(e).__name__
+            results.append((method, status, time.perf_counter() - t0))
+
+    async def run():
+        await asyncio.gather(*(connection(n) for n in range(concurrency)))
+
+    asyncio.run(run())
+    return results
+
+
+def run_workers(workers, args, env, categories):
+    host, port = '127.0.0.1', _free_port()
+    log = open(os.path.join(tempfile.gettempdir(), f'genricycle-bench-prefork-{workers}.log'), 'w')
+    proc = subprocess.Popen([sys.executable, 'prefork.py', '--workers', str(workers), '--bind', f'{host}:{port}'],
+                            cwd=HERE, env=env, stdout=log, stderr=subprocess.STDOUT)
+    try:
+        deadline = time.monotonic() + 120
+        while True:
+            if proc.poll() is not None:
+                raise SystemExit(f'prefork server exited with status {proc.returncode}')
+            try:
+                if asyncio.run(_request(host, port, 'GET', '/readyz')) == 200:
+                    break
+            except OSError:
+                pass
+            if time.monotonic() > deadline:
+                raise SystemExit('prefork server did not become ready')
+            time.sleep(0.2)
+        start = time.time()
+        jobs = [(host, port, args.concurrency, start + args.seconds, args.login_share, args.logins, categories,
+                 args.seed + c) for c in range(args.clients)]
+        with multiprocessing.Pool(args.clients) as pool:
+            results = [r for batch in pool.map(_client, jobs) for r in batch]
+        elapsed = time.time() - start
+        pids = _children(proc.pid)
+        pss = [_pss_kb(pid) for pid in pids]
+    finally:
+        proc.terminate()
+        proc.wait()
+        log.close()
+    ok = [(m, t * 1000.0) for m, s, t in results if s == 200]
+    latencies = sorted(t for _, t in ok)
+    return {
+        'requests': len(results),
+        'ok': len(ok),
+        'failed': len(results) - len(ok),
+        'statuses': dict(Counter(str(s) for _, s, _ in results)),
+        'requests_per_sec': round(len(ok) / elapsed, 1),
+        'logins_per_sec': round(sum(1 for m, _ in ok if m == 'POST') / elapsed, 1),
+        'latency_ms': {p: round(_percentile(latencies, int(p[1:])), 2) for p in ('p50', 'p95', 'p99')} if latencies else None,
+        'workers_pss_kb': sum(p for p in pss if p) or None,
+    }
+
+
+def main():
+    cpus = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', default=','.join(str(n) for n in sorted({1, 2, cpus // 2 or 1, cpus})),
+                        help='comma-separated worker counts (default: 1, 2, half and all of the CPUs)')
+    parser.add_argument('--seconds', type=float, default=10.0)
+    parser.add_argument('--clients', type=int, default=max(1, cpus // 4), help='client processes')
+    parser.add_argument('--concurrency', type=int, default=16, help='connections per client process')
+    parser.add_argument('--login-share', type=float, default=0.1)
+    parser.add_argument('--logins', type=int, default=200, help='users given a password')
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--out')
+    parser.add_argument('--seed', type=int, default=24)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'prefork.db')
+    os.environ.update({'DB_ENGINE': 'sqlite', 'DB_PATH': path, 'SESSION_SECRET': 'bench-prefork-secret'})
+    import app
+    app.init_db()
+    generate(app, args.rows, args.seed)
+    db = app.DBProxy(None, 'sqlite')
+    try:
+        db.execute('UPDATE users SET password_hash = ? WHERE id <= ?', (app.hash_password(PASSWORD), args.logins))
+        db.commit()
+        categories = [r['id'] for r in db.execute('SELECT id FROM categories').fetchall()]
+    finally:
+        db.close()
+    app.get_pool().close()
+
+    # one hash thread per worker keeps login CPU inside the worker that took the request
+    env = dict(os.environ, PASSWORD_HASH_WORKERS='1', PASSWORD_HASH_QUEUE='1000', LOGIN_MAX_ATTEMPTS_PER_IP='100000000')
+    counts = [int(n) for n in args.workers.split(',')]
+    report = {'meta': {'commit': _git_commit()[0], 'cpus': cpus, 'seconds': args.seconds, 'clients': args.clients,
+                       'concurrency': args.concurrency, 'login_share': args.login_share,
+                       'hash_method': app.PASSWORD_HASH_METHOD, 'rows': args.rows},
+              'workers': {}}
+    try:
+        for n in counts:
+            out = report['workers'][str(n)] = run_workers(n, args, env, categories)
+            base = report['workers'][str(counts[0])]
+            out['speedup'] = round(out['requests_per_sec'] / base['requests_per_sec'], 2) if base['requests_per_sec'] else None
+            out['efficiency'] = round(out['speedup'] * counts[0] / n, 2) if out['speedup'] else None
+            print(f"{n} workers: {out['requests_per_sec']} req/s ({out['logins_per_sec']} logins/s), "
+                  f"x{out['speedup']}, p99 {(out['latency_ms'] or {}).get('p99')} ms, {out['failed']} failed",
+                  file=sys.stderr)
+    finally:
+        shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(text)
+    print(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,125 @@
+"""Latency benchmark for the in-process medicine search index.
+
+Builds a synthetic catalog (default 100k SKUs) straight into SearchIndex and times a
+mix of prefix, multi-token and misspelled queries. Exits non-zero when p99 exceeds
+the budget, so it can gate CI:
+
+    python backend/bench_search.py --skus 100000 --budget-ms 10
+"""
+import argparse
+import json
+import random
+import statistics
+import time
+
+from app import SearchIndex
+
+GENERICS = [
+    'paracetamol', 'ibuprofen', 'amoxicillin', 'metformin', 'atorvastatin', 'cholecalciferol', 'azithromycin',
+    'cetirizine', 'omeprazole', 'pantoprazole', 'losartan', 'amlodipine', 'telmisartan', 'rosuvastatin',
+    'levothyroxine', 'montelukast', 'doxycycline', 'ciprofloxacin', 'clopidogrel', 'glimepiride', 'sitagliptin',
+    'diclofenac', 'aceclofenac', 'ranitidine', 'domperidone', 'ondansetron', 'levocetirizine', 'fexofenadine',
+    'prednisolone', 'hydroxychloroquine', 'metoprolol', 'bisoprolol', 'furosemide', 'spironolactone',
+    'warfarin', 'aspirin', 'salbutamol', 'budesonide', 'insulin', 'vildagliptin', 'linagliptin', 'dapagliflozin',
+    'empagliflozin', 'esomeprazole', 'rabeprazole', 'sertraline', 'escitalopram', 'fluoxetine', 'gabapentin',
+    'pregabalin', 'tramadol', 'cefixime', 'cefuroxime', 'ofloxacin', 'norfloxacin', 'tinidazole', 'fluconazole',
+]
+CATEGORIES = ['Pain Relief', 'Antibiotic', 'Diabetes', 'Vitamins', 'Cardiovascular', 'Antiseptic', 'Digestive', 'Prescription']
+FORMS = ['Tablets', 'Capsules', 'Syrup', 'Injection', 'Gel', 'Drops', 'Suspension']
+STRENGTHS = ['5mg', '10mg', '20mg', '40mg', '50mg', '100mg', '250mg', '400mg', '500mg', '650mg', '1000mg']
+SYLLABLES = ['ra', 'no', 'vi', 'ka', 'zen', 'med', 'pha', 'cor', 'lix', 'tro', 'sun', 'cip', 'lu', 'pin', 'dro', 'max']
+
+
+def make_brands(seed):
+    rnd = random.Random(seed)
+    return sorted({''.join(rnd.choice(SYLLABLES) for _ in range(rnd.randint(2, 3))).capitalize() for _ in range(3000)})
+
+
+def make_docs(n, seed, brands):
+    rnd = random.Random(seed)
+    for i in range(1, n + 1):
+        generic = rnd.choice(GENERICS)
+        brand = rnd.choice(brands)
+        yield {
+            'id': i,
+            'slug': f'sku-{i}',
+            'name': f'{brand} {generic.capitalize()} {rnd.choice(STRENGTHS)} {rnd.choice(FORMS)}',
+            'generic_name': generic.capitalize(),
+            'brand': brand,
+            'category_name': rnd.choice(CATEGORIES),
+            'price': round(rnd.uniform(10, 2000), 2),
+        }
+
+
+def make_queries(rnd, count, brands):
+    queries = []
+    for _ in range(count):
+        generic = rnd.choice(GENERICS)
+        kind = rnd.randrange(4)
+        if kind == 0:
+            queries.append(generic[:rnd.randint(2, 5)])                      # autocomplete prefix
+        elif kind == 1:
+            queries.append(f'{generic} {rnd.choice(STRENGTHS)[:2]}')          # token + prefix
+        elif kind == 2:
+            i = rnd.randrange(1, len(generic) - 1)
+            queries.append(generic[:i] + generic[i + 1:])                    # typo (deletion)
+        else:
+            queries.append(f'{rnd.choice(brands).lower()} {generic[:4]}')      # brand + prefix
+    return queries
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100.0 * (len(values) - 1))))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--skus', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--limit', type=int, default=10)
+    parser.add_argument('--budget-ms', type=float, default=10.0)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    brands = make_brands(args.seed)
+    start = time.perf_counter()
+    index = SearchIndex.build(make_docs(args.skus, args.seed, brands))
+    build_s = time.perf_counter() - start
+
+    # incremental path: re-upsert a slice of the catalog the way writers do
+    start = time.perf_counter()
+    for doc in make_docs(min(args.skus, 1000), args.seed + 2, brands):
+        index.upsert(doc)
+    upsert_ms = (time.perf_counter() - start) * 1000.0 / min(args.skus, 1000)
+
+    queries = make_queries(random.Random(args.seed + 1), args.queries, brands)
+    for q in queries[:50]:
+        index.search(q, args.limit)
+    timings, empty = [], 0
+    for q in queries:
+        t0 = time.perf_counter()
+        hits = index.search(q, args.limit)
+        timings.append((time.perf_counter() - t0) * 1000.0)
+        empty += not hits
+
+    report = {
+        'skus': args.skus,
+        'build_seconds': round(build_s, 2),
+        'upsert_ms': round(upsert_ms, 3),
+        'queries': len(timings),
+        'empty_results': empty,
+        'p50_ms': round(percentile(timings, 50), 3),
+        'p95_ms': round(percentile(timings, 95), 3),
+        'p99_ms': round(percentile(timings, 99), 3),
+        'max_ms': round(max(timings), 3),
+        'mean_ms': round(statistics.mean(timings), 3),
+        'budget_ms': args.budget_ms,
+    }
+    print(json.dumps(report, indent=2))
+    if report['p99_ms'] > args.budget_ms:
+        raise SystemExit(f"p99 {report['p99_ms']}ms exceeds the {args.budget_ms}ms budget")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+"""Prefork serving mode for backend/app.py: one master process, N forked workers.
+
+    python backend/prefork.py --workers 4 --bind 0.0.0.0:5000
+
+The master binds the socket, runs init_db() and the warm-up (search and slot indexes,
+WARMUP_PATHS in the response cache) once, builds the shared catalog snapshot, closes its
+database connections and forks. Workers inherit the warmed state copy-on-write
+(gc.freeze() keeps the collector from writing to those pages), open their own
+connections on first use and serve the shared socket with werkzeug's threaded server.
+What they share after that is in app.SharedState: catalog writes and logouts made in
+one worker reach the others, and catalog list bodies are read from one memory-mapped
+snapshot. The master restarts workers that die. SIGTERM or SIGINT stops them after
+their in-flight requests, killing any still busy after --graceful-timeout seconds.
+"""
+import argparse
+import gc
+import os
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+import traceback
+
+from werkzeug.serving import make_server
+
+import app as flask_app
+from app import _env_float, _env_int
+
+PREFORK_WORKERS = _env_int('PREFORK_WORKERS', os.cpu_count() or 1)
+PREFORK_GRACEFUL_TIMEOUT = _env_float('PREFORK_GRACEFUL_TIMEOUT', 30.0)
+
+
+def _log(message, *args):
+    print(f'[prefork {os.getpid()}] ' + message % args, file=sys.stderr, flush=True)
+
+
+def serve(sock, host, port):
+    # worker process: never returns
+    code = 0
+    try:
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)  # not the master's handlers
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        flask_app.after_fork()
+        flask_app.job_queue.start()
+        server = make_server(host, port, flask_app.app, threaded=True, fd=sock.fileno())
+        server.daemon_threads = False  # so server_close() waits for in-flight requests
+
+        def stop(signum, frame):
+            threading.Thread(target=server.shutdown, daemon=True).start()
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+        server.serve_forever()
+        server.server_close()
+    except BaseException:
+        traceback.print_exc()
+        code = 1
+    finally:
+        os._exit(code)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=PREFORK_WORKERS)
+    parser.add_argument('--bind', default='0.0.0.0:5000')
+    parser.add_argument('--backlog', type=int, default=2048)
+    parser.add_argument('--graceful-timeout', type=float, default=PREFORK_GRACEFUL_TIMEOUT)
+    parser.add_argument('--shared-dir', default=os.environ.get('PREFORK_SHARED_DIR'),
+                        help='directory for the catalog snapshot and revocation log (default: a new one in /dev/shm)')
+    args = parser.parse_args()
+    host, _, port = args.bind.rpartition(':')
+    host, port = host.strip('[]') or '0.0.0.0', int(port)
+
+    sock = socket.create_server((host, port), family=socket.AF_INET6 if ':' in host else socket.AF_INET,
+                                backlog=args.backlog)
+    shared_dir = args.shared_dir or tempfile.mkdtemp(prefix='genricycle-prefork-',
+                                                     dir='/dev/shm' if os.path.isdir('/dev/shm') else None)
+    own_dir = args.shared_dir is None
+    workers, stopping = {}, []
+    try:
+        t0 = time.perf_counter()
+        flask_app.init_db()
+        if flask_app.start_warmup(background=False) != 'ready':
+            _log('warm-up failed: %s', flask_app._warmup['error'])
+            return 1
+        flask_app.share_between_workers(shared_dir)
+        flask_app.before_fork()
+        gc.collect()
+        gc.freeze()
+        _log('warmed up in %.2fs; %d workers on %s:%d', time.perf_counter() - t0, args.workers, host, port)
+
+        def spawn():
+            pid = os.fork()
+            if pid == 0:
+                serve(sock, host, port)
+            workers[pid] = time.monotonic()
+
+        def stop(signum, frame):
+            if not stopping:
+                stopping.append(time.monotonic() + args.graceful_timeout)
+                for pid in workers:
+                    try:
+                        os.kill(pid, signal.SIGTERM)
+                    except ProcessLookupError:
+                        pass
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+        for _ in range(args.workers):
+            spawn()
+        while workers:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                if stopping and time.monotonic() > stopping[0]:
+                    for pid in workers:
+                        try:
+                            os.kill(pid, signal.SIGKILL)
+                        except ProcessLookupError:
+                            pass
+                    stopping[0] = float('inf')
+                time.sleep(0.2)
+                continue
+            started = workers.pop(pid, None)
+            if started is None or stopping:
+                continue
+            _log('worker %d exited with status %d; restarting', pid, os.waitstatus_to_exitcode(status))
+            if time.monotonic() - started < 1.0:
+                time.sleep(1.0)  # don't spin on a worker that dies at startup
+            spawn()
+        return 0
+    finally:
+        sock.close()
+        if own_dir:
+            shutil.rmtree(shared_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,87 @@
+import os
+import sys
+import tempfile
+import threading
+
+import pytest
+
+# app reads its settings at import time: point it at a throwaway SQLite file and keep
+# the background job workers off, the tests run jobs with job_queue.run_once()
+os.environ['DB_ENGINE'] = 'sqlite'
+os.environ['DB_PATH'] = os.path.join(tempfile.mkdtemp(), 'test.db')
+os.environ['JOBS_WORKERS'] = '0'
+os.environ.setdefault('DB_POOL_TIMEOUT', '60')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+
+
+@pytest.fixture(scope='session', autouse=True)
+def schema():
+    app.init_db()
+    db = app.DBProxy(None, app._db_engine())
+    try:
+        app.seed_db(db)
+    finally:
+        db.close()
+
+
+@pytest.fixture
+def db():
+    db = app.DBProxy(None, app._db_engine())
+    yield db
+    db.close()
+
+
+@pytest.fixture
+def client():
+    return app.app.test_client()
+
+
+@pytest.fixture
+def make_user(db, request):
+    # -> (user_id, bearer headers) for a fresh customer, straight into the table
+    made = []
+
+    def make(role='customer'):
+        n = len(made)
+        email = f'{request.node.name}-{n}@example.com'
+        uid = db.execute('INSERT INTO users(name, email, role) VALUES(?, ?, ?)', (f'User {n}', email, role)).lastrowid
+        db.commit()
+        made.append(uid)
+        token = app.issue_token({'id': uid, 'email': email, 'role': role})[0]
+        return uid, {'Authorization': 'Bearer ' + token}
+    return make
+
+
+@pytest.fixture
+def make_medicine(db, request):
+    made = []
+
+    def make(stock, price=10):
+        slug = f'{request.node.name}-{len(made)}'.lower().replace('_', '-')
+        mid = db.execute('INSERT INTO medicines(slug, name, price, stock) VALUES(?, ?, ?, ?)',
+                         (slug, f'Test {slug}', price, stock)).lastrowid
+        db.commit()
+        made.append(mid)
+        return mid
+    return make
+
+
+@pytest.fixture
+def race():
+    # race(n, fn) runs fn(i) on n threads released together -> list of results
+    def run_all(n, fn):
+        barrier = threading.Barrier(n)
+        results = [None] * n
+
+        def run(i):
+            barrier.wait()
+            results[i] = fn(i)
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(n)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return results
+    return run_all
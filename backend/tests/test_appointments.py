@@ -0,0 +1,40 @@
+from collections import Counter
+
+import app
+
+
+def _free_slot(client):
+    items = client.get('/api/slots?limit=1').get_json()['items']
+    assert items, 'seeded doctors have no free slots'
+    return items[0]['id'], items[0]['start']
+
+
+def test_one_booking_per_slot(client, db, make_user, race):
+    doctor_id, start = _free_slot(client)
+    patients = [make_user()[1] for _ in range(10)]
+
+    def book(i):
+        return app.app.test_client().post('/api/appointments', json={'doctor_id': doctor_id, 'start': start},
+                                          headers=patients[i]).status_code
+    statuses = Counter(race(len(patients), book))
+
+    assert statuses == {201: 1, 409: len(patients) - 1}
+    booked = db.execute("SELECT COUNT(*) AS n FROM appointments WHERE doctor_id = ? AND booked_slot = ? AND status = 'scheduled'",
+                        (doctor_id, start)).fetchone()['n']
+    assert booked == 1
+
+
+def test_cancelled_slot_can_be_booked_again(client, make_user):
+    doctor_id, start = _free_slot(client)
+    _, first = make_user()
+    _, second = make_user()
+    resp = client.post('/api/appointments', json={'doctor_id': doctor_id, 'start': start}, headers=first)
+    assert resp.status_code == 201
+    assert client.post('/api/appointments', json={'doctor_id': doctor_id, 'start': start}, headers=second).status_code == 409
+    assert client.post(f"/api/appointments/{resp.get_json()['id']}/cancel", headers=first).status_code == 200
+    assert client.post('/api/appointments', json={'doctor_id': doctor_id, 'start': start}, headers=second).status_code == 201
+
+
+def test_slot_with_offset_is_accepted(client):
+    resp = client.get('/api/slots?after=2030-01-01T00:00:00%2B00:00&limit=1')
+    assert resp.status_code == 200
@@ -0,0 +1,38 @@
+from collections import Counter
+
+import app
+
+
+def test_concurrent_checkout_never_oversells(db, make_user, make_medicine, race):
+    stock = 7
+    hot = make_medicine(stock)
+    other = make_medicine(1000, price=5)
+    buyers = [make_user()[1] for _ in range(20)]
+
+    def buy(i):
+        items = [{'medicine_id': other, 'quantity': 1}, {'medicine_id': hot, 'quantity': 1}]
+        return app.app.test_client().post('/api/checkout', json={'items': items}, headers=buyers[i]).status_code
+    statuses = Counter(race(len(buyers), buy))
+
+    assert statuses == {201: stock, 409: len(buyers) - stock}
+    assert db.execute('SELECT stock FROM medicines WHERE id = ?', (hot,)).fetchone()['stock'] == 0
+    sold = db.execute('SELECT COALESCE(SUM(quantity), 0) AS n FROM order_items WHERE medicine_id = ?', (hot,)).fetchone()['n']
+    assert sold == stock
+    # a refused cart leaves no trace, not even on the SKU that was in stock
+    assert db.execute('SELECT stock FROM medicines WHERE id = ?', (other,)).fetchone()['stock'] == 1000 - stock
+
+
+def test_checkout_larger_than_stock_is_refused(client, db, make_user, make_medicine):
+    mid = make_medicine(2)
+    _, headers = make_user()
+    resp = client.post('/api/checkout', json={'items': [{'medicine_id': mid, 'quantity': 3}]}, headers=headers)
+    assert resp.status_code == 409
+    assert resp.get_json()['medicine_id'] == mid
+    assert db.execute('SELECT stock FROM medicines WHERE id = ?', (mid,)).fetchone()['stock'] == 2
+
+
+def test_checkout_unknown_medicine_is_404(client, make_user):
+    _, headers = make_user()
+    resp = client.post('/api/checkout', json={'items': [{'medicine_id': 10 ** 9}]}, headers=headers)
+    assert resp.status_code == 404
+    assert resp.get_json()['medicine_ids'] == [10 ** 9]
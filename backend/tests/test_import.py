@@ -0,0 +1,26 @@
+import app
+
+
+def _low_stock(db, prefix):
+    return dict((r['medicine_id'], r['stock']) for r in db.execute(
+        'SELECT l.medicine_id, l.stock FROM low_stock l JOIN medicines m ON m.id = l.medicine_id WHERE m.slug LIKE ?',
+        (prefix + '%',)).fetchall())
+
+
+def test_import_keeps_low_stock_in_step(db):
+    threshold = app.LOW_STOCK_THRESHOLD
+    rows = [(i, {'slug': f'imp-{i}', 'name': f'Import {i}', 'price': '5', 'stock': str(i * 7 % (threshold * 2))})
+            for i in range(1, 40)]
+    app.import_catalog(db, 'medicines', rows, batch_size=8)
+    # restock some, sell out others, leave the rest alone (a price-only change)
+    changes = [(i, {'slug': f'imp-{i}', 'name': f'Import {i}', 'price': '6',
+                    **({'stock': str(threshold * 3 if i % 2 else 0)} if i % 3 == 0 else {})})
+               for i in range(1, 40)]
+    report = app.import_catalog(db, 'medicines', changes, batch_size=8)
+    assert report['updated'] == 39
+
+    synced = _low_stock(db, 'imp-')
+    app.rebuild_low_stock(db)
+    db.commit()
+    assert synced == _low_stock(db, 'imp-')
+    assert synced and all(stock < threshold for stock in synced.values())
@@ -0,0 +1,131 @@
+import threading
+from collections import Counter
+
+import app
+
+
+def _ledger_sum(db, user_id):
+    return db.execute('SELECT COALESCE(SUM(delta), 0) AS n FROM reward_ledger WHERE user_id = ?', (user_id,)).fetchone()['n']
+
+
+def _run_jobs(db):
+    while app.job_queue.run_once(db):
+        pass
+
+
+def test_ledger_sum_equals_balance(client, db, make_user, make_medicine):
+    user_id, headers = make_user()
+    mid = make_medicine(100, price=250)
+    for qty in (1, 2, 3):
+        assert client.post('/api/checkout', json={'items': [{'medicine_id': mid, 'quantity': qty}]},
+                           headers=headers).status_code == 201
+    _run_jobs(db)
+    earned = _ledger_sum(db, user_id)
+    assert earned == 25 + 50 + 75
+    assert app.reward_balance(db, user_id) == earned
+
+    resp = client.post('/api/rewards/redeem', json={'points': 40}, headers=headers)
+    assert resp.status_code == 201 and resp.get_json()['balance'] == earned - 40
+    app.compact_reward_balances(db)
+    resp = client.post('/api/rewards/redeem', json={'points': 10}, headers=headers)
+    assert resp.status_code == 201
+
+    balance = client.get('/api/rewards', headers=headers).get_json()['balance']
+    assert balance == _ledger_sum(db, user_id) == app.reward_balance(db, user_id) == earned - 50
+    # accruals point at the order's payment transaction
+    assert db.execute("SELECT COUNT(*) AS n FROM reward_ledger WHERE user_id = ? AND reason = 'order_accrual' "
+                      "AND transaction_id IS NULL", (user_id,)).fetchone()['n'] == 0
+
+
+def test_concurrent_redemptions_never_overdraw(db, make_user, race):
+    user_id, headers = make_user()
+    db.execute('INSERT INTO reward_ledger(user_id, delta, reason) VALUES(?, ?, ?)', (user_id, 100, 'test'))
+    db.commit()
+
+    def redeem(i):
+        return app.app.test_client().post('/api/rewards/redeem', json={'points': 30}, headers=headers).status_code
+    statuses = Counter(race(8, redeem))
+
+    assert statuses == {201: 3, 409: 5}
+    assert app.reward_balance(db, user_id) == _ledger_sum(db, user_id) == 10
+
+
+def test_accrual_is_not_repeated(client, db, make_user, make_medicine):
+    user_id, headers = make_user()
+    mid = make_medicine(10, price=100)
+    order_id = client.post('/api/checkout', json={'items': [{'medicine_id': mid}]}, headers=headers).get_json()['order_id']
+    _run_jobs(db)
+    assert app.credit_order_points(db, [order_id]) == 0
+    db.commit()
+    assert _ledger_sum(db, user_id) == 10
+
+
+def test_redemption_reason_is_set_by_the_server(client, db, make_user):
+    user_id, headers = make_user()
+    db.execute('INSERT INTO reward_ledger(user_id, delta, reason) VALUES(?, ?, ?)', (user_id, 50, 'test'))
+    db.commit()
+    resp = client.post('/api/rewards/redeem', headers=headers,
+                       json={'points': 20, 'reason': 'order_accrual', 'reward': '<img src=x onerror=alert(1)>'})
+    assert resp.status_code == 201
+    entry = db.execute('SELECT reason, reward FROM reward_ledger WHERE id = ?', (resp.get_json()['entry_id'],)).fetchone()
+    assert (entry['reason'], entry['reward']) == ('redemption', '<img src=x onerror=alert(1)>')
+    newest = client.get('/api/rewards', headers=headers).get_json()['history'][0]
+    assert newest['reason'] == 'redemption' and newest['reward'] == '<img src=x onerror=alert(1)>'
+
+
+def test_compaction_during_writes_loses_nothing(db, make_user, make_medicine):
+    users = [make_user() for _ in range(6)]
+    mid = make_medicine(10 ** 6, price=30)
+    for user_id, _ in users:
+        db.execute('INSERT INTO reward_ledger(user_id, delta, reason) VALUES(?, ?, ?)', (user_id, 1000, 'test'))
+    db.commit()
+    stop = threading.Event()
+
+    def shop(headers):
+        client = app.app.test_client()
+        for _ in range(15):
+            client.post('/api/checkout', json={'items': [{'medicine_id': mid}]}, headers=headers)
+            client.post('/api/rewards/redeem', json={'points': 2}, headers=headers)
+
+    def background(step):
+        own = app.DBProxy(None, app._db_engine())
+        try:
+            while not stop.is_set():
+                step(own)
+        finally:
+            own.close()
+    shoppers = [threading.Thread(target=shop, args=(headers,)) for _, headers in users]
+    helpers = [threading.Thread(target=background, args=(step,)) for step in (app.job_queue.run_once, app.compact_reward_balances)]
+    for t in shoppers + helpers:
+        t.start()
+    for t in shoppers:
+        t.join()
+    stop.set()
+    for t in helpers:
+        t.join()
+    _run_jobs(db)
+
+    for user_id, _ in users:
+        assert app.reward_balance(db, user_id) == _ledger_sum(db, user_id)
+    app.compact_reward_balances(db)
+    for user_id, _ in users:
+        snap = db.execute('SELECT points_balance, ledger_id FROM reward_points WHERE user_id = ?', (user_id,)).fetchone()
+        last = db.execute('SELECT MAX(id) AS id FROM reward_ledger WHERE user_id = ?', (user_id,)).fetchone()['id']
+        assert (snap['points_balance'], snap['ledger_id']) == (_ledger_sum(db, user_id), last)
+        assert _ledger_sum(db, user_id) == 1000 + 15 * 3 - 15 * 2
+
+
+def test_writes_keep_the_snapshot_current(client, db, make_user, make_medicine):
+    user_id, headers = make_user()
+    mid = make_medicine(10, price=100)
+    client.post('/api/checkout', json={'items': [{'medicine_id': mid}]}, headers=headers)
+    _run_jobs(db)
+
+    def pending():
+        return db.execute('SELECT COUNT(*) AS n FROM reward_ledger l JOIN reward_points r ON r.user_id = l.user_id '
+                          'WHERE l.user_id = ? AND l.id > r.ledger_id', (user_id,)).fetchone()['n']
+    assert pending() == 0
+    assert client.post('/api/rewards/redeem', json={'points': 4}, headers=headers).status_code == 201
+    assert pending() == 0
+    snap = db.execute('SELECT points_balance FROM reward_points WHERE user_id = ?', (user_id,)).fetchone()
+    assert snap['points_balance'] == _ledger_sum(db, user_id) == 6
@@ -0,0 +1,78 @@
+import json
+
+import pytest
+
+import app
+
+# one gated endpoint per *_ROLES setting
+STAFF_ONLY = [
+    ('get', '/api/jobs'),                            # JOBS_ROLES
+    ('post', '/api/import/medicines'),               # IMPORT_ROLES
+    ('post', '/api/deliveries/assign'),              # DISPATCH_ROLES
+    ('get', '/api/dashboard/low-stock'),             # DASHBOARD_ROLES
+]
+
+
+def _signup(client, email, **extra):
+    resp = client.post('/api/auth/signup', json={'email': email, 'password': 'correct horse', **extra})
+    assert resp.status_code == 201
+    return resp.get_json()
+
+
+def _login(client, email):
+    resp = client.post('/api/auth/login', json={'email': email, 'password': 'correct horse'})
+    assert resp.status_code == 200
+    return {'Authorization': 'Bearer ' + resp.get_json()['token']}
+
+
+def test_signup_ignores_role(client, db):
+    body = _signup(client, 'wannabe-admin@example.com', role='admin')
+    assert body['user']['role'] == 'customer'
+    assert app.verify_token(body['token'])['role'] == 'customer'
+    assert db.execute('SELECT role FROM users WHERE email = ?', ('wannabe-admin@example.com',)).fetchone()['role'] == 'customer'
+
+
+def test_user_upsert_never_sets_role(client, db):
+    client.post('/api/user', json={'email': 'upsert@example.com', 'role': 'admin'})
+    assert db.execute('SELECT role FROM users WHERE email = ?', ('upsert@example.com',)).fetchone()['role'] == 'customer'
+    db.execute("UPDATE users SET role = 'finance' WHERE email = ?", ('upsert@example.com',))
+    db.commit()
+    client.post('/api/user', json={'email': 'upsert@example.com', 'name': 'Renamed', 'role': 'admin'})
+    assert db.execute('SELECT role FROM users WHERE email = ?', ('upsert@example.com',)).fetchone()['role'] == 'finance'
+
+
+@pytest.mark.parametrize('method,path', STAFF_ONLY)
+def test_staff_endpoints_refuse_customers(client, make_user, method, path):
+    assert getattr(client, method)(path).status_code == 401
+    _, headers = make_user()
+    assert getattr(client, method)(path, headers=headers).status_code == 403
+
+
+def test_set_role_grants_admin_at_next_login(client):
+    body = _signup(client, 'promoted@example.com')
+    old = {'Authorization': 'Bearer ' + body['token']}
+    result = app.app.test_cli_runner().invoke(args=['set-role', 'promoted@example.com', 'admin'])
+    assert result.exit_code == 0, result.output
+    assert client.get('/api/jobs', headers=old).status_code == 403
+    assert client.get('/api/jobs', headers=_login(client, 'promoted@example.com')).status_code == 200
+
+
+def test_set_role_unknown_user_fails():
+    result = app.app.test_cli_runner().invoke(args=['set-role', 'nobody@example.com', 'admin'])
+    assert result.exit_code != 0
+
+
+def test_export_is_own_rows_unless_export_role(client, make_user, make_medicine):
+    mid = make_medicine(10)
+    buyer_id, buyer = make_user()
+    other_id, other = make_user()
+    _, finance = make_user('finance')
+    for headers in (buyer, other):
+        assert client.post('/api/checkout', json={'items': [{'medicine_id': mid}]}, headers=headers).status_code == 201
+
+    def owners(headers, **args):
+        resp = client.get('/api/export/orders', query_string=args, headers=headers)
+        assert resp.status_code == 200
+        return {json.loads(line)['user_id'] for line in resp.get_data(as_text=True).splitlines() if line}
+    assert owners(buyer, user_id=other_id) == {buyer_id}
+    assert owners(finance, user_id=other_id) == {other_id}